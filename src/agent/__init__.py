@@ -0,0 +1,15 @@
+"""The ordering agent.
+
+Importing the package is cheap; the compiled graphs are loaded on first use:
+
+    from agent import app, warmup
+"""
+
+
+def __getattr__(name):
+    # PEP 562: agent.workflow imports langgraph and compiles the graphs.
+    if name in ("app", "async_app", "warmup"):
+        from agent import workflow
+
+        return getattr(workflow, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,196 @@
+import asyncio
+import logging
+from sqlalchemy import select, text
+from langchain_core.runnables import RunnableConfig
+from agent.state import AgentState
+from agent.utils import get_schema_snapshot
+from agent.llm import ainvoke_llm
+from agent.sql_utils import aexplain_error, afetch_bounded, is_select
+from agent.cache import CachedUser, user_cache
+from agent.orders import OrderPending, order_writer
+from agent.results import result_cache
+from agent.validation import acheck_plan, astatement_timeout, check_sql
+from agent.nodes import (
+    REGENERATE_MODE,
+    answer_from_menu,
+    answer_generators,
+    answer_inputs,
+    answer_kind,
+    apply_order_error,
+    apply_order_pending,
+    apply_order_result,
+    apply_regenerated_sql,
+    apply_rewritten_question,
+    apply_select_result,
+    apply_sql_error,
+    apply_write_result,
+    cached_current_user,
+    funny_responder,
+    lookup_cached_sql,
+    menu_sql_generator,
+    order_sql_generator,
+    order_sql_inputs,
+    pre_classify_relevance,
+    record_sql_outcome,
+    relevance_checker,
+    render_template_answer,
+    repair_chains,
+    repair_inputs,
+    repairer,
+    rewriter,
+    set_current_user,
+    structured_order,
+)
+from database import database
+from database.database import AsyncSessionLocal
+from database.models import User
+
+logger = logging.getLogger(__name__)
+
+# Async counterparts of the nodes in agent.nodes. They share prompts, chains and
+# state handling with the sync nodes but await the LLM and the database, so one
+# event loop can carry many conversations.
+
+
+async def aget_current_user(state: AgentState, config: RunnableConfig):
+    logger.info("Retrieving the current user based on user ID.")
+    user_id = config["configurable"].get("current_user_id", None)
+    if not user_id:
+        state["current_user"] = "User not found"
+        logger.info("No user ID provided in the configuration.")
+        return state
+
+    try:
+        user_id = int(user_id)
+        if cached_current_user(state, user_id):
+            return state
+        version = user_cache.version()
+        async with AsyncSessionLocal() as session:
+            user = (await session.execute(select(User).where(User.id == user_id))).scalars().first()
+        user = CachedUser.from_model(user)
+        user_cache.set(user_id, user, version)
+        set_current_user(state, user)
+    except Exception as e:
+        state["current_user"] = "Error retrieving user"
+        logger.warning(f"Error retrieving user: {str(e)}")
+    return state
+
+
+async def acheck_relevance(state: AgentState, config: RunnableConfig):
+    if await asyncio.to_thread(pre_classify_relevance, state):
+        return state
+    snapshot = await asyncio.to_thread(get_schema_snapshot, database.engine)
+    schema = snapshot.for_question(state["question"])
+    relevance = await ainvoke_llm(relevance_checker, {"schema": schema, "question": state["question"]})
+    state["relevance"] = relevance.relevance
+    logger.info(f"Relevance determined: {state['relevance']}")
+    return state
+
+
+async def aconvert_nl_to_sql(state: AgentState, config: RunnableConfig):
+    question = state["question"]
+    current_user = state["current_user"]
+    if await asyncio.to_thread(structured_order, state) or await asyncio.to_thread(answer_from_menu, state):
+        return state
+    snapshot = await asyncio.to_thread(get_schema_snapshot, database.engine)
+    if await asyncio.to_thread(lookup_cached_sql, state, snapshot):
+        return state
+    schema = snapshot.for_question(question)
+    logger.info(f"Converting question to SQL for user '{current_user}': {question}")
+    if state["relevance"].lower() == "order":
+        result = await ainvoke_llm(order_sql_generator, order_sql_inputs(state, schema))
+        logger.info(f"Generated SQL query: {result.sql_query}")
+    else:
+        result = await ainvoke_llm(menu_sql_generator, {"schema": schema, "question": question})
+        logger.info(f"Generated SQL query for menu: {result.sql_query}")
+    state["sql_query"] = result.sql_query
+    return state
+
+
+async def aexecute_sql(state: AgentState):
+    sql_query = state["sql_query"].strip()
+    if state.get("order_action"):
+        logger.info(f"Placing order through the order writer: {sql_query}")
+        try:
+            apply_order_result(state, await order_writer.aplace(state["order_action"]))
+        except OrderPending as e:
+            apply_order_pending(state, e)
+        except Exception as e:
+            apply_order_error(state, e)
+        return await asyncio.to_thread(record_sql_outcome, state, sql_query)
+    logger.info(f"Executing SQL query: {sql_query}")
+    try:
+        snapshot = await asyncio.to_thread(get_schema_snapshot, database.engine)
+        check_sql(sql_query, snapshot.tables, state.get("relevance"))
+        cached = result_cache.get(sql_query) if is_select(sql_query) else None
+        if cached is not None:
+            logger.info("Serving the SELECT result from the result cache.")
+            apply_select_result(state, *cached)
+            return await asyncio.to_thread(record_sql_outcome, state, sql_query)
+        async with AsyncSessionLocal(read=is_select(sql_query)) as session:
+            async with astatement_timeout(session):
+                await acheck_plan(session, sql_query)
+                if is_select(sql_query):
+                    versions = result_cache.versions(sql_query)
+                    result = await afetch_bounded(session, sql_query)
+                    result_cache.set(sql_query, result, versions)
+                    apply_select_result(state, *result)
+                else:
+                    await session.execute(text(sql_query))
+            if not is_select(sql_query):
+                await session.commit()
+                result_cache.invalidate(sql_query)
+                apply_write_result(state)
+    except Exception as e:
+        apply_sql_error(state, e)
+    return await asyncio.to_thread(record_sql_outcome, state, sql_query)
+
+
+async def agenerate_human_readable_answer(state: AgentState, config: RunnableConfig):
+    logger.info("Generating a human-readable answer.")
+    kind = answer_kind(state)
+    if render_template_answer(state, kind):
+        return state
+    state["query_result"] = await ainvoke_llm(answer_generators[kind], answer_inputs(state), config)
+    logger.info("Generated human-readable answer.")
+    return state
+
+
+async def apick_candidate(state: AgentState, candidates):
+    candidates = list(dict.fromkeys(c.strip() for c in candidates if c and c.strip()))
+    snapshot = await asyncio.to_thread(get_schema_snapshot, database.engine)
+    for candidate in candidates:
+        try:
+            check_sql(candidate, snapshot.tables, state.get("relevance"))
+        except Exception as e:
+            logger.info(f"Candidate rejected ({str(e)}): {candidate}")
+            continue
+        async with AsyncSessionLocal(read=is_select(candidate)) as session:
+            error = await aexplain_error(session, candidate)
+        if error is None:
+            logger.info(f"Picked a valid candidate out of {len(candidates)}: {candidate}")
+            return candidate
+        logger.info(f"Candidate rejected by EXPLAIN ({error}): {candidate}")
+    return candidates[0] if candidates else ""
+
+
+async def aregenerate_query(state: AgentState):
+    if REGENERATE_MODE in ("repair", "speculative"):
+        inputs = await asyncio.to_thread(repair_inputs, state)
+        chains = repair_chains if REGENERATE_MODE == "speculative" else [repairer]
+        logger.info(f"Repairing the failed SQL query with {len(chains)} candidate(s).")
+        results = await asyncio.gather(*(ainvoke_llm(chain, inputs) for chain in chains))
+        candidates = [result.sql_query for result in results]
+        if len(candidates) > 1:
+            return apply_regenerated_sql(state, await apick_candidate(state, candidates))
+        return apply_regenerated_sql(state, candidates[0])
+    logger.info("Regenerating the SQL query by rewriting the question.")
+    rewritten = await ainvoke_llm(rewriter, {"question": state["question"]})
+    return apply_rewritten_question(state, rewritten.question)
+
+
+async def agenerate_funny_response(state: AgentState, config: RunnableConfig):
+    logger.info("Generating a funny response for an unrelated question.")
+    state["query_result"] = await ainvoke_llm(funny_responder, {"question": state["question"]}, config)
+    logger.info("Generated funny response.")
+    return state
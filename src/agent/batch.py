@@ -0,0 +1,318 @@
+"""Answer many questions with the agent graph, for replay and regression runs.
+
+    cd src
+    python -m agent.batch questions.jsonl -o answers.jsonl --concurrency 8
+
+Each input line is a JSON object with "question" and optionally "id",
+"user_id" and "confirm" ("yes", "no" or "skip" for the order confirmation).
+Plain-text lines are taken as questions. Output is one JSON object per answered
+question, appended as results complete; rerunning with the same output file
+skips ids that are already there. A summary goes to stderr.
+
+Order confirmations are left unanswered unless --confirm yes (or a record's
+"confirm") says otherwise: a confirmed order is written to DATABASE_URL, so
+only confirm when replaying against a copy of the database. On Ctrl-C the
+questions already running are finished and written before the runner stops,
+so a rerun does not place their orders again.
+
+From Python:
+
+    from agent.batch import run_batch
+    for result in run_batch([{"question": "show me the menu", "user_id": 2}]):
+        ...
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from agent.cache import normalize_question
+from agent.sql_utils import is_select
+
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "4"))
+# How to answer the confirm_order interrupt: "yes", "no" or "skip" (leave it unanswered).
+# "yes" places real orders in DATABASE_URL.
+BATCH_CONFIRM = os.getenv("BATCH_CONFIRM", "skip")
+CONFIRM_REPLIES = {"yes": "Yes", "no": "No"}
+RESULT_FIELDS = ("relevance", "sql_query", "row_count", "rows_truncated", "sql_error", "attempts")
+
+
+def batch_graph():
+    """The agent graph with an in-memory checkpointer, so replays leave the SQLite store alone."""
+    from langgraph.checkpoint.memory import InMemorySaver
+    from agent.workflow import workflow
+
+    return workflow.compile(checkpointer=InMemorySaver())
+
+
+def read_records(lines, default_user_id=None):
+    """Turn JSONL (or plain-text) lines into records with an id, question and user_id."""
+    for number, line in enumerate(lines, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line) if line.startswith("{") else {"question": line}
+        except json.JSONDecodeError as e:
+            record = {"question": None, "error": f"invalid JSON: {e}"}
+        record.setdefault("question", None)
+        record.setdefault("id", f"line-{number}")
+        record["id"] = str(record["id"])
+        record.setdefault("user_id", default_user_id)
+        yield record
+
+
+def completed_ids(path):
+    """Ids already written to an output file, for resuming an interrupted run."""
+    if not path or not os.path.exists(path):
+        return set()
+    done = set()
+    with open(path) as f:
+        for line in f:
+            try:
+                done.add(str(json.loads(line)["id"]))
+            except (ValueError, KeyError):
+                continue
+    return done
+
+
+def dedupe_key(record):
+    if not record["question"] or record.get("error"):
+        return record["id"]
+    return normalize_question(record["question"]), str(record.get("user_id")), record.get("confirm")
+
+
+def effective_confirm(record, confirm=BATCH_CONFIRM):
+    return (record.get("confirm") or confirm).lower()
+
+
+def wrote(result, confirm):
+    """Whether answering ran a confirmed write, e.g. placed an order; such answers are never reused."""
+    sql_query = result.get("sql_query")
+    return confirm == "yes" and bool(sql_query) and not is_select(sql_query)
+
+
+def answer_record(graph, record, confirm=BATCH_CONFIRM):
+    from langgraph.types import Command
+
+    result = {"id": record["id"], "question": record["question"], "user_id": record.get("user_id")}
+    started = time.perf_counter()
+    thread_id = f"batch-{uuid.uuid4()}"
+    config = {"configurable": {"thread_id": thread_id, "current_user_id": record.get("user_id")}}
+    confirm = effective_confirm(record, confirm)
+    try:
+        if record.get("error") or not record["question"]:
+            raise ValueError(record.get("error") or "missing question")
+        state = graph.invoke({"question": f"user: {record['question']}", "attempts": 0}, config=config)
+        if "__interrupt__" in state and confirm in CONFIRM_REPLIES:
+            state = graph.invoke(Command(resume=CONFIRM_REPLIES[confirm]), config=config)
+        result["answer"] = state.get("query_result")
+        result["interrupted"] = "__interrupt__" in state
+        result.update({field: state.get(field) for field in RESULT_FIELDS})
+        result["error"] = None
+    except Exception as e:
+        result["answer"] = None
+        result["error"] = f"{type(e).__name__}: {e}"
+    finally:
+        graph.checkpointer.delete_thread(thread_id)
+    result["latency_ms"] = round((time.perf_counter() - started) * 1000, 3)
+    return result
+
+
+def run_batch(records, graph=None, concurrency=BATCH_CONCURRENCY, confirm=BATCH_CONFIRM, done=(), dedupe=True):
+    """Answer records on a thread pool and yield results as they complete.
+
+    At most 2 * concurrency questions are in flight, so input can be streamed.
+    With dedupe, a question asked again by the same user reuses the first
+    answer (marked with duplicate_of) instead of running the graph again,
+    unless that answer wrote to the database: repeated "I want two salads"
+    lines each place their order.
+
+    A KeyboardInterrupt cancels the questions not started yet, yields the
+    results of those already running (their writes commit regardless) and is
+    then re-raised.
+    """
+    graph = graph or batch_graph()
+    done = set(done)
+    pending = {}
+    waiting = {}
+    answered = {}
+    # Dedupe keys whose answer wrote; their later copies run on their own.
+    writes = set()
+    stopping = False
+
+    def submit(record, key):
+        waiting[key] = []
+        pending[pool.submit(answer_record, graph, record, confirm)] = (key, record)
+
+    def copy_for(result, record):
+        return {**result, "id": record["id"], "question": record["question"], "duplicate_of": result["id"],
+                "latency_ms": 0.0}
+
+    def drain(finished):
+        for future in finished:
+            key, record = pending.pop(future)
+            copies = waiting.pop(key, ())
+            if future.cancelled():
+                continue
+            result = future.result()
+            yield result
+            if wrote(result, effective_confirm(record, confirm)):
+                writes.add(key)
+                if not stopping:
+                    for copy in copies:
+                        submit(copy, copy["id"])
+                continue
+            answered[key] = result
+            for copy in copies:
+                yield copy_for(result, copy)
+
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="batch") as pool:
+        try:
+            for record in records:
+                if record["id"] in done:
+                    continue
+                key = dedupe_key(record) if dedupe else record["id"]
+                if key in writes:
+                    key = record["id"]
+                if key in answered:
+                    yield copy_for(answered[key], record)
+                    continue
+                if key in waiting:
+                    waiting[key].append(record)
+                    continue
+                submit(record, key)
+                while len(pending) >= 2 * concurrency:
+                    yield from drain(wait(pending, return_when=FIRST_COMPLETED).done)
+            while pending:
+                yield from drain(wait(pending, return_when=FIRST_COMPLETED).done)
+        except KeyboardInterrupt:
+            stopping = True
+            pool.shutdown(wait=False, cancel_futures=True)
+            # wait() never counts a future cancelled by shutdown as done, so only wait for those running.
+            wait([future for future in pending if not future.cancelled()])
+            yield from drain(list(pending))
+            raise
+
+
+def finish_interrupted(results):
+    """What run_batch still yields after a KeyboardInterrupt raised outside it, e.g. while writing."""
+    try:
+        result = results.throw(KeyboardInterrupt)
+    except (KeyboardInterrupt, StopIteration):
+        return
+    yield result
+    try:
+        yield from results
+    except KeyboardInterrupt:
+        return
+
+
+class BatchSummary:
+    def __init__(self, skipped=0):
+        self.started = time.perf_counter()
+        self.skipped = skipped
+        self.results = 0
+        self.errors = 0
+        self.sql_errors = 0
+        self.interrupted = 0
+        self.duplicates = 0
+        self.latencies = []
+        self.error_kinds = {}
+
+    def add(self, result):
+        self.results += 1
+        if result.get("duplicate_of"):
+            self.duplicates += 1
+        else:
+            self.latencies.append(result["latency_ms"])
+        if result["error"]:
+            self.errors += 1
+            kind = result["error"].split(":", 1)[0]
+            self.error_kinds[kind] = self.error_kinds.get(kind, 0) + 1
+        if result.get("sql_error"):
+            self.sql_errors += 1
+        if result.get("interrupted"):
+            self.interrupted += 1
+
+    def as_dict(self):
+        wall = time.perf_counter() - self.started
+        ordered = sorted(self.latencies)
+
+        def rank(p):
+            return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))] if ordered else None
+
+        return {
+            "results": self.results,
+            "skipped": self.skipped,
+            "duplicates": self.duplicates,
+            "errors": self.errors,
+            "error_kinds": self.error_kinds,
+            "sql_errors": self.sql_errors,
+            "interrupted": self.interrupted,
+            "wall_s": round(wall, 3),
+            "questions_per_s": round(self.results / wall, 3) if wall else 0.0,
+            "latency_ms": {"p50": rank(50), "p95": rank(95), "p99": rank(99), "max": ordered[-1] if ordered else None},
+        }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help="JSONL questions, or - for stdin")
+    parser.add_argument("-o", "--output", help="JSONL answers (appended, resumable); stdout when omitted")
+    parser.add_argument("--concurrency", type=int, default=BATCH_CONCURRENCY)
+    parser.add_argument("--confirm", choices=("yes", "no", "skip"), default=BATCH_CONFIRM,
+                        help="answer to order confirmations; yes places real orders")
+    parser.add_argument("--user-id", help="user id for records without one")
+    parser.add_argument("--no-dedupe", action="store_true", help="run every line even if repeated")
+    parser.add_argument("--log-level", default="WARNING")
+    args = parser.parse_args(argv)
+
+    from agent.metrics import logger as agent_logger
+
+    agent_logger.setLevel(args.log_level)
+    for handler in agent_logger.handlers:
+        if isinstance(handler, logging.StreamHandler):
+            handler.setStream(sys.stderr)
+
+    done = completed_ids(args.output)
+    source = sys.stdin if args.input == "-" else open(args.input)
+    sink = open(args.output, "a") if args.output else sys.stdout
+    summary = BatchSummary()
+
+    def unanswered(records):
+        # Counted here rather than from the output file, which may hold ids that are no longer in the input.
+        for record in records:
+            if record["id"] in done:
+                summary.skipped += 1
+                continue
+            yield record
+
+    def write(result):
+        sink.write(json.dumps(result, default=str) + "\n")
+        sink.flush()
+        summary.add(result)
+
+    records = unanswered(read_records(source, default_user_id=args.user_id))
+    results = run_batch(records, concurrency=args.concurrency, confirm=args.confirm, dedupe=not args.no_dedupe)
+    try:
+        for result in results:
+            write(result)
+    except KeyboardInterrupt:
+        print("Interrupted; writing the answers already running.", file=sys.stderr)
+        for result in finish_interrupted(results):
+            write(result)
+        print("Rerun with the same --output to resume.", file=sys.stderr)
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if sink is not sys.stdout:
+            sink.close()
+    print(json.dumps(summary.as_dict(), indent=2), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,282 @@
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from agent.sql_utils import write_targets
+
+SQL_CACHE_SIZE = int(os.getenv("SQL_CACHE_SIZE", "512"))
+SQL_CACHE_TTL = float(os.getenv("SQL_CACHE_TTL", "86400"))
+# Optional SQLite file that keeps generated queries across restarts.
+SQL_CACHE_PATH = os.getenv("SQL_CACHE_PATH", "")
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "1024"))
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "300"))
+
+
+class LRUCache:
+    """Thread-safe LRU mapping with an optional per-entry TTL (0 = no expiry)."""
+
+    def __init__(self, maxsize=1024, ttl=0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            value, stored_at = entry
+            if self.ttl > 0 and time.monotonic() - stored_at > self.ttl:
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic())
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+def normalize_question(question):
+    question = question.lower().strip()
+    if question.startswith("user:"):
+        question = question[len("user:"):]
+    return " ".join(re.findall(r"\d+(?:\.\d+)?|\w+", question))
+
+
+# Cheap pre-check: only statements mentioning one of these words are parsed for write targets.
+WRITE_HINT_RE = re.compile(r"\b(?:insert|replace|update|delete|drop|alter|truncate)\b", re.IGNORECASE)
+
+
+class TableVersions:
+    """Per-table write counters for caches built from table contents.
+
+    Every INSERT/UPDATE/DELETE seen by any engine in this process bumps the
+    table's version when it executes and again when its transaction commits,
+    so a cache that stores the version it was built at can tell it is stale.
+    Writes from other processes are not seen; pair this with a TTL.
+    """
+
+    def __init__(self):
+        self._versions = {}
+        self._lock = threading.Lock()
+        # Statements repeat (bound parameters), so their parsed targets are kept.
+        self._targets = LRUCache(maxsize=1024)
+
+    def get(self, table):
+        return self._versions.get(table, 0)
+
+    def bump(self, *tables):
+        with self._lock:
+            for table in tables:
+                self._versions[table] = self._versions.get(table, 0) + 1
+
+    def snapshot(self, tables):
+        return tuple(self.get(table) for table in tables)
+
+    def written_tables(self, statement):
+        if not WRITE_HINT_RE.search(statement):
+            return ()
+        tables = self._targets.get(statement)
+        if tables is None:
+            tables = tuple(write_targets(statement))
+            self._targets.set(statement, tables)
+        return tables
+
+    def on_execute(self, conn, cursor, statement, parameters, context, executemany):
+        tables = self.written_tables(statement)
+        if tables:
+            conn.info.setdefault("written_tables", set()).update(tables)
+            self.bump(*tables)
+
+    def on_commit(self, conn):
+        self.bump(*conn.info.pop("written_tables", ()))
+
+    def on_rollback(self, conn):
+        conn.info.pop("written_tables", None)
+
+
+table_versions = TableVersions()
+event.listen(Engine, "after_cursor_execute", table_versions.on_execute)
+event.listen(Engine, "commit", table_versions.on_commit)
+event.listen(Engine, "rollback", table_versions.on_rollback)
+
+
+class SQLCache:
+    """Generated SQL keyed by (normalized question, relevance, user id, schema hash).
+
+    Entries live in an in-memory LRU and, when a path is configured, in a small
+    SQLite table so they survive restarts. Only queries that executed without
+    error should be recorded.
+    """
+
+    def __init__(self, maxsize=SQL_CACHE_SIZE, ttl=SQL_CACHE_TTL, path=SQL_CACHE_PATH):
+        self.memory = LRUCache(maxsize=maxsize, ttl=ttl)
+        self.ttl = ttl
+        self.disk_hits = 0
+        self._conn = None
+        self._lock = threading.Lock()
+        if path:
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS sql_cache (key TEXT PRIMARY KEY, sql TEXT NOT NULL, created_at REAL NOT NULL)"
+            )
+            self._conn.commit()
+
+    @staticmethod
+    def make_key(question, relevance, user_id, schema_hash):
+        # The user id, not the name: names are not unique and order SQL embeds users.id.
+        return "\x1f".join([normalize_question(question), relevance.lower(), f"id:{user_id}", schema_hash])
+
+    def get(self, key):
+        sql = self.memory.get(key)
+        if sql is not None or self._conn is None:
+            return sql
+        with self._lock:
+            row = self._conn.execute("SELECT sql, created_at FROM sql_cache WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        sql, created_at = row
+        if self.ttl > 0 and time.time() - created_at > self.ttl:
+            self._delete_disk(key)
+            return None
+        self.disk_hits += 1
+        self.memory.set(key, sql)
+        return sql
+
+    def set(self, key, sql):
+        self.memory.set(key, sql)
+        if self._conn is not None:
+            with self._lock:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO sql_cache (key, sql, created_at) VALUES (?, ?, ?)",
+                    (key, sql, time.time()),
+                )
+                self._conn.commit()
+
+    def delete(self, key):
+        self.memory.delete(key)
+        if self._conn is not None:
+            self._delete_disk(key)
+
+    def stats(self):
+        stats = self.memory.stats()
+        lookups = stats["hits"] + stats["misses"]
+        stats["disk_hits"] = self.disk_hits
+        stats["hit_rate"] = (stats["hits"] + self.disk_hits) / lookups if lookups else 0.0
+        return stats
+
+    def _delete_disk(self, key):
+        with self._lock:
+            self._conn.execute("DELETE FROM sql_cache WHERE key = ?", (key,))
+            self._conn.commit()
+
+
+sql_cache = SQLCache()
+
+
+class CachedUser:
+    """The user facts a turn needs: primary key for scoping, name and email for prompts."""
+
+    __slots__ = ("id", "name", "email")
+
+    def __init__(self, id, name, email):
+        self.id = id
+        self.name = name
+        self.email = email
+
+    @classmethod
+    def from_model(cls, user):
+        return cls(user.id, user.name, user.email) if user is not None else None
+
+
+MISSING = object()
+
+
+class UserCache:
+    """Current-user lookups keyed by user id, in an LRU with a TTL.
+
+    Entries remember the users table version they were read at and are
+    dropped once a write to users is seen. Unknown ids are cached as None so
+    a bad id does not hit the database on every turn either.
+    """
+
+    def __init__(self, maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL):
+        self.entries = LRUCache(maxsize=maxsize, ttl=ttl)
+        self.stale = 0
+
+    @staticmethod
+    def version():
+        return table_versions.get("users")
+
+    def get(self, user_id):
+        entry = self.entries.get(user_id, MISSING)
+        if entry is MISSING:
+            return MISSING
+        user, version = entry
+        if version != self.version():
+            self.entries.delete(user_id)
+            self.stale += 1
+            return MISSING
+        return user
+
+    def set(self, user_id, user, version):
+        self.entries.set(user_id, (user, version))
+
+    def invalidate(self, user_id=None):
+        if user_id is None:
+            self.entries.clear()
+        else:
+            self.entries.delete(user_id)
+
+    def stats(self):
+        stats = self.entries.stats()
+        stats["stale"] = self.stale
+        stats["hits"] -= self.stale
+        stats["misses"] += self.stale
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+
+user_cache = UserCache()
@@ -0,0 +1,248 @@
+import asyncio
+import logging
+import os
+import sqlite3
+import time
+from langgraph.checkpoint.sqlite import SqliteSaver
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_DB = os.getenv("CHECKPOINT_DB", "checkpoints.db")
+# Finished threads are dropped after this many idle seconds.
+CHECKPOINT_TTL = float(os.getenv("CHECKPOINT_TTL", "3600"))
+# Threads waiting at the confirm_order interrupt are kept longer.
+CHECKPOINT_INTERRUPTED_TTL = float(os.getenv("CHECKPOINT_INTERRUPTED_TTL", "86400"))
+CHECKPOINT_MAX_THREADS = int(os.getenv("CHECKPOINT_MAX_THREADS", "10000"))
+# Idle threads keep only their latest checkpoint after this many seconds.
+CHECKPOINT_COMPACT_AFTER = float(os.getenv("CHECKPOINT_COMPACT_AFTER", "60"))
+CHECKPOINT_MAINTENANCE_INTERVAL = float(os.getenv("CHECKPOINT_MAINTENANCE_INTERVAL", "300"))
+# Seconds to wait for another process (e.g. another server worker) holding the write lock.
+CHECKPOINT_BUSY_TIMEOUT = float(os.getenv("CHECKPOINT_BUSY_TIMEOUT", "30"))
+
+INTERRUPTED_THREADS = """
+    SELECT DISTINCT w.thread_id FROM writes w
+    WHERE w.channel = '__interrupt__'
+      AND w.checkpoint_id = (
+          SELECT MAX(c.checkpoint_id) FROM checkpoints c
+          WHERE c.thread_id = w.thread_id AND c.checkpoint_ns = w.checkpoint_ns
+      )
+"""
+
+
+class PersistentSaver(SqliteSaver):
+    """SQLite checkpointer that evicts old threads and compacts idle ones.
+
+    Every thread gets a last-activity timestamp. Maintenance runs from put()
+    at most once per CHECKPOINT_MAINTENANCE_INTERVAL. It drops finished
+    threads past CHECKPOINT_TTL and interrupted ones past
+    CHECKPOINT_INTERRUPTED_TTL, keeps at most CHECKPOINT_MAX_THREADS threads,
+    and reduces idle threads to their latest checkpoint. That checkpoint is
+    all a resume needs.
+
+    Resumes are claimed per interrupted checkpoint in resume_claims, so two
+    processes sharing the file cannot both resume the same interrupt.
+    """
+
+    def __init__(self, conn, **kwargs):
+        super().__init__(conn, **kwargs)
+        self.ttl = CHECKPOINT_TTL
+        self.interrupted_ttl = CHECKPOINT_INTERRUPTED_TTL
+        self.max_threads = CHECKPOINT_MAX_THREADS
+        self.compact_after = CHECKPOINT_COMPACT_AFTER
+        self.maintenance_interval = CHECKPOINT_MAINTENANCE_INTERVAL
+        self.evicted_threads = 0
+        self.compacted_checkpoints = 0
+        self._last_maintenance = time.monotonic()
+
+    @classmethod
+    def from_path(cls, path=CHECKPOINT_DB):
+        return cls(sqlite3.connect(path, check_same_thread=False, timeout=CHECKPOINT_BUSY_TIMEOUT))
+
+    def setup(self):
+        if self.is_setup:
+            return
+        # Must precede table creation to take effect on a new file.
+        self.conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        super().setup()
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS thread_activity (
+                thread_id TEXT PRIMARY KEY,
+                updated_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS thread_activity_updated_at ON thread_activity (updated_at);
+            CREATE TABLE IF NOT EXISTS resume_claims (
+                thread_id TEXT NOT NULL,
+                checkpoint_id TEXT NOT NULL,
+                claimed_at REAL NOT NULL,
+                PRIMARY KEY (thread_id, checkpoint_id)
+            );
+            """
+        )
+
+    def _touch(self, config):
+        with self.cursor() as cur:
+            cur.execute(
+                "INSERT INTO thread_activity (thread_id, updated_at) VALUES (?, ?) "
+                "ON CONFLICT(thread_id) DO UPDATE SET updated_at = excluded.updated_at",
+                (str(config["configurable"]["thread_id"]), time.time()),
+            )
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        saved = super().put(config, checkpoint, metadata, new_versions)
+        self._touch(config)
+        if time.monotonic() - self._last_maintenance > self.maintenance_interval:
+            self.maintain()
+        return saved
+
+    def put_writes(self, config, writes, task_id, task_path=""):
+        super().put_writes(config, writes, task_id, task_path)
+        self._touch(config)
+
+    def claim_resume(self, thread_id, checkpoint_id):
+        """True for the first caller to claim resuming this interrupted checkpoint, in any process."""
+        with self.cursor() as cur:
+            cur.execute(
+                "INSERT OR IGNORE INTO resume_claims (thread_id, checkpoint_id, claimed_at) VALUES (?, ?, ?)",
+                (str(thread_id), str(checkpoint_id), time.time()),
+            )
+            return cur.rowcount == 1
+
+    def release_resume(self, thread_id, checkpoint_id):
+        with self.cursor() as cur:
+            cur.execute(
+                "DELETE FROM resume_claims WHERE thread_id = ? AND checkpoint_id = ?",
+                (str(thread_id), str(checkpoint_id)),
+            )
+
+    def delete_thread(self, thread_id):
+        super().delete_thread(thread_id)
+        with self.cursor() as cur:
+            cur.execute("DELETE FROM thread_activity WHERE thread_id = ?", (str(thread_id),))
+            cur.execute("DELETE FROM resume_claims WHERE thread_id = ?", (str(thread_id),))
+
+    def prune(self, thread_ids, *, strategy="keep_latest"):
+        if strategy == "delete":
+            for thread_id in thread_ids:
+                self.delete_thread(thread_id)
+            return
+        with self.cursor() as cur:
+            for thread_id in thread_ids:
+                self._keep_latest(cur, "thread_id = ?", (str(thread_id),))
+
+    def _keep_latest(self, cur, where, params):
+        latest = (
+            "(SELECT MAX(l.checkpoint_id) FROM checkpoints l "
+            "WHERE l.thread_id = {t}.thread_id AND l.checkpoint_ns = {t}.checkpoint_ns)"
+        )
+        cur.execute(
+            f"DELETE FROM writes WHERE {where} AND checkpoint_id < {latest.format(t='writes')}", params
+        )
+        cur.execute(
+            f"DELETE FROM checkpoints WHERE {where} AND checkpoint_id < {latest.format(t='checkpoints')}", params
+        )
+        removed = cur.rowcount
+        cur.execute(
+            f"UPDATE checkpoints SET parent_checkpoint_id = NULL WHERE {where} AND parent_checkpoint_id IS NOT NULL",
+            params,
+        )
+        self.compacted_checkpoints += max(removed, 0)
+        return removed
+
+    def compact(self, now=None):
+        """Keep only the latest checkpoint of threads idle for compact_after seconds."""
+        now = time.time() if now is None else now
+        with self.cursor() as cur:
+            return self._keep_latest(
+                cur,
+                "thread_id IN (SELECT thread_id FROM thread_activity WHERE updated_at < ?)",
+                (now - self.compact_after,),
+            )
+
+    def evict(self, now=None):
+        """Delete expired threads and enforce max_threads; returns the number of threads removed."""
+        now = time.time() if now is None else now
+        with self.cursor() as cur:
+            interrupted = {row[0] for row in cur.execute(INTERRUPTED_THREADS)}
+            expired = []
+            for thread_id, updated_at in cur.execute("SELECT thread_id, updated_at FROM thread_activity"):
+                ttl = self.interrupted_ttl if thread_id in interrupted else self.ttl
+                if now - updated_at > ttl:
+                    expired.append(thread_id)
+            total = cur.execute("SELECT COUNT(*) FROM thread_activity").fetchone()[0] - len(expired)
+            if total > self.max_threads:
+                expired_set = set(expired)
+                oldest = cur.execute(
+                    "SELECT thread_id FROM thread_activity ORDER BY updated_at LIMIT ?",
+                    (total - self.max_threads + len(expired),),
+                ).fetchall()
+                expired.extend(row[0] for row in oldest if row[0] not in expired_set)
+            for thread_id in expired:
+                for table in ("writes", "checkpoints", "thread_activity", "resume_claims"):
+                    cur.execute(f"DELETE FROM {table} WHERE thread_id = ?", (thread_id,))
+            # A claimed checkpoint is never resumed again, so its claim only has to outlive the interrupt.
+            cur.execute("DELETE FROM resume_claims WHERE claimed_at < ?", (now - self.interrupted_ttl,))
+        self.evicted_threads += len(expired)
+        return len(expired)
+
+    def maintain(self):
+        self._last_maintenance = time.monotonic()
+        evicted = self.evict()
+        compacted = self.compact()
+        with self.cursor(transaction=False) as cur:
+            # executescript steps the pragma to completion and frees every page.
+            self.conn.executescript("PRAGMA incremental_vacuum; PRAGMA wal_checkpoint(TRUNCATE);")
+        logger.info(f"Checkpoint maintenance: evicted {evicted} threads, compacted {compacted} checkpoints.")
+        return evicted, compacted
+
+    def footprint(self):
+        with self.cursor(transaction=False) as cur:
+            page_size = cur.execute("PRAGMA page_size").fetchone()[0]
+            pages = cur.execute("PRAGMA page_count").fetchone()[0]
+            free_pages = cur.execute("PRAGMA freelist_count").fetchone()[0]
+            checkpoints, checkpoint_bytes = cur.execute(
+                "SELECT COUNT(*), COALESCE(SUM(LENGTH(checkpoint) + LENGTH(metadata)), 0) FROM checkpoints"
+            ).fetchone()
+            writes, write_bytes = cur.execute(
+                "SELECT COUNT(*), COALESCE(SUM(LENGTH(value)), 0) FROM writes"
+            ).fetchone()
+            threads = cur.execute("SELECT COUNT(*) FROM thread_activity").fetchone()[0]
+            path = cur.execute("PRAGMA database_list").fetchone()[2]
+        wal_bytes = os.path.getsize(path + "-wal") if path and os.path.exists(path + "-wal") else 0
+        return {
+            "threads": threads,
+            "checkpoints": checkpoints,
+            "writes": writes,
+            # Serialized state that has to be loaded to resume threads.
+            "payload_bytes": checkpoint_bytes + write_bytes,
+            "disk_bytes": page_size * pages,
+            "free_bytes": page_size * free_pages,
+            "wal_bytes": wal_bytes,
+            "evicted_threads": self.evicted_threads,
+            "compacted_checkpoints": self.compacted_checkpoints,
+        }
+
+    # The async graph shares this saver; sqlite3 calls run in worker threads.
+    async def aget_tuple(self, config):
+        return await asyncio.to_thread(self.get_tuple, config)
+
+    async def alist(self, config, *, filter=None, before=None, limit=None):
+        items = await asyncio.to_thread(lambda: list(self.list(config, filter=filter, before=before, limit=limit)))
+        for item in items:
+            yield item
+
+    async def aput(self, config, checkpoint, metadata, new_versions):
+        return await asyncio.to_thread(self.put, config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(self, config, writes, task_id, task_path=""):
+        await asyncio.to_thread(self.put_writes, config, writes, task_id, task_path)
+
+    async def adelete_thread(self, thread_id):
+        await asyncio.to_thread(self.delete_thread, thread_id)
+
+    async def aprune(self, thread_ids, *, strategy="keep_latest"):
+        await asyncio.to_thread(self.prune, thread_ids, strategy=strategy)
+
+    async def aget_delta_channel_history(self, *, config, channels):
+        return await asyncio.to_thread(lambda: self.get_delta_channel_history(config=config, channels=channels))
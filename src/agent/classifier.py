@@ -0,0 +1,146 @@
+import logging
+import os
+import threading
+import time
+from sqlalchemy import text
+from agent.cache import normalize_question
+
+logger = logging.getLogger(__name__)
+
+# Minimum confidence a pre-classifier needs before its label replaces the LLM call.
+PRECLASSIFIER_MIN_CONFIDENCE = float(os.getenv("PRECLASSIFIER_MIN_CONFIDENCE", "0.8"))
+# Minimum keyword weight a question needs before the keyword classifier labels it at all.
+PRECLASSIFIER_MIN_SCORE = float(os.getenv("PRECLASSIFIER_MIN_SCORE", "1.0"))
+MENU_INDEX_TTL = float(os.getenv("MENU_INDEX_TTL", "60"))
+
+# Generic request verbs ("I want", "I'd like to buy") only weigh a little; the
+# anchor check below keeps them from labelling off-topic requests.
+ORDER_WORDS = {
+    "order": 1.0, "orders": 1.0, "ordered": 1.5, "confirm": 1.0,
+    "want": 0.5, "get": 0.25, "like": 0.25, "buy": 0.25, "place": 0.25, "cancel": 0.25,
+}
+MENU_WORDS = {
+    "menu": 1.5, "price": 1.0, "prices": 1.0, "cost": 1.0, "costs": 1.0, "cheap": 1.0, "cheapest": 1.0,
+    "expensive": 1.0, "dish": 0.75, "dishes": 0.75, "serve": 1.0, "available": 0.75, "options": 0.75,
+    "description": 1.0, "describe": 1.0, "how": 0.25, "much": 0.5,
+}
+# Mentioning a dish leans towards the menu unless an order verb is present too.
+DISH_WEIGHT = 0.75
+# Words before "order" that make it a noun ("my order", "place an order"), and words after it.
+ORDER_NOUN_BEFORE = frozenset(("my", "an", "the", "this", "that", "our", "last", "previous", "new", "whole"))
+ORDER_NOUN_AFTER = frozenset(("history", "status", "total"))
+# Only questions about the asker's own orders are "order": that SQL is scoped to the current user.
+FIRST_PERSON = frozenset(("i", "me", "my", "mine", "we", "us", "our"))
+
+
+def mentions_order_noun(words):
+    for i, word in enumerate(words):
+        if word not in ("order", "orders"):
+            continue
+        if i and words[i - 1] in ORDER_NOUN_BEFORE or i + 1 < len(words) and words[i + 1] in ORDER_NOUN_AFTER:
+            return True
+    return False
+
+
+class KeywordClassifier:
+    """Labels questions from keyword weights and dish names taken from the live menu.
+
+    A question is only labelled when it names a restaurant anchor (a dish,
+    "menu", or "order" used as a noun) and carries at least min_score of
+    keyword weight; "order" also needs the asker to talk about themselves.
+    Everything else, including off-topic requests, is left to the LLM.
+    """
+
+    name = "keyword"
+
+    def __init__(self, engine=None, index_ttl=MENU_INDEX_TTL, min_score=PRECLASSIFIER_MIN_SCORE):
+        self.engine = engine
+        self.index_ttl = index_ttl
+        self.min_score = min_score
+        self._dishes = ()
+        self._built_at = None
+        self._lock = threading.Lock()
+
+    def dishes(self):
+        if self._built_at is None or time.monotonic() - self._built_at > self.index_ttl:
+            with self._lock:
+                if self._built_at is None or time.monotonic() - self._built_at > self.index_ttl:
+                    self._dishes = self._load_dishes()
+                    self._built_at = time.monotonic()
+        return self._dishes
+
+    def _load_dishes(self):
+        engine = self.engine
+        if engine is None:
+            from database.database import engine
+        with engine.connect() as conn:
+            names = conn.execute(text("SELECT name FROM food")).scalars().all()
+        return tuple(sorted({normalize_question(name) for name in names if name}, key=len, reverse=True))
+
+    def classify(self, question):
+        normalized = f" {normalize_question(question)} "
+        words = normalized.split()
+        order_score = sum(ORDER_WORDS.get(word, 0.0) for word in words)
+        menu_score = sum(MENU_WORDS.get(word, 0.0) for word in words)
+        names_dish = any(
+            f" {form} " in normalized for dish in self.dishes() for form in (dish, dish + "s", dish + "es")
+        )
+        if names_dish:
+            if order_score > 0:
+                order_score += DISH_WEIGHT
+            else:
+                menu_score += DISH_WEIGHT
+        if not (names_dish or "menu" in words or mentions_order_noun(words)):
+            return None
+        total = order_score + menu_score
+        if total < self.min_score:
+            return None
+        label = "order" if order_score > menu_score else "menu"
+        if label == "order" and not FIRST_PERSON.intersection(words):
+            return None
+        margin = abs(order_score - menu_score) / total
+        return label, round(0.5 + 0.45 * margin, 3)
+
+
+class PreClassifier:
+    """Runs registered classifiers before the relevance LLM and counts how often they decide."""
+
+    def __init__(self, classifiers=None, min_confidence=PRECLASSIFIER_MIN_CONFIDENCE):
+        self.classifiers = list(classifiers or [])
+        self.min_confidence = min_confidence
+        self.turns = 0
+        self.resolved = {}
+        # classify runs on batch threads and server workers at once.
+        self._lock = threading.Lock()
+
+    def register(self, classifier):
+        self.classifiers.append(classifier)
+
+    def classify(self, question):
+        with self._lock:
+            self.turns += 1
+        for classifier in self.classifiers:
+            try:
+                verdict = classifier.classify(question)
+            except Exception as e:
+                logger.warning(f"Pre-classifier '{classifier.name}' failed: {str(e)}")
+                continue
+            if verdict and verdict[1] >= self.min_confidence:
+                with self._lock:
+                    self.resolved[classifier.name] = self.resolved.get(classifier.name, 0) + 1
+                return verdict
+        return None
+
+    def stats(self):
+        with self._lock:
+            turns, by_classifier = self.turns, dict(self.resolved)
+        resolved = sum(by_classifier.values())
+        return {
+            "turns": turns,
+            "resolved": resolved,
+            "resolved_share": resolved / turns if turns else 0.0,
+            "by_classifier": by_classifier,
+        }
+
+
+pre_classifier = PreClassifier([KeywordClassifier()])
@@ -0,0 +1,385 @@
+import asyncio
+import json
+import logging
+import os
+import ssl
+import threading
+import time
+import weakref
+from collections import deque
+from langchain_core.runnables import Runnable
+from agent.metrics import llm_metrics_handler, registry
+
+logger = logging.getLogger(__name__)
+
+base_url = os.getenv("OLLAMA_BASE_URL", "http://127.0.0.1:11434/")
+model = os.getenv("OLLAMA_MODEL", "codellama:7b")
+# Small, fast model for classification and small talk (e.g. "llama3.2:1b"); defaults to OLLAMA_MODEL.
+small_model = os.getenv("OLLAMA_SMALL_MODEL", model)
+# Comma-separated Ollama servers to spread calls over; defaults to OLLAMA_BASE_URL.
+endpoints = [url.strip() for url in os.getenv("OLLAMA_ENDPOINTS", base_url).split(",") if url.strip()]
+# How long Ollama keeps the model loaded after a request ("30m", "-1" = forever).
+keep_alive = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+max_connections = int(os.getenv("OLLAMA_MAX_CONNECTIONS", "16"))
+keepalive_expiry = float(os.getenv("OLLAMA_KEEPALIVE_EXPIRY", "300"))
+
+_clients = {}
+_lock = threading.Lock()
+_ssl_context = None
+
+
+def ollama_chat_model(**kwargs):
+    # Imported on first use: langchain_ollama is the slowest import of the agent.
+    from langchain_ollama import ChatOllama
+
+    return ChatOllama(**kwargs)
+
+
+# Swappable so benchmarks can run against a scripted model instead of Ollama.
+chat_model_factory = ollama_chat_model
+
+
+def shared_ssl_context():
+    """One TLS context for every client; httpx would load the CA bundle again for each one."""
+    global _ssl_context
+    if _ssl_context is None:
+        _ssl_context = ssl.create_default_context()
+    return _ssl_context
+
+
+def _chat_model(base_url, model, temperature, timeout=None):
+    import httpx
+
+    key = (base_url, model, temperature, None, timeout)
+    llm = _clients.get(key)
+    if llm is None:
+        client_kwargs = {
+            "limits": httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections,
+                keepalive_expiry=keepalive_expiry,
+            ),
+            # Applies to connecting and to each wait for data, so a hung server fails the call.
+            "timeout": timeout,
+        }
+        if base_url.startswith("https:"):
+            client_kwargs["verify"] = shared_ssl_context()
+        else:
+            # Plain HTTP never uses TLS; skip loading certificates at all.
+            client_kwargs["verify"] = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+        from agent.prompts import num_ctx
+
+        llm = chat_model_factory(
+            base_url=base_url,
+            model=model,
+            temperature=temperature,
+            num_ctx=num_ctx(),
+            keep_alive=keep_alive,
+            callbacks=[llm_metrics_handler],
+            client_kwargs=client_kwargs,
+        )
+        _clients[key] = llm
+    return llm
+
+
+def build_client(temperature=0, schema=None, model=model, base_url=base_url, timeout=None):
+    """The shared chat client for (model, temperature, output schema), built on first call."""
+    key = (base_url, model, temperature, schema, timeout)
+    client = _clients.get(key)
+    if client is not None:
+        return client
+    with _lock:
+        client = _clients.get(key)
+        if client is None:
+            llm = _chat_model(base_url, model, temperature, timeout)
+            client = llm if schema is None else llm.with_structured_output(schema)
+            _clients[key] = client
+    return client
+
+
+# Which model serves each kind of call. "timeout" is in seconds per call; on an
+# error or timeout the call moves to the next endpoint, then to "fallback".
+# OLLAMA_ROUTES is JSON merged over this, e.g. '{"sql": {"model": "sqlcoder:7b"}}'.
+ROUTES = {
+    "relevance": {"model": small_model, "fallback": model, "timeout": 15},
+    "funny": {"model": small_model, "fallback": model, "timeout": 30},
+    "sql": {"model": model, "fallback": None, "timeout": 60},
+    "answer": {"model": model, "fallback": small_model, "timeout": 60},
+    "default": {"model": model, "fallback": None, "timeout": 60},
+}
+for _name, _override in json.loads(os.getenv("OLLAMA_ROUTES", "{}")).items():
+    ROUTES[_name] = {**ROUTES.get(_name, ROUTES["default"]), **_override}
+
+
+class RouteStats:
+    """Calls, failures, fallbacks and recent latencies per (route, model, endpoint)."""
+
+    def __init__(self, window=1000):
+        self.window = window
+        self.routes = {}
+        self.in_flight = {url: 0 for url in endpoints}
+        self._lock = threading.Lock()
+
+    def start(self, url):
+        with self._lock:
+            self.in_flight[url] = self.in_flight.get(url, 0) + 1
+
+    def finish(self, route, model, url, seconds, outcome):
+        with self._lock:
+            self.in_flight[url] -= 1
+            stats = self.routes.get((route, model, url))
+            if stats is None:
+                stats = self.routes[(route, model, url)] = {
+                    "calls": 0, "errors": 0, "timeouts": 0, "fallbacks": 0, "latencies": deque(maxlen=self.window),
+                }
+            stats["calls"] += 1
+            stats["errors"] += outcome in ("error", "timeout")
+            stats["timeouts"] += outcome == "timeout"
+            if outcome == "ok":
+                stats["latencies"].append(seconds)
+
+    def fell_back(self, route, model, url):
+        with self._lock:
+            stats = self.routes.get((route, model, url))
+            if stats is not None:
+                stats["fallbacks"] += 1
+
+    def pick(self, route):
+        """Endpoint with the fewest calls in flight. Ties go to the route's own endpoint, so
+        under light load a node keeps hitting the server that holds its prompt prefix."""
+        preferred = sum(map(ord, route)) % len(endpoints)
+        ordered = endpoints[preferred:] + endpoints[:preferred]
+        with self._lock:
+            return sorted(ordered, key=lambda url: self.in_flight.get(url, 0))
+
+    def stats(self):
+        with self._lock:
+            result = {}
+            for (route, model, url), stats in self.routes.items():
+                ordered = sorted(stats["latencies"])
+
+                def rank(p):
+                    return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))] if ordered else 0.0
+
+                result[(route, model, url)] = {
+                    **{key: stats[key] for key in ("calls", "errors", "timeouts", "fallbacks")},
+                    "p50_seconds": rank(50),
+                    "p95_seconds": rank(95),
+                }
+            return result
+
+
+route_stats = RouteStats()
+
+
+def _is_timeout(error):
+    return "timeout" in type(error).__name__.lower() or isinstance(error, TimeoutError)
+
+
+class RoutedClient(Runnable):
+    """Chat client for one ROUTES entry, resolved on every call.
+
+    Each call goes to the least busy endpoint with the route's model and
+    timeout; if it fails or times out before producing output, the next
+    endpoint is tried, then the fallback model. Clients are looked up in the
+    shared cache per call, so use_chat_model also applies to chains built
+    before it was called.
+    """
+
+    def __init__(self, route="default", temperature=0, schema=None):
+        self.route = route if route in ROUTES else "default"
+        self.temperature = temperature
+        self.schema = schema
+
+    def candidates(self):
+        spec = ROUTES[self.route]
+        urls = route_stats.pick(self.route)
+        attempts = [(spec["model"], url) for url in urls]
+        if spec.get("fallback") and spec["fallback"] != spec["model"]:
+            attempts += [(spec["fallback"], url) for url in urls]
+        return attempts
+
+    def client(self, model, url):
+        return build_client(self.temperature, self.schema, model, url, ROUTES[self.route]["timeout"])
+
+    def get_name(self, suffix=None, *, name=None):
+        return name or f"{self.route}_llm"
+
+    def _settle(self, model, url, started, error=None, final=False):
+        """Record one attempt; returns True when the caller should re-raise instead of moving on."""
+        if error is None or not isinstance(error, Exception):
+            # Success, or the caller gave up (cancelled, or stopped reading a stream).
+            route_stats.finish(self.route, model, url, time.perf_counter() - started, "ok" if error is None else "cancelled")
+            return error is not None
+        outcome = "timeout" if _is_timeout(error) else "error"
+        route_stats.finish(self.route, model, url, time.perf_counter() - started, outcome)
+        if final:
+            return True
+        route_stats.fell_back(self.route, model, url)
+        logger.warning(f"LLM route '{self.route}' {outcome} on {model} at {url} ({str(error)}), trying the next candidate.")
+        return False
+
+    def _call(self, method, *args, **kwargs):
+        attempts = self.candidates()
+        for i, (model, url) in enumerate(attempts):
+            started = time.perf_counter()
+            route_stats.start(url)
+            try:
+                result = getattr(self.client(model, url), method)(*args, **kwargs)
+            except BaseException as e:
+                if self._settle(model, url, started, e, i == len(attempts) - 1):
+                    raise
+                continue
+            self._settle(model, url, started)
+            return result
+
+    async def _acall(self, method, *args, **kwargs):
+        attempts = self.candidates()
+        for i, (model, url) in enumerate(attempts):
+            started = time.perf_counter()
+            route_stats.start(url)
+            try:
+                result = await getattr(self.client(model, url), method)(*args, **kwargs)
+            except BaseException as e:
+                if self._settle(model, url, started, e, i == len(attempts) - 1):
+                    raise
+                continue
+            self._settle(model, url, started)
+            return result
+
+    def _iterate(self, method, *args, **kwargs):
+        attempts = self.candidates()
+        for i, (model, url) in enumerate(attempts):
+            started = time.perf_counter()
+            route_stats.start(url)
+            produced = False
+            try:
+                for chunk in getattr(self.client(model, url), method)(*args, **kwargs):
+                    produced = True
+                    yield chunk
+            except BaseException as e:
+                # Output already streamed cannot be taken back, so only fall back before the first chunk.
+                if self._settle(model, url, started, e, produced or i == len(attempts) - 1):
+                    raise
+                continue
+            self._settle(model, url, started)
+            return
+
+    async def _aiterate(self, method, *args, **kwargs):
+        attempts = self.candidates()
+        for i, (model, url) in enumerate(attempts):
+            started = time.perf_counter()
+            route_stats.start(url)
+            produced = False
+            try:
+                async for chunk in getattr(self.client(model, url), method)(*args, **kwargs):
+                    produced = True
+                    yield chunk
+            except BaseException as e:
+                if self._settle(model, url, started, e, produced or i == len(attempts) - 1):
+                    raise
+                continue
+            self._settle(model, url, started)
+            return
+
+    def invoke(self, input, config=None, **kwargs):
+        return self._call("invoke", input, config, **kwargs)
+
+    async def ainvoke(self, input, config=None, **kwargs):
+        return await self._acall("ainvoke", input, config, **kwargs)
+
+    def stream(self, input, config=None, **kwargs):
+        return self._iterate("stream", input, config, **kwargs)
+
+    def astream(self, input, config=None, **kwargs):
+        return self._aiterate("astream", input, config, **kwargs)
+
+    def transform(self, input, config=None, **kwargs):
+        # The upstream iterator can only be consumed once, so gather it before any retry.
+        return self._iterate("stream", _gather(input), config, **kwargs)
+
+    def atransform(self, input, config=None, **kwargs):
+        return self._aiterate_gathered(input, config, **kwargs)
+
+    async def _aiterate_gathered(self, input, config=None, **kwargs):
+        value = await _agather(input)
+        async for chunk in self._aiterate("astream", value, config, **kwargs):
+            yield chunk
+
+
+def _gather(chunks):
+    value = None
+    for chunk in chunks:
+        value = chunk if value is None else value + chunk
+    return value
+
+
+async def _agather(chunks):
+    value = None
+    async for chunk in chunks:
+        value = chunk if value is None else value + chunk
+    return value
+
+
+def get_llm(temperature=0, schema=None, route="default"):
+    """Return the chat client for a ROUTES entry, temperature and output schema.
+
+    Clients are built once per process, on first use; each holds a pooled
+    keep-alive HTTP session to Ollama, so callers should never construct
+    ChatOllama directly.
+    """
+    return RoutedClient(route, temperature, schema)
+
+
+def warm_models():
+    """Ask every route model on every endpoint for one token so Ollama loads them now."""
+    for name in dict.fromkeys(spec["model"] for spec in ROUTES.values()):
+        for url in endpoints:
+            try:
+                build_client(model=name, base_url=url).invoke("OK", options={"num_predict": 1})
+            except Exception as e:
+                logger.warning(f"Could not load {name} at {url}: {str(e)}")
+
+
+def _route_metrics():
+    samples = []
+    for (route, name, url), stats in route_stats.stats().items():
+        labels = {"route": route, "model": name, "endpoint": url}
+        for key, value in stats.items():
+            samples.append((f"agent_llm_route_{key}", labels, value))
+    for url, count in route_stats.in_flight.items():
+        samples.append(("agent_llm_endpoint_in_flight", {"endpoint": url}, count))
+    return samples
+
+
+registry.register_collector(_route_metrics)
+
+
+def clear_clients():
+    with _lock:
+        _clients.clear()
+
+
+def use_chat_model(factory):
+    """Build clients with factory(**ChatOllama kwargs) from now on, including for chains already defined."""
+    global chat_model_factory
+    chat_model_factory = factory
+    clear_clients()
+
+
+# Upper bound on LLM requests in flight per event loop for the async graph.
+llm_concurrency = int(os.getenv("LLM_CONCURRENCY", "8"))
+_semaphores = weakref.WeakKeyDictionary()
+
+
+def _llm_semaphore():
+    loop = asyncio.get_running_loop()
+    semaphore = _semaphores.get(loop)
+    if semaphore is None:
+        semaphore = _semaphores[loop] = asyncio.Semaphore(llm_concurrency)
+    return semaphore
+
+
+async def ainvoke_llm(chain, inputs, config=None):
+    async with _llm_semaphore():
+        return await chain.ainvoke(inputs, config)
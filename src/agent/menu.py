@@ -0,0 +1,259 @@
+import bisect
+import logging
+import os
+import re
+import threading
+import time
+from sqlalchemy import text
+from agent.cache import normalize_question, table_versions
+from agent.sql_utils import MAX_RESULT_ROWS, empty_rows
+
+logger = logging.getLogger(__name__)
+
+# Answer common menu questions from an in-memory copy of the food table.
+MENU_FAST_PATH = os.getenv("MENU_FAST_PATH", "1") == "1"
+# Seconds before the snapshot is reloaded even without a local write (other processes).
+MENU_SNAPSHOT_TTL = float(os.getenv("MENU_SNAPSHOT_TTL", "60"))
+
+MENU_COLUMNS = ("food_name", "price", "food_description")
+MENU_SELECT = "SELECT name AS food_name, price, description AS food_description FROM food"
+
+# Price phrases mapped to (bound, inclusive).
+BOUND_WORDS = {
+    "under": ("upper", False), "below": ("upper", False), "less than": ("upper", False),
+    "cheaper than": ("upper", False), "at most": ("upper", True), "up to": ("upper", True),
+    "max": ("upper", True), "maximum": ("upper", True),
+    "over": ("lower", False), "above": ("lower", False), "more than": ("lower", False),
+    "pricier than": ("lower", False), "at least": ("lower", True), "min": ("lower", True), "minimum": ("lower", True),
+}
+BOUND_RE = re.compile(r"\b(" + "|".join(BOUND_WORDS) + r")\s+(\d+(?:\.\d+)?)\b")
+CHEAPEST_RE = re.compile(r"\b(cheapest|least expensive|lowest price)\b")
+PRICIEST_RE = re.compile(r"\b(most expensive|priciest|highest price)\b")
+# Words that carry the intent ("show me the menu", "how much is ...") but do not filter.
+FILLER_WORDS = frozenset("""
+a about all an and any anything are at available can could describe description descriptions dish dishes
+display do dollar dollars usd bucks eat entire food foods for full get give have hello here hi how i in is
+it item items let list look me menu much of offer on options or our please price prices cost costs see
+serve serves show something tell than that the there this to today tonight us want we what whats which
+whole with would you your s
+""".split())
+MENU_WORDS = frozenset(("menu", "serve", "serves", "offer", "dishes", "items", "options", "food", "foods", "eat"))
+# Function words that never filter the menu, and words that exclude rather than
+# include ("no garlic", "gluten free"): the snapshot leaves those to the LLM.
+STOP_WORDS = frozenset("be been by does did has its just my so some such very".split())
+NEGATION_WORDS = frozenset("no not without except excluding free dont don t isnt nothing never non".split())
+
+
+class MenuItem:
+    __slots__ = ("id", "name", "price", "description", "key")
+
+    def __init__(self, id, name, price, description):
+        self.id = id
+        self.name = name
+        self.price = price
+        self.description = description
+        self.key = normalize_question(name or "")
+
+
+class MenuSnapshot:
+    """Immutable copy of the food table with name, word and price indexes."""
+
+    def __init__(self, items, version):
+        self.items = tuple(items)
+        self.version = version
+        self.built_at = time.monotonic()
+        self.by_price = sorted((item for item in self.items if item.price is not None), key=lambda item: item.price)
+        self.prices = [item.price for item in self.by_price]
+        self.by_name = {item.key: item for item in self.items if item.key}
+        # Longest names first so "spicy ramen" wins over "ramen".
+        self.names = sorted(self.by_name, key=len, reverse=True)
+        self.by_word = {}
+        for item in self.items:
+            for word in set(item.key.split()):
+                self.by_word.setdefault(word, []).append(item)
+
+    def under(self, limit, inclusive=True):
+        end = bisect.bisect_right(self.prices, limit) if inclusive else bisect.bisect_left(self.prices, limit)
+        return self.by_price[:end]
+
+    def over(self, limit, inclusive=True):
+        start = bisect.bisect_left(self.prices, limit) if inclusive else bisect.bisect_right(self.prices, limit)
+        return self.by_price[start:]
+
+    def word_for(self, term):
+        """The name word term stands for (the word itself or its singular/plural), or None."""
+        for word in (term, term[:-1] if term.endswith("s") else None, term + "s", term + "es"):
+            if word and word in self.by_word:
+                return word
+        return None
+
+    def containing(self, term):
+        """Items whose name has term as a whole word."""
+        return self.by_word.get(self.word_for(term), [])
+
+    def __len__(self):
+        return len(self.items)
+
+
+def _quote(value):
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+class MenuQuery:
+    """Constraints parsed from a menu question; applies them to a snapshot or renders SQL."""
+
+    def __init__(self):
+        self.names = []
+        self.terms = []
+        self.upper = None
+        self.lower = None
+        self.inclusive = {"upper": True, "lower": True}
+        self.pick = None
+
+    def filtered(self):
+        return bool(self.names or self.terms or self.upper is not None or self.lower is not None or self.pick)
+
+    def apply(self, snapshot):
+        if self.upper is not None:
+            items = snapshot.under(self.upper, self.inclusive["upper"])
+        else:
+            items = snapshot.by_price if self.filtered() else snapshot.items
+        if self.lower is not None:
+            lowest = snapshot.over(self.lower, self.inclusive["lower"])
+            wanted = {item.id for item in lowest}
+            items = [item for item in items if item.id in wanted]
+        if self.names:
+            wanted = {item.id for item in self.names}
+            items = [item for item in items if item.id in wanted]
+        for term in self.terms:
+            wanted = {item.id for item in snapshot.containing(term)}
+            items = [item for item in items if item.id in wanted]
+        if self.pick == "cheapest":
+            items = [item for item in items if item.price is not None][:1]
+        elif self.pick == "priciest":
+            items = [item for item in items if item.price is not None][-1:]
+        return list(items)
+
+    def sql(self):
+        where = []
+        if self.names:
+            where.append(f"name IN ({', '.join(_quote(item.name) for item in self.names)})")
+        where += [f"' ' || lower(name) || ' ' LIKE {_quote('% ' + term + ' %')}" for term in self.terms]
+        if self.upper is not None:
+            where.append(f"price {'<=' if self.inclusive['upper'] else '<'} {self.upper}")
+        if self.lower is not None:
+            where.append(f"price {'>=' if self.inclusive['lower'] else '>'} {self.lower}")
+        sql = MENU_SELECT + (f" WHERE {' AND '.join(where)}" if where else "")
+        if self.pick == "cheapest":
+            return sql + " ORDER BY price LIMIT 1"
+        if self.pick == "priciest":
+            return sql + " ORDER BY price DESC LIMIT 1"
+        return sql + (" ORDER BY price" if self.filtered() else "")
+
+
+def parse_menu_question(question, snapshot):
+    """Parse a menu question into a MenuQuery, or None when the snapshot cannot answer it."""
+    normalized = f" {normalize_question(question)} "
+    if NEGATION_WORDS.intersection(normalized.split()):
+        return None
+    query = MenuQuery()
+    for phrase, amount in BOUND_RE.findall(normalized):
+        bound, inclusive = BOUND_WORDS[phrase]
+        setattr(query, bound, float(amount))
+        query.inclusive[bound] = inclusive
+    normalized = BOUND_RE.sub(" ", normalized)
+    if CHEAPEST_RE.search(normalized):
+        query.pick = "cheapest"
+    elif PRICIEST_RE.search(normalized):
+        query.pick = "priciest"
+    normalized = PRICIEST_RE.sub(" ", CHEAPEST_RE.sub(" ", normalized))
+    for name in snapshot.names:
+        if f" {name} " in normalized:
+            query.names.append(snapshot.by_name[name])
+            normalized = normalized.replace(f" {name} ", " ")
+    words = normalized.split()
+    for word in words:
+        if word in FILLER_WORDS or word in STOP_WORDS or len(word) < 2:
+            continue
+        term = snapshot.word_for(word)
+        if term is None:
+            return None
+        query.terms.append(term)
+    if not query.filtered() and not MENU_WORDS.intersection(words):
+        return None
+    return query
+
+
+class MenuIndex:
+    """Keeps a MenuSnapshot current and answers menu questions from it.
+
+    The snapshot is reloaded when a write to the food table is seen in this
+    process (agent.cache.table_versions) or after MENU_SNAPSHOT_TTL seconds.
+    """
+
+    def __init__(self, engine=None, ttl=MENU_SNAPSHOT_TTL):
+        self.engine = engine
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.reloads = 0
+        self._snapshot = None
+        self._lock = threading.Lock()
+
+    def snapshot(self):
+        snapshot = self._snapshot
+        if snapshot is not None and not self._stale(snapshot):
+            return snapshot
+        with self._lock:
+            if self._snapshot is None or self._stale(self._snapshot):
+                self._snapshot = self._load()
+                self.reloads += 1
+                logger.info(f"Menu snapshot loaded ({len(self._snapshot)} items).")
+            return self._snapshot
+
+    def invalidate(self):
+        self._snapshot = None
+
+    def answer(self, question, max_rows=MAX_RESULT_ROWS):
+        """Return (sql, data, truncated, total) for question, or None to fall back to SQL."""
+        snapshot = self.snapshot()
+        query = parse_menu_question(question, snapshot)
+        if query is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        items = query.apply(snapshot)
+        data = empty_rows(MENU_COLUMNS)
+        names, prices, descriptions = data["values"]
+        for item in items[:max_rows]:
+            names.append(item.name)
+            prices.append(item.price)
+            descriptions.append(item.description)
+        return query.sql(), data, len(items) > max_rows, len(items)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "items": len(self._snapshot) if self._snapshot is not None else 0,
+            "hits": self.hits,
+            "misses": self.misses,
+            "reloads": self.reloads,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def _stale(self, snapshot):
+        if snapshot.version != table_versions.get("food"):
+            return True
+        return self.ttl > 0 and time.monotonic() - snapshot.built_at > self.ttl
+
+    def _load(self):
+        engine = self.engine
+        if engine is None:
+            from database.database import read_engine as engine
+        version = table_versions.get("food")
+        with engine.connect() as conn:
+            rows = conn.execute(text("SELECT id, name, price, description FROM food ORDER BY id")).all()
+        return MenuSnapshot((MenuItem(*row) for row in rows), version)
+
+
+menu_index = MenuIndex()
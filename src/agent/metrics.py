@@ -0,0 +1,402 @@
+import asyncio
+import contextvars
+import functools
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from langchain_core.callbacks import BaseCallbackHandler
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+AGENT_LOG_LEVEL = os.getenv("AGENT_LOG_LEVEL", "INFO")
+# "text" keeps the old one-line messages, "json" emits one JSON object per record.
+AGENT_LOG_FORMAT = os.getenv("AGENT_LOG_FORMAT", "text")
+# Prometheus text-format file rewritten every AGENT_METRICS_INTERVAL seconds.
+AGENT_METRICS_FILE = os.getenv("AGENT_METRICS_FILE", "")
+AGENT_METRICS_INTERVAL = float(os.getenv("AGENT_METRICS_INTERVAL", "15"))
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+logger = logging.getLogger("agent")
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        payload = {
+            "ts": round(record.created, 6),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        payload.update(getattr(record, "fields", {}))
+        return json.dumps(payload, default=str)
+
+
+def configure_logging(level=AGENT_LOG_LEVEL, fmt=AGENT_LOG_FORMAT):
+    if logger.handlers:
+        return
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(JsonFormatter() if fmt == "json" else logging.Formatter("%(message)s"))
+    logger.addHandler(handler)
+    logger.setLevel(level)
+    logger.propagate = False
+
+
+class NodeStats:
+    __slots__ = (
+        "runs", "errors", "interrupts", "seconds", "buckets", "llm_calls", "llm_seconds",
+        "prompt_tokens", "completion_tokens", "prompt_sent_tokens", "prompt_eval_seconds", "load_seconds",
+        "sql_statements", "sql_seconds", "rows", "retries",
+    )
+
+    def __init__(self):
+        self.runs = self.errors = self.interrupts = 0
+        self.seconds = 0.0
+        self.buckets = [0] * len(DURATION_BUCKETS)
+        self.llm_calls = self.prompt_tokens = self.completion_tokens = self.prompt_sent_tokens = 0
+        self.llm_seconds = self.prompt_eval_seconds = self.load_seconds = 0.0
+        self.sql_statements = self.rows = self.retries = 0
+        self.sql_seconds = 0.0
+
+
+class Scope:
+    """Counters for one node run; folded into the node's totals when it ends."""
+
+    __slots__ = ("node", "llm_calls", "llm_seconds", "prompt_tokens", "completion_tokens",
+                 "prompt_sent_tokens", "prompt_eval_seconds", "load_seconds",
+                 "sql_statements", "sql_seconds", "rows", "retries")
+
+    def __init__(self, node):
+        self.node = node
+        self.llm_calls = self.prompt_tokens = self.completion_tokens = self.prompt_sent_tokens = 0
+        self.llm_seconds = self.prompt_eval_seconds = self.load_seconds = 0.0
+        self.sql_statements = self.rows = self.retries = 0
+        self.sql_seconds = 0.0
+
+
+class Registry:
+    def __init__(self):
+        self.nodes = {}
+        self.collectors = []
+        self._lock = threading.Lock()
+
+    def record(self, scope, seconds, outcome):
+        with self._lock:
+            stats = self.nodes.get(scope.node)
+            if stats is None:
+                stats = self.nodes[scope.node] = NodeStats()
+            stats.runs += 1
+            stats.errors += outcome == "error"
+            stats.interrupts += outcome == "interrupt"
+            stats.seconds += seconds
+            for i, bound in enumerate(DURATION_BUCKETS):
+                if seconds <= bound:
+                    stats.buckets[i] += 1
+            for field in Scope.__slots__[1:]:
+                setattr(stats, field, getattr(stats, field) + getattr(scope, field))
+
+    def register_collector(self, collector):
+        """collector() returns [(metric_name, {label: value}, value), ...] gauges."""
+        self.collectors.append(collector)
+
+    def snapshot(self):
+        with self._lock:
+            return {name: {field: getattr(stats, field) for field in NodeStats.__slots__}
+                    for name, stats in self.nodes.items()}
+
+    def reset(self):
+        with self._lock:
+            self.nodes.clear()
+
+
+registry = Registry()
+_scope = contextvars.ContextVar("agent_node_scope", default=None)
+
+
+def current_scope():
+    return _scope.get()
+
+
+def record_rows(count):
+    scope = _scope.get()
+    if scope is not None:
+        scope.rows += count
+
+
+def record_retry():
+    scope = _scope.get()
+    if scope is not None:
+        scope.retries += 1
+
+
+def _outcome(error):
+    if error is None:
+        return "ok"
+    # GraphInterrupt (confirm_order) is control flow, not a failure.
+    if type(error).__name__ in ("GraphInterrupt", "NodeInterrupt", "ParentCommand"):
+        return "interrupt"
+    return "error"
+
+
+def _finish(scope, token, started, error):
+    seconds = time.perf_counter() - started
+    _scope.reset(token)
+    outcome = _outcome(error)
+    registry.record(scope, seconds, outcome)
+    fields = {"event": "node", "node": scope.node, "outcome": outcome, "wall_ms": round(seconds * 1000, 3)}
+    fields.update({field: getattr(scope, field) for field in Scope.__slots__[1:] if getattr(scope, field)})
+    for field in ("llm_seconds", "prompt_eval_seconds", "load_seconds", "sql_seconds"):
+        if field in fields:
+            fields[field] = round(fields[field], 6)
+    logger.info(f"Node {scope.node} finished in {fields['wall_ms']} ms ({outcome}).", extra={"fields": fields})
+
+
+def instrument(name, fn):
+    """Wrap a graph node so its wall time, LLM, SQL and retry counts are recorded."""
+    if asyncio.iscoroutinefunction(fn):
+        @functools.wraps(fn)
+        async def async_wrapper(*args, **kwargs):
+            scope = Scope(name)
+            token = _scope.set(scope)
+            started = time.perf_counter()
+            error = None
+            try:
+                return await fn(*args, **kwargs)
+            except BaseException as e:
+                error = e
+                raise
+            finally:
+                _finish(scope, token, started, error)
+        return async_wrapper
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        scope = Scope(name)
+        token = _scope.set(scope)
+        started = time.perf_counter()
+        error = None
+        try:
+            return fn(*args, **kwargs)
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            _finish(scope, token, started, error)
+    return wrapper
+
+
+class LLMMetricsHandler(BaseCallbackHandler):
+    """Attributes LLM calls, latency and token usage to the running node.
+
+    prompt_sent_tokens estimates the whole prompt; prompt_tokens is what
+    Ollama reports it evaluated (prompt_eval_count), which leaves out a prefix
+    reused from its KV cache. prompt_eval_seconds and load_seconds come from
+    Ollama's response metadata.
+    """
+
+    run_inline = True
+
+    def __init__(self):
+        self._started = {}
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        text = "".join(str(message.content) for batch in messages for message in batch)
+        self._started[run_id] = (time.perf_counter(), len(text))
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._started[run_id] = (time.perf_counter(), sum(len(prompt) for prompt in prompts))
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        started, chars = self._started.pop(run_id, (None, 0))
+        scope = _scope.get()
+        if scope is None:
+            return
+        scope.llm_calls += 1
+        scope.prompt_sent_tokens += chars // 4
+        if started is not None:
+            scope.llm_seconds += time.perf_counter() - started
+        for generations in response.generations:
+            for generation in generations:
+                message = getattr(generation, "message", None)
+                usage = getattr(message, "usage_metadata", None) or {}
+                scope.prompt_tokens += usage.get("input_tokens", 0)
+                scope.completion_tokens += usage.get("output_tokens", 0)
+                metadata = getattr(message, "response_metadata", None) or generation.generation_info or {}
+                # Ollama reports durations in nanoseconds.
+                scope.prompt_eval_seconds += (metadata.get("prompt_eval_duration") or 0) / 1e9
+                scope.load_seconds += (metadata.get("load_duration") or 0) / 1e9
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._started.pop(run_id, None)
+
+
+llm_metrics_handler = LLMMetricsHandler()
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("agent_query_started", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get("agent_query_started")
+    if not started:
+        return
+    elapsed = time.perf_counter() - started.pop()
+    scope = _scope.get()
+    if scope is not None:
+        scope.sql_statements += 1
+        scope.sql_seconds += elapsed
+
+
+def _label_value(value):
+    # Escapes required by the text exposition format; values include URLs and names from OLLAMA_ROUTES.
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_label_value(value)}"' for key, value in labels.items()) + "}"
+
+
+def render_prometheus():
+    """Current metrics in the Prometheus text exposition format."""
+    lines = []
+    nodes = registry.snapshot()
+
+    def family(name, kind, help_text, samples):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for suffix, labels, value in samples:
+            lines.append(f"{name}{suffix}{_labels(labels)} {value}")
+
+    family("agent_node_duration_seconds", "histogram", "Wall time per graph node run.", [
+        sample
+        for node, stats in nodes.items()
+        for sample in (
+            [("_bucket", {"node": node, "le": bound}, count) for bound, count in zip(DURATION_BUCKETS, stats["buckets"])]
+            + [("_bucket", {"node": node, "le": "+Inf"}, stats["runs"]),
+               ("_sum", {"node": node}, round(stats["seconds"], 6)),
+               ("_count", {"node": node}, stats["runs"])]
+        )
+    ])
+    family("agent_node_runs_total", "counter", "Node runs by outcome.", [
+        ("", {"node": node, "outcome": outcome}, count)
+        for node, stats in nodes.items()
+        for outcome, count in (("ok", stats["runs"] - stats["errors"] - stats["interrupts"]),
+                               ("error", stats["errors"]), ("interrupt", stats["interrupts"]))
+    ])
+    counters = (
+        ("agent_node_llm_calls_total", "LLM calls made inside the node.", "llm_calls"),
+        ("agent_node_llm_seconds_total", "Time spent waiting on the LLM.", "llm_seconds"),
+        ("agent_node_llm_prompt_tokens_total", "Prompt tokens reported by the model.", "prompt_tokens"),
+        ("agent_node_llm_completion_tokens_total", "Completion tokens reported by the model.", "completion_tokens"),
+        ("agent_node_llm_prompt_sent_tokens_total", "Prompt tokens sent, estimated from the prompt length.",
+         "prompt_sent_tokens"),
+        ("agent_node_llm_prompt_eval_seconds_total", "Time the model spent evaluating prompts (not cached).",
+         "prompt_eval_seconds"),
+        ("agent_node_llm_load_seconds_total", "Time the model server spent loading the model.", "load_seconds"),
+        ("agent_node_sql_statements_total", "SQL statements executed inside the node.", "sql_statements"),
+        ("agent_node_sql_seconds_total", "Time spent executing SQL.", "sql_seconds"),
+        ("agent_node_rows_total", "Result rows returned to the graph.", "rows"),
+        ("agent_node_retries_total", "Query regeneration retries.", "retries"),
+    )
+    for name, help_text, field in counters:
+        family(name, "counter", help_text, [
+            ("", {"node": node}, round(stats[field], 6)) for node, stats in nodes.items()
+        ])
+    gauges = {}
+    for collector in registry.collectors:
+        try:
+            for name, labels, value in collector():
+                gauges.setdefault(name, []).append(("", labels, value))
+        except Exception as e:
+            logger.warning(f"Metrics collector failed: {str(e)}")
+    for name, samples in gauges.items():
+        family(name, "gauge", name.replace("_", " "), samples)
+    lines.append("# EOF")
+    return "\n".join(lines) + "\n"
+
+
+def write_metrics_file(path=AGENT_METRICS_FILE):
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        f.write(render_prometheus())
+    os.replace(tmp, path)
+
+
+def _cache_stats():
+    from agent.cache import sql_cache, user_cache
+    from agent.classifier import pre_classifier
+    from agent.menu import menu_index
+    from agent.orders import order_writer
+    from agent.results import result_cache
+    from agent.utils import prune_stats, schema_cache
+
+    samples = []
+    caches = {"schema": schema_cache, "sql": sql_cache, "menu": menu_index, "user": user_cache,
+              "result": result_cache}
+    for cache, stats in ((name, cache.stats()) for name, cache in caches.items()):
+        for key in ("hits", "misses", "hit_rate"):
+            samples.append((f"agent_cache_{key}", {"cache": cache}, stats[key]))
+    samples.append(("agent_result_cache_bytes", {}, result_cache.bytes))
+    samples.append(("agent_preclassifier_resolved_share", {}, pre_classifier.stats()["resolved_share"]))
+    pruning = prune_stats.stats()
+    samples.append(("agent_schema_pruned_prompts", {}, pruning["prompts"]))
+    for stage in ("full", "pruned"):
+        samples.append(("agent_schema_prompt_tokens", {"stage": stage}, pruning[f"{stage}_tokens"]))
+    writes = order_writer.stats()
+    for key in ("batches", "orders", "rows", "duplicates", "orders_per_batch"):
+        samples.append((f"agent_order_writer_{key}", {}, writes[key]))
+    return samples
+
+
+registry.register_collector(_cache_stats)
+
+
+def start_metrics_exporter(path=AGENT_METRICS_FILE, interval=AGENT_METRICS_INTERVAL):
+    """Rewrite the metrics file from a daemon thread; works without any server."""
+    def loop():
+        while True:
+            time.sleep(interval)
+            try:
+                write_metrics_file(path)
+            except Exception as e:
+                logger.warning(f"Writing metrics to {path} failed: {str(e)}")
+
+    thread = threading.Thread(target=loop, name="agent-metrics-exporter", daemon=True)
+    thread.start()
+    return thread
+
+
+def profile_turn(func, *args, path="turn.prof", **kwargs):
+    """Run one call (e.g. app.invoke) under pyinstrument if installed, else cProfile."""
+    try:
+        from pyinstrument import Profiler
+    except ImportError:
+        Profiler = None
+    if Profiler is not None:
+        profiler = Profiler()
+        profiler.start()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            profiler.stop()
+            with open(os.path.splitext(path)[0] + ".html", "w") as f:
+                f.write(profiler.output_html())
+    import cProfile
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(func, *args, **kwargs)
+    finally:
+        profiler.dump_stats(path)
+
+
+configure_logging()
+if AGENT_METRICS_FILE:
+    start_metrics_exporter()
@@ -1,18 +1,52 @@
+import logging
+import os
 from pydantic import BaseModel, Field
 from agent.state import AgentState
-from agent.utils import get_database_schema
-from langchain_ollama import ChatOllama
-from langchain_core.prompts import ChatPromptTemplate
+from agent.utils import get_schema_snapshot
+from agent.llm import get_llm
+from agent.cache import MISSING, CachedUser, sql_cache, user_cache
+from agent.classifier import pre_classifier
+from agent.menu import MENU_FAST_PATH, menu_index
+from agent.prompts import ANSWER_INSTRUCTIONS, build_prompt
+from agent.orders import (
+    ORDER_FAST_PATH,
+    OrderPending,
+    OrderTooLarge,
+    describe_order,
+    order_sql,
+    order_writer,
+    parse_order_action,
+)
+from agent.render import ANSWER_RENDERER, render_answer
+from agent.results import result_cache
+from agent.sql_utils import (
+    describe_total,
+    error_message,
+    explain_error,
+    fetch_bounded,
+    is_select,
+    iter_rows,
+    row_count,
+)
+from agent.metrics import record_retry, record_rows
+from agent.validation import check_plan, check_sql, statement_timeout
 from langchain_core.output_parsers import StrOutputParser
-from langchain_core.runnables import RunnableConfig
+from langchain_core.runnables import RunnableConfig, RunnableParallel
 from sqlalchemy import text, inspect
-from database.database import *
+from database import database
 from database.models import *       
 from typing import Literal
 from langgraph.types import interrupt, Command
 
-base_url = "http://127.0.0.1:11434/"
-model = 'codellama:7b'
+logger = logging.getLogger(__name__)
+
+# How regenerate_query recovers from a failed query: "rewrite" rephrases the
+# question and generates SQL again, "repair" corrects the failed SQL from the
+# database error, "speculative" repairs with several candidates at once and
+# executes the first one that passes EXPLAIN.
+REGENERATE_MODE = os.getenv("REGENERATE_MODE", "repair")
+REGENERATE_CANDIDATES = int(os.getenv("REGENERATE_CANDIDATES", "3"))
+REGENERATE_TEMPERATURE = float(os.getenv("REGENERATE_TEMPERATURE", "0.6"))
 
 
 class GetCurrentUser(BaseModel):
@@ -20,28 +54,47 @@ class GetCurrentUser(BaseModel):
         description="The name of the current user based on the provided user ID."
     )
 
+def set_current_user(state: AgentState, user):
+    if user:
+        state["current_user"] = user.name
+        state["current_user_id"] = user.id
+        state["current_user_email"] = user.email
+        logger.info(f"Current user set to: {state['current_user']}")
+    else:
+        state["current_user"] = "User not found"
+        state["current_user_id"] = None
+        state["current_user_email"] = None
+        logger.info("User not found in the database.")
+    return state
+
+def cached_current_user(state: AgentState, user_id):
+    user = user_cache.get(user_id)
+    if user is MISSING:
+        return False
+    logger.info(f"Current user {user_id} served from cache.")
+    set_current_user(state, user)
+    return True
+
 def get_current_user(state: AgentState, config: RunnableConfig):
-    print("Retrieving the current user based on user ID.")
+    logger.info("Retrieving the current user based on user ID.")
     user_id = config["configurable"].get("current_user_id", None)
     if not user_id:
         state["current_user"] = "User not found"
-        print("No user ID provided in the configuration.")
+        logger.info("No user ID provided in the configuration.")
         return state
 
-    session = SessionLocal()
     try:
-        user = session.query(User).filter(User.id == int(user_id)).first()
-        if user:
-            state["current_user"] = user.name
-            print(f"Current user set to: {state['current_user']}")
-        else:
-            state["current_user"] = "User not found"
-            print("User not found in the database.")
+        user_id = int(user_id)
+        if cached_current_user(state, user_id):
+            return state
+        version = user_cache.version()
+        with database.SessionLocal() as session:
+            user = CachedUser.from_model(session.query(User).filter(User.id == user_id).first())
+        user_cache.set(user_id, user, version)
+        set_current_user(state, user)
     except Exception as e:
         state["current_user"] = "Error retrieving user"
-        print(f"Error retrieving user: {str(e)}")
-    finally:
-        session.close()
+        logger.warning(f"Error retrieving user: {str(e)}")
     return state
 
 class CheckRelevance(BaseModel):
@@ -49,34 +102,27 @@ class CheckRelevance(BaseModel):
         description="Indicates whether the question is related to the database schema. 'order' or 'not_relevant' or 'menu'."
     )
 
+check_prompt = build_prompt("relevance")
+relevance_checker = check_prompt | get_llm(temperature=0, schema=CheckRelevance, route="relevance")
+
+def pre_classify_relevance(state: AgentState):
+    question = state["question"]
+    logger.info(f"Checking relevance of the question: {question}")
+    verdict = pre_classifier.classify(question)
+    if not verdict:
+        return False
+    state["relevance"], confidence = verdict
+    logger.info(f"Relevance determined without LLM: {state['relevance']} (confidence {confidence})")
+    return True
+
 def check_relevance(state: AgentState, config: RunnableConfig):
     question = state["question"]
-    schema = get_database_schema(engine)
-    print(f"Checking relevance of the question: {question}")
-    system = """You are an assistant that determines whether a given question is related to the following database schema.
-
-Schema:
-{schema}
-
-Respond with only "order" or "not_relevant" or "menu".
-""".format(schema=schema)
-    human = f"Question: {question}"
-    check_prompt = ChatPromptTemplate.from_messages(
-        [
-            ("system", system),
-            ("human", human),
-        ]
-    )
-    llm = ChatOllama(
-    base_url=base_url,
-    model = model,
-    temperature = 0,
-)
-    structured_llm = llm.with_structured_output(CheckRelevance)
-    relevance_checker = check_prompt | structured_llm
-    relevance = relevance_checker.invoke({})
+    if pre_classify_relevance(state):
+        return state
+    schema = get_schema_snapshot(database.engine).for_question(question)
+    relevance = relevance_checker.invoke({"schema": schema, "question": question})
     state["relevance"] = relevance.relevance
-    print(f"Relevance determined: {state['relevance']}")
+    logger.info(f"Relevance determined: {state['relevance']}")
     return state
 
 class ConvertToSQL(BaseModel):
@@ -84,275 +130,354 @@ class ConvertToSQL(BaseModel):
         description="The SQL query corresponding to the user's natural language question."
     )
 
+order_sql_prompt = build_prompt("order_sql")
+menu_sql_prompt = build_prompt("menu_sql")
+order_sql_generator = order_sql_prompt | get_llm(temperature=0, schema=ConvertToSQL, route="sql")
+menu_sql_generator = menu_sql_prompt | get_llm(temperature=0, schema=ConvertToSQL, route="sql")
+
+def lookup_cached_sql(state: AgentState, snapshot):
+    if state.get("current_user_id") is None:
+        state["sql_cache_key"] = None
+        state["sql_cache_hit"] = False
+        return False
+    cache_key = sql_cache.make_key(state["question"], state["relevance"], state["current_user_id"], snapshot.hash)
+    state["sql_cache_key"] = cache_key
+    cached_sql = sql_cache.get(cache_key)
+    state["sql_cache_hit"] = cached_sql is not None
+    if cached_sql is not None:
+        state["sql_query"] = cached_sql
+        logger.info(f"Reusing cached SQL query: {cached_sql}")
+    return state["sql_cache_hit"]
+
+def answer_from_menu(state: AgentState):
+    state["menu_answered"] = False
+    if not MENU_FAST_PATH or state["relevance"].lower() != "menu":
+        return False
+    try:
+        answer = menu_index.answer(state["question"])
+    except Exception as e:
+        logger.warning(f"Menu snapshot unavailable: {str(e)}")
+        return False
+    if answer is None:
+        return False
+    sql_query, data, truncated, total = answer
+    state["sql_query"] = sql_query
+    state["sql_cache_hit"] = False
+    apply_select_result(state, data, truncated, total)
+    state["menu_answered"] = True
+    logger.info(f"Answered from the menu snapshot as: {sql_query}")
+    return True
+
+def structured_order(state: AgentState):
+    """Resolve a place-order question to a structured order_action, skipping SQL generation."""
+    state["order_action"] = None
+    state["order_pending"] = False
+    state["order_rejected"] = None
+    if not ORDER_FAST_PATH or state["relevance"].lower() != "order":
+        return False
+    try:
+        action = parse_order_action(state["question"], state.get("current_user_id"))
+    except OrderTooLarge as e:
+        # Answered without placing anything; the user asks again with a quantity that can be served.
+        state["order_rejected"] = str(e)
+        state["sql_query"] = ""
+        state["sql_cache_key"] = None
+        state["sql_cache_hit"] = False
+        logger.info(f"Order rejected without the LLM: {str(e)}")
+        return True
+    except Exception as e:
+        logger.warning(f"Order fast path unavailable: {str(e)}")
+        return False
+    if action is None:
+        return False
+    state["order_action"] = action
+    state["sql_query"] = order_sql(action)
+    state["sql_cache_key"] = None
+    state["sql_cache_hit"] = False
+    logger.info(f"Resolved order without the LLM: {describe_order(action)}")
+    return True
+
+def order_sql_inputs(state: AgentState, schema):
+    return {
+        "schema": schema,
+        "current_user": state["current_user"],
+        "current_user_id": state.get("current_user_id") or "unknown",
+        "question": state["question"],
+    }
+
 def convert_nl_to_sql(state: AgentState, config: RunnableConfig):
     question = state["question"]
     current_user = state["current_user"]
-    schema = get_database_schema(engine)
-    print(f"Converting question to SQL for user '{current_user}': {question}")
+    if structured_order(state) or answer_from_menu(state):
+        return state
+    snapshot = get_schema_snapshot(database.engine)
+    if lookup_cached_sql(state, snapshot):
+        return state
+    schema = snapshot.for_question(question)
+    logger.info(f"Converting question to SQL for user '{current_user}': {question}")
     if state["relevance"].lower() == "order":
-        system = """You are an assistant that converts natural language questions into SQL queries based on the following schema:
-
-    {schema}
-
-    The current user is '{current_user}'. Ensure that all query-related data is scoped to this user.
-
-    Provide only the SQL query without any explanations. Alias columns appropriately to match the expected keys in the result.
-
-    For example, alias 'food.name' as 'food_name' and 'food.price' as 'price'.
-    """.format(schema=schema, current_user=current_user)
-        convert_prompt = ChatPromptTemplate.from_messages(
-            [
-                ("system", system),
-                ("human", "Question: {question}"),
-            ]
-        )
-        llm = ChatOllama(
-        base_url=base_url,
-        model = model,
-        temperature = 0,
-    )
-        structured_llm = llm.with_structured_output(ConvertToSQL)
-        sql_generator = convert_prompt | structured_llm
-        result = sql_generator.invoke({"question": question})
+        result = order_sql_generator.invoke(order_sql_inputs(state, schema))
         state["sql_query"] = result.sql_query
-        print(f"Generated SQL query: {state['sql_query']}")
+        logger.info(f"Generated SQL query: {state['sql_query']}")
         return state
     else :
-        print(f"Converting menu-related question to SQL: {question}")
-        system = """You are an assistant that converts natural language questions about the menu into SQL queries based on the following schema:
-    {schema}
-    Provide only the SQL query without any explanations. Use only the "food" table, as the customer only wants to see the menu.
-    Alias columns appropriately to match the expected keys in the result. For example, alias 'food.name' as 'food_name', 'food.price' as 'price', and 'food.description' as 'food_description'.
-
-    """.format(schema=schema)
-        convert_prompt = ChatPromptTemplate.from_messages(
-            [
-                ("system", system),
-                ("human", "Question: {question}"),
-            ]
-        )
-        llm = ChatOllama(
-        base_url=base_url,
-        model = model,
-        temperature = 0,
-    )
-        structured_llm = llm.with_structured_output(ConvertToSQL)
-        sql_generator = convert_prompt | structured_llm
-        result = sql_generator.invoke({"question": question})
+        logger.info(f"Converting menu-related question to SQL: {question}")
+        result = menu_sql_generator.invoke({"schema": schema, "question": question})
         state["sql_query"] = result.sql_query
-        print(f"Generated SQL query for menu: {state['sql_query']}")
+        logger.info(f"Generated SQL query for menu: {state['sql_query']}")
         return state
    
 
+def apply_select_result(state: AgentState, data, truncated=False, total_estimate=None):
+    count = row_count(data)
+    record_rows(count)
+    state["query_rows"] = data
+    state["row_count"] = count
+    state["rows_truncated"] = truncated
+    state["total_rows_estimate"] = total_estimate if total_estimate is not None else count
+    if count:
+        header = ", ".join(data["columns"])
+        rows = list(iter_rows(data))
+        logger.info(f"Raw SQL Query Result: {count} rows{' (truncated)' if truncated else ''}, first: {rows[0]}")
+        # Format the result for readability
+        if state["relevance"].lower() == "order":
+            data = "; ".join([f"{row.get('food_name', row.get('name'))} for ${row.get('price', row.get('food_price'))}" for row in rows])
+        else:
+            data = "; ".join([f"{row.get('food_name', row.get('name'))} for ${row.get('price', row.get('food_price'))} description {row.get(('description'), row.get('food_description'))} " for row in rows])
+        formatted_result = f"{header}\n{data}"
+        if truncated:
+            formatted_result += f"\n(showing the first {count} of {describe_total(state['total_rows_estimate'])} rows)"
+    else:
+        formatted_result = "No results found."
+    state["query_result"] = formatted_result
+    state["sql_error"] = False
+    logger.info("SQL SELECT query executed successfully.")
+    return state
+
+def apply_write_result(state: AgentState):
+    state["query_result"] = "The action has been successfully completed."
+    state["sql_error"] = False
+    logger.info("SQL command executed successfully.")
+    return state
+
+def apply_sql_error(state: AgentState, error):
+    state["query_result"] = f"Error executing SQL query: {str(error)}"
+    state["sql_error"] = True
+    state["sql_error_message"] = error_message(error)
+    logger.warning(f"Error executing SQL query: {str(error)}")
+    return state
+
+def record_sql_outcome(state: AgentState, sql_query):
+    cache_key = state.get("sql_cache_key")
+    if cache_key:
+        if not state["sql_error"] and not state.get("sql_cache_hit"):
+            sql_cache.set(cache_key, sql_query)
+        elif state["sql_error"] and state.get("sql_cache_hit"):
+            sql_cache.delete(cache_key)
+    return state
+
+def apply_order_result(state: AgentState, rows):
+    state["query_result"] = f"Your order has been placed: {describe_order(state['order_action'])}."
+    state["sql_error"] = False
+    logger.info(f"Order {state['order_action']['key']} placed ({rows} row(s)).")
+    return state
+
+def apply_order_pending(state: AgentState, error):
+    # The writer still holds the order and may commit it, so it must not reach the repair loop.
+    state["order_pending"] = True
+    state["query_result"] = f"Your order is still being placed: {describe_order(state['order_action'])}."
+    state["sql_error"] = False
+    logger.warning(f"Order not confirmed yet: {str(error)}")
+    return state
+
+def apply_order_error(state: AgentState, error):
+    # The writer rolled the order back, so the literal INSERT in sql_query is what regenerate_query repairs from here on.
+    state["order_action"] = None
+    return apply_sql_error(state, error)
+
 def execute_sql(state: AgentState):
     sql_query = state["sql_query"].strip()
-    session = SessionLocal()
-    print(f"Executing SQL query: {sql_query}")
+    if state.get("order_action"):
+        logger.info(f"Placing order through the order writer: {sql_query}")
+        try:
+            apply_order_result(state, order_writer.place(state["order_action"]))
+        except OrderPending as e:
+            apply_order_pending(state, e)
+        except Exception as e:
+            apply_order_error(state, e)
+        return record_sql_outcome(state, sql_query)
+    logger.info(f"Executing SQL query: {sql_query}")
     try:
-        result = session.execute(text(sql_query))
-        if sql_query.lower().startswith("select"):
-            rows = result.fetchall()
-            columns = result.keys()
-            if rows:
-                if state["relevance"].lower() == "order":
-                    header = ", ".join(columns)
-                    state["query_rows"] = [dict(zip(columns, row)) for row in rows]
-                    print(f"Raw SQL Query Result: {state['query_rows']}")
-                    # Format the result for readability
-                    data = "; ".join([f"{row.get('food_name', row.get('name'))} for ${row.get('price', row.get('food_price'))}" for row in state["query_rows"]])
-                    formatted_result = f"{header}\n{data}"
-                else:
-                    header = ", ".join(columns)
-                    state["query_rows"] = [dict(zip(columns, row)) for row in rows]
-                    print(f"Raw SQL Query Result: {state['query_rows']}")
-                    # Format the result for readability
-                    data = "; ".join([f"{row.get('food_name', row.get('name'))} for ${row.get('price', row.get('food_price'))} description {row.get(('description'), row.get('food_description'))} " for row in state["query_rows"]])
-                    formatted_result = f"{header}\n{data}"
-
+        check_sql(sql_query, get_schema_snapshot(database.engine).tables, state.get("relevance"))
+    except Exception as e:
+        apply_sql_error(state, e)
+        return record_sql_outcome(state, sql_query)
+    if is_select(sql_query):
+        cached = result_cache.get(sql_query)
+        if cached is not None:
+            logger.info("Serving the SELECT result from the result cache.")
+            apply_select_result(state, *cached)
+            return record_sql_outcome(state, sql_query)
+    # Read-only queries go to the replica (the primary when none is configured).
+    session = database.ReadSessionLocal() if is_select(sql_query) else database.SessionLocal()
+    try:
+        with statement_timeout(session):
+            check_plan(session, sql_query)
+            if is_select(sql_query):
+                versions = result_cache.versions(sql_query)
+                result = fetch_bounded(session, sql_query)
+                result_cache.set(sql_query, result, versions)
+                apply_select_result(state, *result)
             else:
-                state["query_rows"] = []
-                formatted_result = "No results found."
-            state["query_result"] = formatted_result
-            state["sql_error"] = False
-            print("SQL SELECT query executed successfully.")
-        else:
+                session.execute(text(sql_query))
+        if not is_select(sql_query):
             session.commit()
-            state["query_result"] = "The action has been successfully completed."
-            state["sql_error"] = False
-            print("SQL command executed successfully.")
+            result_cache.invalidate(sql_query)
+            apply_write_result(state)
     except Exception as e:
-        state["query_result"] = f"Error executing SQL query: {str(e)}"
-        state["sql_error"] = True
-        print(f"Error executing SQL query: {str(e)}")
+        apply_sql_error(state, e)
     finally:
         session.close()
-    return state
-
-def generate_human_readable_answer(state: AgentState):
-    sql = state["sql_query"]
-    result = state["query_result"]
-    current_user = state["current_user"]
-    query_rows = state.get("query_rows", [])
-    sql_error = state.get("sql_error", False)
-    print("Generating a human-readable answer.")
-    system = """You are an assistant that converts SQL query results into clear, natural language responses without including any identifiers like order IDs. Start the response with a friendly greeting that includes the user's name.
-    """
-    if sql_error:
-        # Directly relay the error message
-        generate_prompt = ChatPromptTemplate.from_messages(
-            [
-                ("system", system),
-                (
-                    "human",
-                    f"""SQL Query:
-{sql}
-
-Result:
-{result}
-
-Formulate a clear and understandable error message in a single sentence, starting with 'Hello {current_user},' informing them about the issue."""
-                ),
-            ]
-        )
-    elif sql.lower().startswith("select"):
-        if not query_rows:
-            # Handle cases with no orders
-            generate_prompt = ChatPromptTemplate.from_messages(
-                [
-                    ("system", system),
-                    (
-                        "human",
-                        f"""SQL Query:
-{sql}
-
-Result:
-{result}
-Formulate a clear and understandable answer to the original question in a single sentence, starting with 'Hello {current_user},' and mention that there are no orders found
-."""
-                    ),
-                ]
-            )
-        elif state["relevance"].lower() == "order":
-            # Handle displaying orders
-            generate_prompt = ChatPromptTemplate.from_messages(
-                [
-                    ("system", system),
-                    (
-                        "human",
-                        f"""SQL Query:
-{sql}
-
-Result:
-{result}
-
-Formulate a clear and understandable answer to the original question in a single sentence, starting with 'Hello {current_user},' and list each item ordered along with its price. For example: 'Hello Bob, you have ordered Lasagne for $14.0 and Spaghetti Carbonara for $15.0.'"""
-                    ),
-                ]
-            )
-        else:
-            # Handle displaying menu items
-            generate_prompt = ChatPromptTemplate.from_messages(
-                [
-                    ("system", system),
-                    (
-                        "human",
-                        f"""SQL Query:
-{sql}
-Result:
-{result}
-
-Formulate a clear and understandable answer to the original question, starting with 'Hello {current_user},' and present the menu items along with their prices in a well-formatted table instead of a single sentence. For example:** **Hello Bob, here is the menu:**
- | Item                | Price  | Description                  |
- |---------------------|--------|------------------------------|
- | food_name           | price  | description                  | 
- | food_name           | price  | description                  |
-'"""
-                    ),
-                ]
-            )
-    else:
-        # Handle non-select queries
-        generate_prompt = ChatPromptTemplate.from_messages(
-            [
-                ("system", system),
-                (
-                    "human",
-                    f"""SQL Query:
-{sql}
-
-Result:
-{result}
-
-Formulate a clear and understandable confirmation message in a single sentence, starting with 'Hello {current_user},' confirming that your request has been successfully processed."""
-                ),
-            ]
-        )
-
-    llm = ChatOllama(
-    base_url=base_url,
-    model = model,
-    temperature = 0,
-)
-    human_response = generate_prompt | llm | StrOutputParser()
-    answer = human_response.invoke({})
+    return record_sql_outcome(state, sql_query)
+
+answer_generators = {
+    kind: build_prompt(f"answer_{kind}") | get_llm(temperature=0, route="answer") | StrOutputParser()
+    for kind in ANSWER_INSTRUCTIONS
+}
+
+def answer_kind(state: AgentState):
+    if state.get("order_rejected"):
+        return "rejected"
+    if state.get("sql_error", False):
+        return "error"
+    if not is_select(state["sql_query"]):
+        return "write"
+    if not state.get("row_count", 0):
+        return "no_rows"
+    if state["relevance"].lower() == "order":
+        return "orders"
+    return "menu"
+
+def render_template_answer(state: AgentState, kind):
+    # A rejected order has a fixed answer, whatever the renderer.
+    if ANSWER_RENDERER != "template" and kind != "rejected":
+        return False
+    answer = render_answer(kind, state)
+    if answer is None:
+        return False
+    state["query_result"] = answer
+    logger.info(f"Rendered '{kind}' answer from template.")
+    return True
+
+def answer_inputs(state: AgentState):
+    return {
+        "sql": state["sql_query"],
+        "result": state["query_result"],
+        "current_user": state["current_user"],
+    }
+
+def generate_human_readable_answer(state: AgentState, config: RunnableConfig):
+    logger.info("Generating a human-readable answer.")
+    kind = answer_kind(state)
+    if render_template_answer(state, kind):
+        return state
+    human_response = answer_generators[kind]
+    answer = human_response.invoke(answer_inputs(state), config)
     state["query_result"] = answer
-    print("Generated human-readable answer.")
+    logger.info("Generated human-readable answer.")
     return state
 
 class RewrittenQuestion(BaseModel):
     question: str = Field(description="The rewritten question.")
 
-def regenerate_query(state: AgentState):
-    question = state["question"]
-    print("Regenerating the SQL query by rewriting the question.")
-    system = """You are an assistant that reformulates an original question to enable more precise SQL queries. Ensure that all necessary details, such as table joins, are preserved to retrieve complete and accurate data.
-    """
-    rewrite_prompt = ChatPromptTemplate.from_messages(
-        [
-            ("system", system),
-            (
-                "human",
-                f"Original Question: {question}\nReformulate the question to enable more precise SQL queries, ensuring all necessary details are preserved.",
-            ),
-        ]
-    )
-    llm = ChatOllama(
-    base_url=base_url,
-    model = model,
-    temperature = 0,
-)
-    structured_llm = llm.with_structured_output(RewrittenQuestion)
-    rewriter = rewrite_prompt | structured_llm
-    rewritten = rewriter.invoke({})
-    state["question"] = rewritten.question
+rewrite_prompt = build_prompt("rewrite")
+rewriter = rewrite_prompt | get_llm(temperature=0, schema=RewrittenQuestion, route="sql")
+
+repair_prompt = build_prompt("repair")
+repairer = repair_prompt | get_llm(temperature=0, schema=ConvertToSQL, route="sql")
+# Candidate 0 is the deterministic repair, the rest are sampled for variety.
+repair_chains = [repairer] + [
+    repair_prompt | get_llm(temperature=REGENERATE_TEMPERATURE, schema=ConvertToSQL, route="sql")
+] * max(REGENERATE_CANDIDATES - 1, 0)
+speculative_repairer = RunnableParallel({str(i): chain for i, chain in enumerate(repair_chains)})
+
+def repair_inputs(state: AgentState):
+    return {
+        "schema": get_schema_snapshot(database.engine).for_question(state["question"]),
+        "current_user": state["current_user"],
+        "current_user_id": state.get("current_user_id") or "unknown",
+        "question": state["question"],
+        "sql": state["sql_query"],
+        "error": state.get("sql_error_message") or state["query_result"],
+    }
+
+def pick_candidate(state: AgentState, candidates):
+    """First candidate that passes validation and compiles under EXPLAIN, else the first one."""
+    candidates = list(dict.fromkeys(c.strip() for c in candidates if c and c.strip()))
+    schema = get_schema_snapshot(database.engine).tables
+    for candidate in candidates:
+        try:
+            check_sql(candidate, schema, state.get("relevance"))
+        except Exception as e:
+            logger.info(f"Candidate rejected ({str(e)}): {candidate}")
+            continue
+        session = database.ReadSessionLocal() if is_select(candidate) else database.SessionLocal()
+        try:
+            error = explain_error(session, candidate)
+        finally:
+            session.close()
+        if error is None:
+            logger.info(f"Picked a valid candidate out of {len(candidates)}: {candidate}")
+            return candidate
+        logger.info(f"Candidate rejected by EXPLAIN ({error}): {candidate}")
+    return candidates[0] if candidates else ""
+
+def apply_regenerated_sql(state: AgentState, sql_query):
+    state["sql_query"] = sql_query
+    state["sql_repaired"] = True
+    state["sql_cache_hit"] = False
     state["attempts"] += 1
-    print(f"Rewritten question: {state['question']}")
+    record_retry()
+    logger.info(f"Repaired SQL query: {sql_query}")
     return state
 
-def generate_funny_response(state: AgentState):
-    print("Generating a funny response for an unrelated question.")
-    system = """You are an assistant who can help with ordering delicious food, and you politely explain that what the person is asking for isn’t related to the restaurant’s work..
-    """
-    human_message = state["question"]
-    funny_prompt = ChatPromptTemplate.from_messages(
-        [
-            ("system", system),
-            ("human", human_message),
-        ]
-    )
-    llm = ChatOllama(
-    base_url=base_url,
-    model = model,
-    temperature = 0.8
-)
-    funny_response = funny_prompt | llm | StrOutputParser()
-    message = funny_response.invoke({})
+def apply_rewritten_question(state: AgentState, question):
+    state["question"] = question
+    state["sql_repaired"] = False
+    state["attempts"] += 1
+    record_retry()
+    logger.info(f"Rewritten question: {state['question']}")
+    return state
+
+def regenerate_query(state: AgentState):
+    if REGENERATE_MODE == "repair":
+        logger.info("Repairing the failed SQL query from the database error.")
+        result = repairer.invoke(repair_inputs(state))
+        return apply_regenerated_sql(state, result.sql_query)
+    if REGENERATE_MODE == "speculative":
+        logger.info(f"Generating {len(repair_chains)} repair candidates for the failed SQL query.")
+        results = speculative_repairer.invoke(repair_inputs(state))
+        candidates = [results[str(i)].sql_query for i in range(len(repair_chains))]
+        return apply_regenerated_sql(state, pick_candidate(state, candidates))
+    logger.info("Regenerating the SQL query by rewriting the question.")
+    rewritten = rewriter.invoke({"question": state["question"]})
+    return apply_rewritten_question(state, rewritten.question)
+
+funny_prompt = build_prompt("funny")
+funny_responder = funny_prompt | get_llm(temperature=0.8, route="funny") | StrOutputParser()
+
+def generate_funny_response(state: AgentState, config: RunnableConfig):
+    logger.info("Generating a funny response for an unrelated question.")
+    message = funny_responder.invoke({"question": state["question"]}, config)
     state["query_result"] = message
-    print("Generated funny response.")
+    logger.info("Generated funny response.")
     return state
 
 def confirm_order(state: AgentState) -> Command[Literal["execute_sql", "cancel_order"]]:
-    summary = 'Hello this is summay'
+    if state.get("order_action"):
+        summary = describe_order(state["order_action"])
+    else:
+        summary = state["sql_query"]
     return_to = interrupt({
         "question": "Do you want to confirm the order?",
         "options": ["Yes", "No"],
@@ -362,22 +487,22 @@ def confirm_order(state: AgentState) -> Command[Literal["execute_sql", "cancel_o
     
 
     if return_to == "Yes":
-        print("User confirmed the order.")
+        logger.info("User confirmed the order.")
         state['query_result'] = 'sefaresh shoma sabt shod'
         return Command(goto="execute_sql")
     else:
-        print("User canceled the order.")
+        logger.info("User canceled the order.")
         state["query_result"] = "Order canceled."
         return Command(goto="cancel_order")
     
 def cancel_order(state: AgentState):
     state["query_result"] = "Order canceled."
-    print("Order has been canceled.")
+    logger.info("Order has been canceled.")
     return state    
 
 def end_max_iterations(state: AgentState):
     state["query_result"] = "Please try again."
-    print("Maximum attempts reached. Ending the workflow.")
+    logger.info("Maximum attempts reached. Ending the workflow.")
     return state
 
 def relevance_router(state: AgentState):
@@ -387,6 +512,8 @@ def relevance_router(state: AgentState):
         return "generate_funny_response"
     
 def confirm_router(state: AgentState):
+    if state.get("menu_answered") or state.get("order_rejected"):
+        return "generate_human_readable_answer"
     if state["relevance"].lower() == "order":
         return "confirm_order"
     else:
@@ -394,6 +521,11 @@ def confirm_router(state: AgentState):
     
 def check_attempts_router(state: AgentState):
     if state["attempts"] < 3:
+        if state.get("sql_repaired"):
+            # The user confirmed the SQL before the repair, not this one.
+            if not is_select(state["sql_query"]):
+                return "confirm_order"
+            return "execute_sql"
         return "convert_to_sql"
     else:
         return "end_max_iterations"
@@ -0,0 +1,285 @@
+import asyncio
+import logging
+import os
+import queue
+import re
+import threading
+import time
+import uuid
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from sqlalchemy.exc import IntegrityError
+from agent.cache import LRUCache, normalize_question
+from agent.menu import menu_index
+
+logger = logging.getLogger(__name__)
+
+# Resolve "I want two salads" to a structured order instead of LLM-written SQL.
+ORDER_FAST_PATH = os.getenv("ORDER_FAST_PATH", "1") == "1"
+ORDER_MAX_QUANTITY = int(os.getenv("ORDER_MAX_QUANTITY", "20"))
+# Group commit: wait up to ORDER_BATCH_WINDOW seconds for more orders, at most ORDER_BATCH_MAX per transaction.
+ORDER_BATCH_WINDOW = float(os.getenv("ORDER_BATCH_WINDOW", "0.005"))
+ORDER_BATCH_MAX = int(os.getenv("ORDER_BATCH_MAX", "64"))
+ORDER_IDEMPOTENCY_TTL = float(os.getenv("ORDER_IDEMPOTENCY_TTL", "86400"))
+ORDER_WRITE_TIMEOUT = float(os.getenv("ORDER_WRITE_TIMEOUT", "30"))
+
+PLACE_PHRASES = (
+    "i want", "i d like", "i would like", "i ll have", "i ll take", "i will have", "i will take",
+    "can i get", "can i have", "could i get", "could i have", "get me", "order me", "i want to order",
+    "i d like to order", "place an order for", "please order", "please add", "add",
+)
+HISTORY_WORDS = frozenset(("did", "ordered", "history", "previous", "last", "what", "which", "my"))
+QUANTITY_WORDS = {
+    "a": 1, "an": 1, "one": 1, "two": 2, "three": 3, "four": 4, "five": 5,
+    "six": 6, "seven": 7, "eight": 8, "nine": 9, "ten": 10, "couple": 2,
+}
+# Words that end the quantity lookback, so "2 spaghetti and salad" is one salad.
+# Commas are turned into "and" before normalizing; a matched dish is replaced by "and".
+ITEM_SEPARATORS = frozenset(("and", "or", "plus", "with", "also", "then"))
+SEPARATOR_RE = re.compile(r"[,;&+/]")
+ORDER_INSERT_SQL = "INSERT INTO orders (food_id, user_id) VALUES (:food_id, :user_id)"
+
+
+class OrderTooLarge(ValueError):
+    """A dish was asked for in a larger quantity than ORDER_MAX_QUANTITY."""
+
+
+def _quantity(words):
+    """Quantity written just before a dish ("2 salads", "two salads", "a couple of salads")."""
+    for word in reversed(words[-3:]):
+        if word in ITEM_SEPARATORS:
+            break
+        if word.isdigit():
+            return int(word)
+        if word in QUANTITY_WORDS:
+            return QUANTITY_WORDS[word]
+    return 1
+
+
+def parse_order_action(question, user_id, snapshot=None):
+    """Structured order {"user_id", "items", "key"} for a place-order question, or None.
+
+    Only dishes found in the menu snapshot are accepted; anything else (order
+    history questions, unknown dishes, no user) is left to the LLM. Raises
+    OrderTooLarge rather than placing a smaller order than the one asked for.
+    """
+    if not user_id:
+        return None
+    normalized = f" {normalize_question(SEPARATOR_RE.sub(' and ', question))} "
+    if not any(f" {phrase} " in normalized for phrase in PLACE_PHRASES):
+        return None
+    if HISTORY_WORDS.intersection(normalized.split()):
+        return None
+    snapshot = snapshot or menu_index.snapshot()
+    items = []
+    for name in snapshot.names:
+        for form in (name, name + "s", name + "es"):
+            position = normalized.find(f" {form} ")
+            if position < 0:
+                continue
+            item = snapshot.by_name[name]
+            quantity = _quantity(normalized[:position].split())
+            if quantity > ORDER_MAX_QUANTITY:
+                raise OrderTooLarge(
+                    f"I can take at most {ORDER_MAX_QUANTITY} x {item.name} in one order, "
+                    f"but you asked for {quantity}. Please order a smaller quantity."
+                )
+            items.append({
+                "food_id": item.id, "food_name": item.name, "price": item.price,
+                "quantity": max(1, quantity),
+            })
+            normalized = normalized[:position] + " and " + normalized[position + len(form) + 2:]
+            break
+    if not items:
+        return None
+    return {"user_id": int(user_id), "items": items, "key": uuid.uuid4().hex}
+
+
+def describe_order(action):
+    parts = [f"{item['quantity']} x {item['food_name']} (${item['price']})" for item in action["items"]]
+    total = sum(item["quantity"] * (item["price"] or 0) for item in action["items"])
+    return f"{', '.join(parts)}; total ${round(total, 2)}"
+
+
+def order_sql(action):
+    """Literal INSERT equivalent to the action, shown as sql_query and used if the action has to be repaired."""
+    values = ", ".join(f"({row['food_id']}, {row['user_id']})" for row in order_rows(action))
+    return f"INSERT INTO orders (food_id, user_id) VALUES {values}"
+
+
+def order_rows(action):
+    """The orders table has no quantity column, so a quantity becomes that many rows."""
+    return [
+        {"food_id": item["food_id"], "user_id": action["user_id"]}
+        for item in action["items"]
+        for _ in range(item["quantity"])
+    ]
+
+
+class OrderPending(Exception):
+    """The order is queued but not committed within the timeout; it may still be placed later.
+
+    Never retry such an order through another path: only its idempotency key
+    guards against inserting it twice.
+    """
+
+
+class OrderWriter:
+    """Single writer thread that commits queued orders in shared transactions.
+
+    Orders confirmed within ORDER_BATCH_WINDOW of each other are inserted
+    with one executemany and one commit. Each order carries an idempotency
+    key; submitting a key again returns the first submission's future
+    instead of inserting twice. The keys are also written to the order_keys
+    table in the same transaction as the order rows, so a key placed by
+    another worker process, or before a restart, is not inserted again.
+    """
+
+    def __init__(self, engine=None, window=ORDER_BATCH_WINDOW, max_batch=ORDER_BATCH_MAX,
+                 idempotency_ttl=ORDER_IDEMPOTENCY_TTL):
+        self.engine = engine
+        self.window = window
+        self.max_batch = max_batch
+        self.idempotency_ttl = idempotency_ttl
+        self.submitted = LRUCache(maxsize=100_000, ttl=idempotency_ttl)
+        self.batches = 0
+        self.orders = 0
+        self.rows = 0
+        self.duplicates = 0
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._keys_ready = False
+        self._next_purge = 0.0
+
+    def submit(self, action):
+        """Queue action for the next group commit; returns a Future of the rows inserted."""
+        with self._lock:
+            existing = self.submitted.get(action["key"])
+            if existing is not None:
+                self.duplicates += 1
+                logger.info(f"Order {action['key']} already submitted, not inserting it again.")
+                return existing
+            future = Future()
+            self.submitted.set(action["key"], future)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="order-writer", daemon=True)
+                self._thread.start()
+        self._queue.put((action, future))
+        return future
+
+    def place(self, action, timeout=ORDER_WRITE_TIMEOUT):
+        try:
+            return self.submit(action).result(timeout)
+        except FutureTimeoutError:
+            raise OrderPending(f"order {action['key']} was not committed within {timeout:g}s")
+
+    async def aplace(self, action, timeout=ORDER_WRITE_TIMEOUT):
+        # Shielded: a cancelled turn must not cancel the writer's future, which resubmissions of the key share.
+        future = asyncio.wrap_future(self.submit(action))
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), timeout)
+        except asyncio.TimeoutError:
+            raise OrderPending(f"order {action['key']} was not committed within {timeout:g}s")
+
+    def stats(self):
+        return {
+            "batches": self.batches,
+            "orders": self.orders,
+            "rows": self.rows,
+            "duplicates": self.duplicates,
+            "orders_per_batch": self.orders / self.batches if self.batches else 0.0,
+        }
+
+    def _next(self, timeout=None):
+        """Next queued order whose future was not cancelled; once running, it can no longer be."""
+        while True:
+            action, future = self._queue.get(timeout=timeout)
+            if future.set_running_or_notify_cancel():
+                return action, future
+            self.submitted.delete(action["key"])
+            logger.warning(f"Order {action['key']} was cancelled before it was written, dropping it.")
+
+    def _run(self):
+        while True:
+            batch = [self._next()]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self._next(timeout=max(deadline - time.monotonic(), 0)))
+                except queue.Empty:
+                    break
+            try:
+                self._commit(batch)
+            except Exception as e:
+                # Keep the thread alive; the callers of this batch get the error.
+                logger.error(f"Order writer failed on a batch of {len(batch)}: {str(e)}")
+                for entry in batch:
+                    if not entry[1].done():
+                        self._fail(entry, e)
+
+    def _commit(self, batch, retry=True):
+        try:
+            placed = self._insert([action for action, _ in batch])
+        except Exception as e:
+            if len(batch) == 1:
+                if retry and isinstance(e, IntegrityError):
+                    # Most likely another process committed this key after our check; the retry sees it.
+                    self._commit(batch, retry=False)
+                    return
+                self._fail(batch[0], e)
+                return
+            logger.warning(f"Group commit of {len(batch)} orders failed ({str(e)}), retrying one by one.")
+            for entry in batch:
+                self._commit([entry])
+            return
+        self.batches += 1
+        for action, future in batch:
+            if action["key"] in placed:
+                self.duplicates += 1
+                logger.info(f"Order {action['key']} was already placed, not inserting it again.")
+                future.set_result(placed[action["key"]])
+                continue
+            rows = len(order_rows(action))
+            self.orders += 1
+            self.rows += rows
+            future.set_result(rows)
+        logger.info(f"Committed {len(batch)} order(s) in one transaction.")
+
+    def _fail(self, entry, error):
+        action, future = entry
+        self.submitted.delete(action["key"])
+        future.set_exception(error)
+
+    def _insert(self, actions):
+        """Insert the actions whose key is not in order_keys yet; returns {key: rows} for those that were."""
+        from sqlalchemy import delete, select, text
+        from sqlalchemy.schema import CreateIndex, CreateTable
+        from database.models import OrderKey
+
+        engine = self.engine
+        if engine is None:
+            from database.database import engine
+        with engine.begin() as conn:
+            if not self._keys_ready:
+                # IF NOT EXISTS: other worker processes may create it at the same moment.
+                conn.execute(CreateTable(OrderKey.__table__, if_not_exists=True))
+                for index in OrderKey.__table__.indexes:
+                    conn.execute(CreateIndex(index, if_not_exists=True))
+                self._keys_ready = True
+            if self.idempotency_ttl > 0 and time.monotonic() >= self._next_purge:
+                conn.execute(delete(OrderKey).where(OrderKey.created_at < time.time() - self.idempotency_ttl))
+                self._next_purge = time.monotonic() + min(self.idempotency_ttl, 3600)
+            keys = [action["key"] for action in actions]
+            placed = dict(conn.execute(select(OrderKey.key, OrderKey.rows).where(OrderKey.key.in_(keys))).all())
+            fresh = [action for action in actions if action["key"] not in placed]
+            if fresh:
+                # The primary key on order_keys makes a key committed concurrently by another process fail this batch.
+                conn.execute(OrderKey.__table__.insert(), [
+                    {"key": action["key"], "rows": len(order_rows(action)), "created_at": time.time()}
+                    for action in fresh
+                ])
+                conn.execute(text(ORDER_INSERT_SQL), [row for action in fresh for row in order_rows(action)])
+        return placed
+
+
+order_writer = OrderWriter()
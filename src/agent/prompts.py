@@ -0,0 +1,163 @@
+"""Prompt layout that lets Ollama reuse its KV cache across turns.
+
+Ollama keeps the evaluated prompt of the previous request and only
+evaluates what follows the first differing token. Every node prompt is
+therefore laid out as
+
+    system: node instructions, then the schema     (the same bytes every turn)
+    human:  current user, question, SQL, results   (per user and per turn)
+
+so consecutive calls of a node share their whole system message. The schema
+is last in the system message because pruning (agent.utils.SCHEMA_PRUNING)
+can vary it per question; the instructions before it still match.
+
+num_ctx is sized once per process from the rendered prefixes: changing it
+between requests makes Ollama reload the model, and a prompt longer than
+num_ctx is cut from the front, which throws the cached prefix away.
+"""
+import logging
+import os
+import threading
+from langchain_core.prompts import ChatPromptTemplate
+from agent.utils import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+# Fixed context window; 0 sizes it from the prompts (see context_window).
+OLLAMA_NUM_CTX = int(os.getenv("OLLAMA_NUM_CTX", "0"))
+# Room left after the static prefix for per-turn text (question, SQL, result rows) and for the reply.
+PROMPT_TURN_TOKENS = int(os.getenv("PROMPT_TURN_TOKENS", "1024"))
+PROMPT_REPLY_TOKENS = int(os.getenv("PROMPT_REPLY_TOKENS", "512"))
+CONTEXT_WINDOWS = (2048, 4096, 8192, 16384, 32768, 65536, 131072)
+
+SCHEMA_BLOCK = "\n\nSchema:\n{schema}\n"
+USER_LINE = "The current user is '{current_user}' (users.id = {current_user_id}).\n"
+
+ANSWER_SYSTEM = """You are an assistant that converts SQL query results into clear, natural language responses without including any identifiers like order IDs. Start the response with a friendly greeting that includes the user's name.
+
+"""
+ANSWER_INSTRUCTIONS = {
+    # Directly relay the error message
+    "error": "Formulate a clear and understandable error message in a single sentence, starting with 'Hello' and the current user's name, informing them about the issue.",
+    # Handle cases with no orders
+    "no_rows": "Formulate a clear and understandable answer to the original question in a single sentence, starting with 'Hello' and the current user's name, and mention that there are no orders found.",
+    # Handle displaying orders
+    "orders": "Formulate a clear and understandable answer to the original question in a single sentence, starting with 'Hello' and the current user's name, and list each item ordered along with its price. For example: 'Hello Bob, you have ordered Lasagne for $14.0 and Spaghetti Carbonara for $15.0.'",
+    # Handle displaying menu items
+    "menu": """Formulate a clear and understandable answer to the original question, starting with 'Hello' and the current user's name, and present the menu items along with their prices in a well-formatted table instead of a single sentence. For example: **Hello Bob, here is the menu:**
+ | Item                | Price  | Description                  |
+ |---------------------|--------|------------------------------|
+ | food_name           | price  | description                  |
+ | food_name           | price  | description                  |""",
+    # Handle non-select queries
+    "write": "Formulate a clear and understandable confirmation message in a single sentence, starting with 'Hello' and the current user's name, confirming that your request has been successfully processed.",
+}
+ANSWER_TURN = "The current user is '{current_user}'.\n\nSQL Query:\n{sql}\n\nResult:\n{result}"
+
+# name: (static instructions, uses the schema, per-turn human message)
+PROMPTS = {
+    "relevance": (
+        """You are an assistant that determines whether a given question is related to the following database schema.
+
+Respond with only "order" or "not_relevant" or "menu".""",
+        True,
+        "Question: {question}",
+    ),
+    "order_sql": (
+        """You are an assistant that converts natural language questions into SQL queries based on the following schema.
+
+Ensure that all query-related data is scoped to the current user given with the question.
+
+Provide only the SQL query without any explanations. Alias columns appropriately to match the expected keys in the result.
+
+For example, alias 'food.name' as 'food_name' and 'food.price' as 'price'.""",
+        True,
+        USER_LINE + "Question: {question}",
+    ),
+    "menu_sql": (
+        """You are an assistant that converts natural language questions about the menu into SQL queries based on the following schema.
+Provide only the SQL query without any explanations. Use only the "food" table, as the customer only wants to see the menu.
+Alias columns appropriately to match the expected keys in the result. For example, alias 'food.name' as 'food_name', 'food.price' as 'price', and 'food.description' as 'food_description'.""",
+        True,
+        "Question: {question}",
+    ),
+    "repair": (
+        """You are an assistant that fixes SQL queries that failed against the following schema.
+
+Ensure that all query-related data is scoped to the current user given with the question when the question is about their orders.
+
+Provide only the corrected SQL query without any explanations. Keep the column aliases of the failed query.""",
+        True,
+        USER_LINE + "Question: {question}\nFailed SQL: {sql}\nDatabase error: {error}",
+    ),
+    "rewrite": (
+        """You are an assistant that reformulates an original question to enable more precise SQL queries. Ensure that all necessary details, such as table joins, are preserved to retrieve complete and accurate data.""",
+        False,
+        "Original Question: {question}\nReformulate the question to enable more precise SQL queries, ensuring all necessary details are preserved.",
+    ),
+    "funny": (
+        """You are an assistant who can help with ordering delicious food, and you politely explain that what the person is asking for isn't related to the restaurant's work.""",
+        False,
+        "{question}",
+    ),
+    **{
+        f"answer_{kind}": (ANSWER_SYSTEM + instructions, False, ANSWER_TURN)
+        for kind, instructions in ANSWER_INSTRUCTIONS.items()
+    },
+}
+
+
+def system_template(name):
+    instructions, with_schema, _ = PROMPTS[name]
+    return instructions + (SCHEMA_BLOCK if with_schema else "\n")
+
+
+def build_prompt(name):
+    """ChatPromptTemplate for a node: static system message, per-turn human message."""
+    system = ChatPromptTemplate.from_messages([("system", system_template(name))])
+    extra = set(system.input_variables) - {"schema"}
+    if extra:
+        raise ValueError(f"Prompt '{name}' has per-turn values in its static prefix: {', '.join(sorted(extra))}")
+    return ChatPromptTemplate.from_messages([("system", system_template(name)), ("human", PROMPTS[name][2])])
+
+
+def static_prefix(name, schema=""):
+    """The system message of a node's prompt, exactly as sent."""
+    return system_template(name).replace("{schema}", schema)
+
+
+def longest_prefix(schema):
+    return max(estimate_tokens(static_prefix(name, schema)) for name in PROMPTS)
+
+
+def context_window(schema, turn_tokens=PROMPT_TURN_TOKENS, reply_tokens=PROMPT_REPLY_TOKENS):
+    """Smallest standard num_ctx that fits the longest prefix plus the per-turn and reply allowances."""
+    needed = longest_prefix(schema) + turn_tokens + reply_tokens
+    for size in CONTEXT_WINDOWS:
+        if size >= needed:
+            return size
+    return CONTEXT_WINDOWS[-1]
+
+
+_num_ctx = None
+_num_ctx_lock = threading.Lock()
+
+
+def num_ctx():
+    """The context window for every client in this process: OLLAMA_NUM_CTX, or sized from the full schema once."""
+    global _num_ctx
+    if _num_ctx is not None:
+        return _num_ctx
+    if OLLAMA_NUM_CTX:
+        _num_ctx = OLLAMA_NUM_CTX
+        return _num_ctx
+    from agent.utils import get_schema_snapshot
+    from database import database
+
+    with _num_ctx_lock:
+        if _num_ctx is None:
+            # The full schema is the longest a pruned one can be.
+            schema = get_schema_snapshot(database.engine).text
+            _num_ctx = context_window(schema)
+            logger.info(f"Context window sized to {_num_ctx} tokens (longest static prefix {longest_prefix(schema)} tokens).")
+    return _num_ctx
@@ -0,0 +1,98 @@
+import os
+from agent.orders import describe_order
+from agent.sql_utils import describe_total, iter_rows, tokenize
+from agent.validation import table_references
+
+# "template" renders known result shapes directly, "llm" always asks the model.
+ANSWER_RENDERER = os.getenv("ANSWER_RENDERER", "template")
+
+NAME_KEYS = ("food_name", "name", "item")
+# A bare "name" or "item" is only a dish when the query reads the food table alone;
+# "SELECT name FROM users" must not become "you have ordered <user name>".
+FOOD_NAME_KEYS = ("food_name",)
+PRICE_KEYS = ("price", "food_price")
+DESCRIPTION_KEYS = ("food_description", "description")
+
+
+def _pick(row, keys):
+    for key in keys:
+        if key in row:
+            return row[key]
+    return None
+
+
+def _price(value):
+    return f"${float(value)}" if isinstance(value, (int, float)) else f"${value}"
+
+
+def name_keys(sql_query):
+    """The columns that hold dish names in the result of sql_query."""
+    tables = table_references(tokenize(sql_query or ""))[0]
+    return NAME_KEYS if tables == {"food"} else FOOD_NAME_KEYS
+
+
+def render_menu(current_user, rows, names=NAME_KEYS):
+    if not all(_pick(row, names) is not None for row in rows):
+        return None
+    with_price = any(_pick(row, PRICE_KEYS) is not None for row in rows)
+    with_description = any(_pick(row, DESCRIPTION_KEYS) is not None for row in rows)
+    header = ["Item"] + (["Price"] if with_price else []) + (["Description"] if with_description else [])
+    lines = [
+        f"**Hello {current_user}, here is the menu:**",
+        "",
+        "| " + " | ".join(header) + " |",
+        "|" + "|".join("---" for _ in header) + "|",
+    ]
+    for row in rows:
+        cells = [str(_pick(row, names))]
+        if with_price:
+            price = _pick(row, PRICE_KEYS)
+            cells.append(_price(price) if price is not None else "")
+        if with_description:
+            cells.append(str(_pick(row, DESCRIPTION_KEYS) or ""))
+        lines.append("| " + " | ".join(cell.replace("|", "\\|") for cell in cells) + " |")
+    return "\n".join(lines)
+
+
+def render_orders(current_user, rows, names=FOOD_NAME_KEYS):
+    items = []
+    for row in rows:
+        name = _pick(row, names)
+        if name is None:
+            return None
+        price = _pick(row, PRICE_KEYS)
+        items.append(f"{name} for {_price(price)}" if price is not None else str(name))
+    if len(items) > 1:
+        listing = ", ".join(items[:-1]) + f" and {items[-1]}"
+    else:
+        listing = items[0]
+    return f"Hello {current_user}, you have ordered {listing}."
+
+
+def render_answer(kind, state):
+    """Render the answer for a known result shape, or return None to defer to the LLM."""
+    current_user = state["current_user"]
+    rows = list(iter_rows(state.get("query_rows")))
+    if kind == "rejected":
+        return f"Hello {current_user}, {state['order_rejected']}"
+    if kind == "write" and state.get("order_pending"):
+        return (f"Hello {current_user}, your order is still being placed: {describe_order(state['order_action'])}. "
+                "Please check your orders in a moment instead of ordering again.")
+    if kind == "write" and state.get("order_action"):
+        return f"Hello {current_user}, your order has been placed: {describe_order(state['order_action'])}."
+    if kind == "write":
+        return f"Hello {current_user}, your request has been successfully processed."
+    if kind == "no_rows":
+        if state["relevance"].lower() == "order":
+            return f"Hello {current_user}, there are no orders found."
+        return f"Hello {current_user}, there are no matching items on the menu."
+    names = name_keys(state.get("sql_query"))
+    if kind == "orders":
+        answer = render_orders(current_user, rows, names)
+    elif kind == "menu":
+        answer = render_menu(current_user, rows, names)
+    else:
+        return None
+    if answer is not None and state.get("rows_truncated"):
+        answer += f"\n\n_Showing the first {len(rows)} of {describe_total(state['total_rows_estimate'])} results._"
+    return answer
@@ -0,0 +1,148 @@
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from agent.cache import LRUCache, table_versions
+from agent.sql_utils import statement_kind, tokenize
+from agent.validation import table_references
+
+# Memory for cached SELECT results, in bytes (0 disables the cache).
+RESULT_CACHE_BYTES = int(os.getenv("RESULT_CACHE_BYTES", str(32 * 1024 * 1024)))
+# Seconds a result is served at most; writes from other processes are only caught by this.
+RESULT_CACHE_TTL = float(os.getenv("RESULT_CACHE_TTL", "60"))
+# Results whose rows would take more than this share of the cache are not stored.
+RESULT_CACHE_MAX_SHARE = 0.25
+
+# Functions whose value changes between runs of the same SQL.
+VOLATILE_WORDS = frozenset((
+    "random", "randomblob", "now", "current_date", "current_time", "current_timestamp",
+    "changes", "total_changes", "last_insert_rowid",
+))
+
+
+def result_size(sql, data):
+    """Rough bytes held by a cached result: the SQL, the column lists and every value."""
+    size = sys.getsizeof(sql) + sum(sys.getsizeof(column) for column in data["columns"])
+    for values in data["values"]:
+        size += sys.getsizeof(values) + sum(sys.getsizeof(value) for value in values)
+    return size
+
+
+def copy_rows(data):
+    return {"columns": list(data["columns"]), "values": [list(values) for values in data["values"]]}
+
+
+class ResultCache:
+    """SELECT results keyed by normalized SQL, valid while the tables it reads are unchanged.
+
+    An entry stores the table_versions of the tables its statement reads, taken
+    before the query ran, so a write that lands while it runs also makes it
+    stale. Writes bump those versions through the engine events in agent.cache
+    and through invalidate(). Entries are evicted least recently used first once
+    max_bytes is reached.
+    """
+
+    def __init__(self, max_bytes=RESULT_CACHE_BYTES, ttl=RESULT_CACHE_TTL):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.evictions = 0
+        self.skipped = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        # SQL text -> (key, tables), or None when the statement must not be cached.
+        self._parsed = LRUCache(maxsize=1024)
+
+    def parse(self, sql_query):
+        parsed = self._parsed.get(sql_query)
+        if parsed is None:
+            tokens = tokenize(sql_query)
+            cacheable = statement_kind(sql_query) == "read" and not any(
+                value in VOLATILE_WORDS or value == "'now'" for _, value in tokens
+            )
+            tables = tuple(sorted(table_references(tokens)[0]))
+            key = " ".join(value for _, value in tokens).rstrip(" ;")
+            parsed = (key, tables) if cacheable and tables else (None, tables)
+            self._parsed.set(sql_query, parsed)
+        return parsed
+
+    def versions(self, sql_query):
+        """Version stamp to pass to set(); take it before running the query."""
+        return table_versions.snapshot(self.parse(sql_query)[1])
+
+    def get(self, sql_query):
+        """(data, truncated, total_estimate) as fetch_bounded returned it, or None."""
+        if not self.max_bytes:
+            return None
+        key, tables = self.parse(sql_query)
+        if key is None:
+            return None
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            data, truncated, total_estimate, versions, size, stored_at = entry
+            expired = self.ttl > 0 and time.monotonic() - stored_at > self.ttl
+            if expired or versions != table_versions.snapshot(tables):
+                del self._data[key]
+                self.bytes -= size
+                self.stale += 1
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+        # Callers keep the rows in graph state; hand out a copy so the cached one never changes.
+        return copy_rows(data), truncated, total_estimate
+
+    def set(self, sql_query, result, versions):
+        if not self.max_bytes:
+            return
+        key, _ = self.parse(sql_query)
+        if key is None:
+            return
+        data, truncated, total_estimate = result
+        size = result_size(key, data)
+        if size > self.max_bytes * RESULT_CACHE_MAX_SHARE:
+            self.skipped += 1
+            return
+        with self._lock:
+            previous = self._data.pop(key, None)
+            if previous is not None:
+                self.bytes -= previous[4]
+            self._data[key] = (copy_rows(data), truncated, total_estimate, versions, size, time.monotonic())
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, evicted = self._data.popitem(last=False)
+                self.bytes -= evicted[4]
+                self.evictions += 1
+
+    def invalidate(self, sql_query):
+        """Mark every table a write statement names as changed."""
+        table_versions.bump(*self.parse(sql_query)[1])
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.bytes = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "stale": self.stale,
+            "evictions": self.evictions,
+            "skipped": self.skipped,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+result_cache = ResultCache()
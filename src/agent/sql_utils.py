@@ -0,0 +1,296 @@
+import os
+import re
+from sqlalchemy import text
+
+# Most rows a single query may bring into the graph state.
+MAX_RESULT_ROWS = int(os.getenv("MAX_RESULT_ROWS", "200"))
+FETCH_BATCH_SIZE = int(os.getenv("FETCH_BATCH_SIZE", "100"))
+# Truncated results get a row count capped at this many rows; 0 skips counting.
+COUNT_ESTIMATE_CAP = int(os.getenv("COUNT_ESTIMATE_CAP", "100000"))
+
+TOKEN_RE = re.compile(
+    r"""(?P<space>\s+)|(?P<comment>--[^\n]*|/\*.*?(?:\*/|$))|(?P<string>'(?:[^']|'')*'?)"""
+    r"""|(?P<ident>"(?:[^"]|"")*"?|`[^`]*`?|\[[^\]]*\]?)|(?P<number>\d+(?:\.\d*)?(?:e[+-]?\d+)?|\.\d+)"""
+    r"""|(?P<word>[A-Za-z_][\w$]*)|(?P<param>[?:@$]\w*)|(?P<op>\|\||<=|>=|<>|!=|==|<<|>>|[^\s\w])""",
+    re.DOTALL,
+)
+WRITE_KEYWORDS = ("insert", "update", "delete", "replace", "merge", "upsert")
+DDL_KEYWORDS = ("create", "alter", "drop", "truncate", "rename", "reindex", "vacuum", "analyze")
+READ_KEYWORDS = ("select", "values", "explain", "show", "describe")
+# Statements that accept a trailing LIMIT and can be wrapped in a subquery.
+LIMIT_KEYWORDS = ("select", "values")
+
+LIMIT_RE = re.compile(r"\blimit\s+(\d+)(?:\s*,\s*(\d+))?(\s+offset\s+\d+)?\s*$", re.IGNORECASE)
+
+
+def strip_comments(sql_query):
+    """SQL with -- and /* */ comments replaced by a space; strings and everything else untouched."""
+    parts, last = [], 0
+    for match in TOKEN_RE.finditer(sql_query):
+        if match.lastgroup == "comment":
+            parts.append(sql_query[last:match.start()] + " ")
+            last = match.end()
+    parts.append(sql_query[last:])
+    return "".join(parts)
+
+
+def strip_statement(sql_query):
+    """The statement without comments and trailing semicolons, ready to be wrapped or extended."""
+    return strip_comments(sql_query).strip().rstrip(";").rstrip()
+
+
+def tokenize(sql_query):
+    """Split SQL into (kind, text) tokens; whitespace and comments are dropped.
+
+    Quoted identifiers are unquoted, words are lowercased, strings keep their quotes.
+    """
+    tokens = []
+    for match in TOKEN_RE.finditer(sql_query):
+        kind = match.lastgroup
+        value = match.group()
+        if kind in ("space", "comment"):
+            continue
+        if kind == "ident":
+            value = value[1:-1] if len(value) > 1 else value
+            value = value.replace('""', '"')
+        elif kind == "word":
+            value = value.lower()
+        tokens.append((kind, value))
+    return tokens
+
+
+def split_statements(tokens):
+    """Group tokens into statements on top-level semicolons, dropping empty ones."""
+    statements, current = [], []
+    for token in tokens:
+        if token == ("op", ";"):
+            if current:
+                statements.append(current)
+            current = []
+        else:
+            current.append(token)
+    if current:
+        statements.append(current)
+    return statements
+
+
+def main_keyword_index(tokens):
+    """Position of the keyword that decides what a statement does, looking past WITH clauses."""
+    if not tokens or tokens[0][0] != "word":
+        return None
+    if tokens[0][1] != "with":
+        return 0
+    depth = 0
+    for i, (kind, value) in enumerate(tokens[1:], start=1):
+        if value == "(":
+            depth += 1
+        elif value == ")":
+            depth -= 1
+        elif depth == 0 and kind == "word" and value in READ_KEYWORDS + WRITE_KEYWORDS:
+            return i
+    return None
+
+
+def main_keyword(tokens):
+    """The keyword that decides what a statement does, looking past WITH clauses."""
+    i = main_keyword_index(tokens)
+    return None if i is None else tokens[i][1]
+
+
+def _skip(tokens, i, *words):
+    """i moved past words if they come next in tokens, else i unchanged."""
+    if [value for _, value in tokens[i:i + len(words)]] == list(words):
+        return i + len(words)
+    return i
+
+
+def write_targets(sql_query):
+    """Tables written by INSERT/REPLACE/UPDATE/DELETE or DROP/ALTER/TRUNCATE TABLE statements in sql_query.
+
+    Looks past WITH clauses and schema prefixes: "WITH x AS (...) DELETE FROM main.orders" writes orders.
+    """
+    targets = set()
+    for tokens in split_statements(tokenize(sql_query)):
+        i = main_keyword_index(tokens)
+        if i is None:
+            continue
+        keyword = tokens[i][1]
+        i += 1
+        if keyword in ("insert", "update") and _skip(tokens, i, "or") > i:
+            i += 2
+        if keyword in ("insert", "replace"):
+            i = _skip(tokens, i, "into")
+        elif keyword == "delete":
+            i = _skip(tokens, i, "from")
+        elif keyword in ("drop", "alter", "truncate"):
+            table = _skip(tokens, i, "table")
+            if table == i and keyword != "truncate":
+                continue
+            i = _skip(tokens, table, "if", "exists")
+        elif keyword != "update":
+            continue
+        if i < len(tokens) and tokens[i][0] in ("word", "ident"):
+            name = tokens[i][1]
+            if i + 2 < len(tokens) and tokens[i + 1][1] == "." and tokens[i + 2][0] in ("word", "ident"):
+                name = tokens[i + 2][1]
+            targets.add(name.lower())
+    return targets
+
+
+def statement_kind(sql_query):
+    """Classify SQL as read, write, ddl, pragma, other, multiple or empty."""
+    statements = split_statements(tokenize(sql_query)) if isinstance(sql_query, str) else [sql_query]
+    if not statements:
+        return "empty"
+    if len(statements) > 1:
+        return "multiple"
+    keyword = main_keyword(statements[0])
+    if keyword in READ_KEYWORDS:
+        return "read"
+    if keyword in WRITE_KEYWORDS:
+        return "write"
+    if keyword in DDL_KEYWORDS:
+        return "ddl"
+    if keyword == "pragma":
+        return "pragma"
+    return "other"
+
+
+def is_select(sql_query):
+    return statement_kind(sql_query) == "read"
+
+
+def accepts_limit(sql_query):
+    return main_keyword(tokenize(sql_query)) in LIMIT_KEYWORDS
+
+
+def apply_row_limit(sql_query, max_rows):
+    """Append a LIMIT, or tighten an existing trailing one, so at most max_rows come back.
+
+    Statements other than SELECT/VALUES (EXPLAIN, SHOW, ...) are returned without one.
+    """
+    sql_query = strip_statement(sql_query)
+    if not accepts_limit(sql_query):
+        return sql_query
+    match = LIMIT_RE.search(sql_query)
+    if match is None:
+        return f"{sql_query} LIMIT {max_rows}"
+    if match.group(2):
+        # SQLite/MySQL "LIMIT offset, count"
+        return f"{sql_query[:match.start()]}LIMIT {match.group(1)}, {min(int(match.group(2)), max_rows)}"
+    return f"{sql_query[:match.start()]}LIMIT {min(int(match.group(1)), max_rows)}{match.group(3) or ''}"
+
+
+def count_query(sql_query, cap=COUNT_ESTIMATE_CAP):
+    """Row count of sql_query, stopping at cap + 1 so a count above cap says the cap was reached."""
+    return f"SELECT COUNT(*) FROM (SELECT 1 FROM ({strip_statement(sql_query)}\n) AS bounded LIMIT {cap + 1}) AS counted"
+
+
+def describe_total(total, cap=COUNT_ESTIMATE_CAP):
+    """"about N" for a counted total, "more than cap" when counting stopped at the cap."""
+    if cap and total > cap:
+        return f"more than {cap}"
+    return f"about {total}"
+
+
+def empty_rows(columns):
+    columns = list(columns)
+    return {"columns": columns, "values": [[] for _ in columns]}
+
+
+def append_rows(data, rows):
+    for values, column in zip(data["values"], zip(*rows)):
+        values.extend(column)
+    return data
+
+
+def row_count(data):
+    if not data or not data["values"]:
+        return 0
+    return len(data["values"][0])
+
+
+def iter_rows(data):
+    """Yield each row of a columnar result as a dict."""
+    if not data:
+        return
+    columns = data["columns"]
+    for row in zip(*data["values"]):
+        yield dict(zip(columns, row))
+
+
+def _finish(data, fetched, max_rows):
+    truncated = fetched > max_rows
+    if truncated:
+        for values in data["values"]:
+            del values[max_rows:]
+    return truncated
+
+
+def fetch_bounded(session, sql_query, max_rows=MAX_RESULT_ROWS, batch_size=FETCH_BATCH_SIZE):
+    """Run a SELECT with an enforced row cap, fetching in batches into columnar lists.
+
+    Returns (data, truncated, total_estimate); total_estimate is only computed
+    when the result was cut off.
+    """
+    limited = apply_row_limit(sql_query, max_rows + 1)
+    result = session.execute(text(limited).execution_options(yield_per=batch_size))
+    data = empty_rows(result.keys())
+    fetched = 0
+    while fetched <= max_rows:
+        rows = result.fetchmany(batch_size)
+        if not rows:
+            break
+        append_rows(data, rows)
+        fetched += len(rows)
+    result.close()
+    truncated = _finish(data, fetched, max_rows)
+    total_estimate = row_count(data)
+    if truncated and COUNT_ESTIMATE_CAP and accepts_limit(sql_query):
+        total_estimate = session.execute(text(count_query(sql_query))).scalar()
+    return data, truncated, total_estimate
+
+
+async def afetch_bounded(session, sql_query, max_rows=MAX_RESULT_ROWS, batch_size=FETCH_BATCH_SIZE):
+    limited = apply_row_limit(sql_query, max_rows + 1)
+    result = await session.stream(text(limited))
+    data = empty_rows(result.keys())
+    fetched = 0
+    while fetched <= max_rows:
+        rows = await result.fetchmany(batch_size)
+        if not rows:
+            break
+        append_rows(data, rows)
+        fetched += len(rows)
+    await result.close()
+    truncated = _finish(data, fetched, max_rows)
+    total_estimate = row_count(data)
+    if truncated and COUNT_ESTIMATE_CAP and accepts_limit(sql_query):
+        total_estimate = (await session.execute(text(count_query(sql_query)))).scalar()
+    return data, truncated, total_estimate
+
+
+def error_message(error):
+    """The driver's message for a failed statement, without SQLAlchemy's SQL echo and help link."""
+    return str(getattr(error, "orig", None) or error)
+
+
+def explain_error(session, sql_query):
+    """Compile sql_query under EXPLAIN without running it; return the error message or None."""
+    try:
+        session.execute(text(f"EXPLAIN {strip_statement(sql_query)}")).fetchall()
+        return None
+    except Exception as e:
+        return error_message(e)
+    finally:
+        session.rollback()
+
+
+async def aexplain_error(session, sql_query):
+    try:
+        (await session.execute(text(f"EXPLAIN {strip_statement(sql_query)}"))).fetchall()
+        return None
+    except Exception as e:
+        return error_message(e)
+    finally:
+        await session.rollback()
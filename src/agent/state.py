@@ -5,8 +5,22 @@ class AgentState(TypedDict):
     question: str
     sql_query: str
     query_result: str
-    query_rows: list
+    query_rows: dict
+    row_count: int
+    rows_truncated: bool
+    total_rows_estimate: int
     current_user: str
+    current_user_id: int
+    current_user_email: str
     attempts: int
     relevance: str
-    sql_error: bool
\ No newline at end of file
+    sql_error: bool
+    sql_error_message: str
+    sql_repaired: bool
+    sql_cache_key: str
+    sql_cache_hit: bool
+    menu_answered: bool
+    order_action: dict
+    order_pending: bool
+    order_rejected: str
+    thread_owner: str
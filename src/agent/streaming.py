@@ -0,0 +1,41 @@
+STREAMED_NODES = {"generate_human_readable_answer", "generate_funny_response"}
+STREAM_MODES = ["updates", "messages"]
+
+
+def _events(mode, chunk):
+    if mode == "messages":
+        message, metadata = chunk
+        if metadata.get("langgraph_node") in STREAMED_NODES and isinstance(message.content, str) and message.content:
+            yield "token", message.content
+    elif mode == "updates":
+        for node, update in chunk.items():
+            if node == "__interrupt__":
+                yield "interrupt", update[0].value
+            else:
+                yield "node", node
+
+
+def stream_turn(graph, graph_input, config):
+    """Run one turn and yield (kind, payload) events as they happen.
+
+    kinds: "node" when a node finishes, "token" for answer text as the model
+    generates it, then either "interrupt" (awaiting confirmation) or "final"
+    with the end state.
+    """
+    interrupted = False
+    for mode, chunk in graph.stream(graph_input, config=config, stream_mode=STREAM_MODES):
+        for kind, payload in _events(mode, chunk):
+            interrupted = interrupted or kind == "interrupt"
+            yield kind, payload
+    if not interrupted:
+        yield "final", graph.get_state(config).values
+
+
+async def astream_turn(graph, graph_input, config):
+    interrupted = False
+    async for mode, chunk in graph.astream(graph_input, config=config, stream_mode=STREAM_MODES):
+        for kind, payload in _events(mode, chunk):
+            interrupted = interrupted or kind == "interrupt"
+            yield kind, payload
+    if not interrupted:
+        yield "final", (await graph.aget_state(config)).values
@@ -1,18 +1,294 @@
-from sqlalchemy import inspect
+import hashlib
+import logging
+import math
+import os
+import re
+import threading
+import time
+from collections import deque
+from sqlalchemy import event, inspect
+from agent.cache import normalize_question
 
-def get_database_schema(engine):
+logger = logging.getLogger(__name__)
+
+# Seconds a schema snapshot stays valid without DDL; 0 keeps it until DDL is seen.
+SCHEMA_CACHE_TTL = float(os.getenv("SCHEMA_CACHE_TTL", "300"))
+
+DDL_KEYWORDS = ("create", "alter", "drop", "rename")
+
+# Prompts get the whole schema while it fits in SCHEMA_TOKEN_BUDGET; above that
+# only the SCHEMA_TOP_K tables that best match the question, plus join paths.
+SCHEMA_PRUNING = os.getenv("SCHEMA_PRUNING", "1") == "1"
+SCHEMA_TOKEN_BUDGET = int(os.getenv("SCHEMA_TOKEN_BUDGET", "1500"))
+SCHEMA_TOP_K = int(os.getenv("SCHEMA_TOP_K", "4"))
+# Comma-separated tables that are always kept, e.g. "users" for per-user scoping.
+SCHEMA_ALWAYS_TABLES = [t for t in os.getenv("SCHEMA_ALWAYS_TABLES", "").split(",") if t]
+TABLE_NAME_WEIGHT = 3.0
+NEIGHBOUR_WEIGHT = 0.25
+MAX_JOIN_PATH = 3
+# Bookkeeping tables the agent writes itself; never shown to the model nor accepted in generated SQL.
+INTERNAL_TABLES = frozenset(("order_keys",))
+
+
+def reflect_schema(engine):
     inspector = inspect(engine)
-    schema = ""
+    tables = {}
     for table_name in inspector.get_table_names():
-        schema += f"Table: {table_name}\n"
+        if table_name in INTERNAL_TABLES:
+            continue
+        pk_columns = set(inspector.get_pk_constraint(table_name).get("constrained_columns") or [])
+        fk_targets = {}
+        for fk in inspector.get_foreign_keys(table_name):
+            for local, remote in zip(fk["constrained_columns"], fk["referred_columns"]):
+                fk_targets[local] = f"{fk['referred_table']}.{remote}"
+        columns = []
         for column in inspector.get_columns(table_name):
-            col = f"- {column['name']}: {str(column['type'])}"
-            if column.get("primary_key"):
+            columns.append({
+                "name": column["name"],
+                "type": str(column["type"]),
+                "primary_key": column["name"] in pk_columns,
+                "foreign_key": fk_targets.get(column["name"]),
+            })
+        tables[table_name] = columns
+    return tables
+
+
+def render_schema(tables):
+    schema = ""
+    for table_name, columns in tables.items():
+        schema += f"Table: {table_name}\n"
+        for column in columns:
+            col = f"- {column['name']}: {column['type']}"
+            if column["primary_key"]:
                 col += ", Primary Key"
-            if column.get("foreign_keys"):
-                fk = list(column["foreign_keys"])[0]
-                col += f", Foreign Key to {fk.column.table.name}.{fk.column.name}"
+            if column["foreign_key"]:
+                col += f", Foreign Key to {column['foreign_key']}"
             schema += col + "\n"
         schema += "\n"
     return schema
 
+
+def get_database_schema(engine):
+    return render_schema(reflect_schema(engine))
+
+
+def estimate_tokens(text):
+    """Rough token count (about four characters per token for English and SQL)."""
+    return (len(text) + 3) // 4
+
+
+def name_terms(name):
+    """Split identifiers and questions into lowercase, crudely singularised terms."""
+    words = re.findall(r"[A-Z]?[a-z]+|[A-Z]+(?![a-z])|\d+", name.replace("_", " "))
+    terms = []
+    for word in words:
+        word = word.lower()
+        if len(word) > 3 and word.endswith("ies"):
+            word = word[:-3] + "y"
+        elif len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        terms.append(word)
+    return terms
+
+
+class SchemaIndex:
+    """Lexical index over table and column names and the foreign-key graph."""
+
+    def __init__(self, tables):
+        self.tables = tables
+        self.neighbours = {name: set() for name in tables}
+        weights = {}
+        for table, columns in tables.items():
+            table_weights = weights.setdefault(table, {})
+            for term in name_terms(table):
+                table_weights[term] = max(table_weights.get(term, 0.0), TABLE_NAME_WEIGHT)
+            for column in columns:
+                for term in name_terms(column["name"]):
+                    table_weights[term] = max(table_weights.get(term, 0.0), 1.0)
+                if column["foreign_key"]:
+                    target = column["foreign_key"].split(".")[0]
+                    if target in self.neighbours and target != table:
+                        self.neighbours[table].add(target)
+                        self.neighbours[target].add(table)
+        document_frequency = {}
+        for table_weights in weights.values():
+            for term in table_weights:
+                document_frequency[term] = document_frequency.get(term, 0) + 1
+        self.postings = {}
+        for table, table_weights in weights.items():
+            for term, weight in table_weights.items():
+                idf = math.log(1 + len(tables) / document_frequency[term])
+                self.postings.setdefault(term, []).append((table, weight * idf))
+
+    def score(self, question):
+        own = {}
+        for term in set(name_terms(question)):
+            for table, weight in self.postings.get(term, ()):
+                own[table] = own.get(table, 0.0) + weight
+        scores = dict(own)
+        for table, value in own.items():
+            for neighbour in self.neighbours[table]:
+                scores[neighbour] = scores.get(neighbour, 0.0) + NEIGHBOUR_WEIGHT * value
+        return scores
+
+    def join_path(self, start, goal):
+        """Shortest foreign-key path between two tables, at most MAX_JOIN_PATH hops."""
+        previous = {start: None}
+        queue = deque([start])
+        while queue:
+            table = queue.popleft()
+            if table == goal:
+                path = []
+                while table is not None:
+                    path.append(table)
+                    table = previous[table]
+                return path[::-1] if len(path) - 1 <= MAX_JOIN_PATH else []
+            for neighbour in self.neighbours[table]:
+                if neighbour not in previous:
+                    previous[neighbour] = table
+                    queue.append(neighbour)
+        return []
+
+    def select(self, question, top_k=SCHEMA_TOP_K, budget=SCHEMA_TOKEN_BUDGET, always=()):
+        """Pick tables for question: top_k by score, then join paths, within budget tokens."""
+        scores = self.score(question)
+        ranked = sorted((t for t in scores if t in self.tables), key=lambda t: (-scores[t], t))
+        seeds = [t for t in always if t in self.tables] + [t for t in ranked if t not in always][:top_k]
+        if not seeds:
+            return []
+        chosen = []
+        used = 0
+        for table in seeds:
+            if table in chosen:
+                continue
+            paths = [self.join_path(anchor, table) for anchor in chosen]
+            paths = [path[1:] for path in paths if path]
+            additions = min(paths, key=len) if paths else [table]
+            additions = [t for t in additions if t not in chosen]
+            cost = sum(estimate_tokens(render_schema({t: self.tables[t]})) for t in additions)
+            if chosen and used + cost > budget:
+                continue
+            chosen.extend(additions)
+            used += cost
+        return chosen
+
+
+class SchemaSnapshot:
+    __slots__ = ("tables", "text", "tokens", "hash", "built_at", "index")
+
+    def __init__(self, tables):
+        self.tables = tables
+        self.text = render_schema(tables)
+        self.tokens = estimate_tokens(self.text)
+        self.hash = hashlib.sha256(self.text.encode("utf-8")).hexdigest()[:16]
+        self.built_at = time.monotonic()
+        self.index = SchemaIndex(tables)
+
+    def for_question(self, question, budget=SCHEMA_TOKEN_BUDGET, top_k=SCHEMA_TOP_K):
+        """Schema text for a prompt about question, pruned when the full text exceeds budget."""
+        if not SCHEMA_PRUNING or self.tokens <= budget:
+            return self.text
+        chosen = set(self.index.select(normalize_question(question), top_k=top_k, budget=budget, always=SCHEMA_ALWAYS_TABLES))
+        if not chosen:
+            logger.info(f"No table matched the question, keeping the full schema ({self.tokens} tokens).")
+            return self.text
+        text = render_schema({name: columns for name, columns in self.tables.items() if name in chosen})
+        prune_stats.record(self.tokens, estimate_tokens(text))
+        logger.info(f"Schema pruned from {self.tokens} to {estimate_tokens(text)} tokens "
+                    f"({len(chosen)} of {len(self.tables)} tables: {', '.join(sorted(chosen))}).")
+        return text
+
+
+class PruneStats:
+    def __init__(self):
+        self.prompts = 0
+        self.full_tokens = 0
+        self.pruned_tokens = 0
+        self._lock = threading.Lock()
+
+    def record(self, full_tokens, pruned_tokens):
+        with self._lock:
+            self.prompts += 1
+            self.full_tokens += full_tokens
+            self.pruned_tokens += pruned_tokens
+
+    def stats(self):
+        return {
+            "prompts": self.prompts,
+            "full_tokens": self.full_tokens,
+            "pruned_tokens": self.pruned_tokens,
+            "saved_share": 1 - self.pruned_tokens / self.full_tokens if self.full_tokens else 0.0,
+        }
+
+
+prune_stats = PruneStats()
+
+
+class SchemaCache:
+    """Process-wide schema snapshots, one per engine.
+
+    A snapshot is rebuilt only after DDL runs through a watched engine or the
+    TTL expires, so nodes can ask for the schema on every call.
+    """
+
+    def __init__(self, ttl=SCHEMA_CACHE_TTL):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._snapshots = {}
+        self._watched = set()
+        self._lock = threading.Lock()
+
+    def get(self, engine):
+        key = id(engine)
+        with self._lock:
+            snapshot = self._snapshots.get(key)
+            if snapshot is not None and not self._expired(snapshot):
+                self.hits += 1
+                return snapshot
+            self.misses += 1
+            self._watch(engine)
+            snapshot = SchemaSnapshot(reflect_schema(engine))
+            self._snapshots[key] = snapshot
+            logger.info(f"Schema snapshot built ({len(snapshot.tables)} tables, hash {snapshot.hash}).")
+            return snapshot
+
+    def invalidate(self, engine=None):
+        with self._lock:
+            if engine is None:
+                self._snapshots.clear()
+            else:
+                self._snapshots.pop(id(engine), None)
+            self.invalidations += 1
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def _expired(self, snapshot):
+        return self.ttl > 0 and time.monotonic() - snapshot.built_at > self.ttl
+
+    def _watch(self, engine):
+        if id(engine) in self._watched:
+            return
+        self._watched.add(id(engine))
+        event.listen(engine, "after_cursor_execute", self._on_execute)
+
+    def _on_execute(self, conn, cursor, statement, parameters, context, executemany):
+        words = statement.lstrip().split(None, 1)
+        if words and words[0].lower() in DDL_KEYWORDS:
+            logger.info("DDL detected, invalidating schema snapshot.")
+            self.invalidate(conn.engine)
+
+
+schema_cache = SchemaCache()
+
+
+def get_schema_snapshot(engine):
+    return schema_cache.get(engine)
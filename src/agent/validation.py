@@ -0,0 +1,276 @@
+import json
+import logging
+import os
+import time
+from contextlib import asynccontextmanager, contextmanager
+from sqlalchemy import text
+from agent.cache import LRUCache
+from agent.sql_utils import main_keyword, split_statements, statement_kind, strip_statement, tokenize
+
+logger = logging.getLogger(__name__)
+
+# Check generated SQL against the schema snapshot before it reaches the database.
+SQL_VALIDATION = os.getenv("SQL_VALIDATION", "1") == "1"
+# Reject statements whose plan would visit more rows than this (0 disables the plan check).
+SQL_MAX_SCAN_ROWS = int(os.getenv("SQL_MAX_SCAN_ROWS", "50000000"))
+# Seconds a generated statement may run before it is interrupted (0 = no limit).
+SQL_STATEMENT_TIMEOUT = float(os.getenv("SQL_STATEMENT_TIMEOUT", "10"))
+# SQLite checks the deadline every this many virtual machine instructions.
+SQLITE_PROGRESS_STEPS = 10_000
+
+TABLE_KEYWORDS = ("from", "join", "into", "update", "table")
+CLAUSE_KEYWORDS = frozenset("""
+where group order having limit offset on using join inner left right full outer cross natural union
+intersect except window returning set values select from as and or not in is null like glob between
+case when then else end exists distinct all asc desc by collate escape default with recursive
+""".split())
+SQL_WORDS = CLAUSE_KEYWORDS | frozenset("""
+insert into update delete replace conflict do nothing abort fail ignore rollback true false
+current_date current_time current_timestamp cast integer int real text float numeric varchar boolean
+date datetime time timestamp interval filter over partition rows range preceding following unbounded current
+row ilike similar to nulls first last primary key rowid excluded
+""".split())
+
+
+class SQLValidationError(Exception):
+    """Generated SQL that was rejected before execution."""
+
+
+class StatementTimeout(Exception):
+    """A generated statement ran past SQL_STATEMENT_TIMEOUT and was interrupted."""
+
+
+def timeout_error(error, seconds):
+    return StatementTimeout(f"the query ran for more than {seconds:g}s and was stopped; make it more selective")
+
+
+def table_references(tokens):
+    """Tables named after FROM/JOIN/INTO/UPDATE, with {alias: table} and CTE names."""
+    tables, aliases, ctes = set(), {}, set()
+    if tokens and tokens[0][1] == "with":
+        depth = 0
+        for i, (kind, value) in enumerate(tokens):
+            if value == "(":
+                depth += 1
+            elif value == ")":
+                depth -= 1
+            elif depth == 0 and value in ("select", "insert", "update", "delete", "replace", "values"):
+                break
+            elif depth == 0 and kind in ("word", "ident") and i + 1 < len(tokens) and tokens[i + 1][1] in ("as", "("):
+                if value not in ("with", "recursive"):
+                    ctes.add(value.lower())
+    i = 0
+    while i < len(tokens):
+        kind, value = tokens[i]
+        i += 1
+        if kind != "word" or value not in TABLE_KEYWORDS:
+            continue
+        while i < len(tokens) and tokens[i][0] in ("word", "ident") and tokens[i][1] not in CLAUSE_KEYWORDS:
+            name = tokens[i][1].lower()
+            i += 1
+            if i + 1 < len(tokens) and tokens[i][1] == "." and tokens[i + 1][0] in ("word", "ident"):
+                name = tokens[i + 1][1].lower()  # schema-qualified, e.g. main.food
+                i += 2
+            if name not in ctes:
+                tables.add(name)
+            aliases[name] = name
+            if i < len(tokens) and tokens[i][1] == "as":
+                i += 1
+            if i < len(tokens) and tokens[i][0] in ("word", "ident") and tokens[i][1] not in CLAUSE_KEYWORDS:
+                aliases[tokens[i][1].lower()] = name
+                i += 1
+            if i < len(tokens) and tokens[i][1] == ",":
+                i += 1
+                continue
+            break
+    return tables, aliases, ctes
+
+
+def column_problems(tokens, schema, aliases, ctes):
+    """Unknown columns in alias.column references and, for plain statements, bare names."""
+    columns = {table: {c["name"].lower() for c in cols} for table, cols in schema.items()}
+    problems = []
+    for i in range(1, len(tokens) - 1):
+        if tokens[i][1] != "." or tokens[i + 1][0] not in ("word", "ident") or tokens[i - 1][0] not in ("word", "ident"):
+            continue
+        qualifier, column = tokens[i - 1][1].lower(), tokens[i + 1][1].lower()
+        table = aliases.get(qualifier)
+        if table is None and qualifier not in ctes:
+            problems.append(f"no such table or alias: {qualifier}")
+        elif table in columns and column not in columns[table] and (i + 2 >= len(tokens) or tokens[i + 2][1] != "."):
+            problems.append(f"no such column: {qualifier}.{column}")
+    subquery = any(value == "select" for _, value in tokens[1:])
+    if ctes or subquery or not all(table in columns for table in set(aliases.values())):
+        return problems
+    known = set().union(*(columns[table] for table in set(aliases.values()))) if aliases else set()
+    words = [i for i, (kind, value) in enumerate(tokens) if kind == "word" and value not in SQL_WORDS]
+    defined = {tokens[i][1] for i in words if i and is_alias(tokens, i)}
+    for i in words:
+        value = tokens[i][1]
+        if value in aliases or value in known or value in defined:
+            continue
+        following = tokens[i + 1][1] if i + 1 < len(tokens) else ""
+        if following in ("(", ".") or (i and tokens[i - 1][1] == "."):
+            continue  # function call or qualified name
+        if i and tokens[i - 1][1] == "collate":
+            continue  # collation name, e.g. NOCASE
+        problems.append(f"no such column: {value}")
+    return problems
+
+
+def is_alias(tokens, i):
+    """Whether the word at i names a result column or table (after AS, or right after an expression)."""
+    kind, value = tokens[i - 1]
+    following = tokens[i + 1][1] if i + 1 < len(tokens) else ""
+    if value == "as" or kind in ("ident", "number", "string"):
+        return True
+    if kind == "word" and value not in SQL_WORDS and following not in ("(", "."):
+        return True
+    return value == ")" and following in ("", ",", "from", "where", "group", "order", "limit", "having")
+
+
+def validate_sql(sql_query, schema, relevance=None):
+    """Return why sql_query must not run, or None.
+
+    schema is SchemaSnapshot.tables. Checks run on the text only, without
+    touching the database.
+    """
+    statements = split_statements(tokenize(sql_query))
+    kind = statement_kind(sql_query)
+    if kind == "empty":
+        return "the SQL query is empty"
+    if kind == "multiple":
+        return "only a single SQL statement is allowed"
+    if kind not in ("read", "write"):
+        return f"{(main_keyword(statements[0]) or kind).upper()} statements are not allowed"
+    if kind == "write" and relevance and relevance.lower() == "menu":
+        return "menu questions may only read from the database"
+    tokens = statements[0]
+    tables, aliases, ctes = table_references(tokens)
+    known_tables = {name.lower() for name in schema}
+    missing = sorted(table for table in tables if table not in known_tables)
+    if missing:
+        return f"no such table: {', '.join(missing)}"
+    problems = column_problems(tokens, {k.lower(): v for k, v in schema.items()}, aliases, ctes)
+    if problems:
+        return "; ".join(dict.fromkeys(problems))
+    return None
+
+
+row_estimates = LRUCache(maxsize=256, ttl=300)
+
+
+def table_rows(conn, table):
+    """Cheap row-count estimate: SQLite's max(rowid) is an index lookup, unlike COUNT(*)."""
+    key = (id(conn.engine), table)
+    rows = row_estimates.get(key)
+    if rows is None:
+        quoted = conn.dialect.identifier_preparer.quote(table)
+        rows = conn.execute(text(f"SELECT max(rowid) FROM {quoted}")).scalar() or 0
+        row_estimates.set(key, rows)
+    return rows
+
+
+def sqlite_scan_rows(conn, plan, aliases):
+    """Rows an SQLite plan visits: full scans multiply within a loop nest, nests add up."""
+    nests = {}
+    for _, parent, _, detail in plan:
+        if not detail.startswith("SCAN ") or detail.startswith(("SCAN CONSTANT", "SCAN (")):
+            continue
+        name = detail.split()[1].lower()
+        table = aliases.get(name, name)
+        try:
+            rows = table_rows(conn, table)
+        except Exception:
+            continue
+        nests[parent] = nests.get(parent, 1) * max(rows, 1)
+    return sum(nests.values())
+
+
+def plan_cost(session, sql_query):
+    """Estimated rows (SQLite) or planner cost (PostgreSQL) for sql_query; None if unknown."""
+    conn = session.connection()
+    sql_query = strip_statement(sql_query)
+    if conn.dialect.name == "sqlite":
+        plan = conn.execute(text(f"EXPLAIN QUERY PLAN {sql_query}")).all()
+        _, aliases, _ = table_references(tokenize(sql_query))
+        return sqlite_scan_rows(conn, plan, aliases)
+    if conn.dialect.name == "postgresql":
+        plan = conn.execute(text(f"EXPLAIN (FORMAT JSON) {sql_query}")).scalar()
+        plan = json.loads(plan) if isinstance(plan, str) else plan
+        return plan[0]["Plan"]["Total Cost"]
+    return None
+
+
+def check_plan(session, sql_query, max_rows=SQL_MAX_SCAN_ROWS):
+    """Dry-run sql_query through the planner; raise SQLValidationError when it is too costly."""
+    if not max_rows:
+        return None
+    cost = plan_cost(session, sql_query)
+    if cost is not None and cost > max_rows:
+        raise SQLValidationError(
+            f"the query would scan about {int(cost):,} rows (limit {max_rows:,}); add filters or join conditions"
+        )
+    return cost
+
+
+async def acheck_plan(session, sql_query, max_rows=SQL_MAX_SCAN_ROWS):
+    return await session.run_sync(lambda sync_session: check_plan(sync_session, sql_query, max_rows))
+
+
+@contextmanager
+def statement_timeout(session, seconds=SQL_STATEMENT_TIMEOUT):
+    """Interrupt statements run on session that take longer than seconds."""
+    if not seconds:
+        yield
+        return
+    conn = session.connection()
+    if conn.dialect.name == "sqlite":
+        raw = conn.connection.driver_connection
+        deadline = time.monotonic() + seconds
+        raw.set_progress_handler(lambda: time.monotonic() > deadline, SQLITE_PROGRESS_STEPS)
+        try:
+            yield
+        except Exception as e:
+            if "interrupted" in str(e) and time.monotonic() > deadline:
+                raise timeout_error(e, seconds) from e
+            raise
+        finally:
+            raw.set_progress_handler(None, 0)
+    else:
+        if conn.dialect.name == "postgresql":
+            conn.execute(text(f"SET LOCAL statement_timeout = {int(seconds * 1000)}"))
+        yield
+
+
+def check_sql(sql_query, schema, relevance=None):
+    """validate_sql when SQL_VALIDATION is on; raise SQLValidationError for a rejected query."""
+    if not SQL_VALIDATION:
+        return
+    problem = validate_sql(sql_query, schema, relevance)
+    if problem:
+        raise SQLValidationError(problem)
+
+
+@asynccontextmanager
+async def astatement_timeout(session, seconds=SQL_STATEMENT_TIMEOUT):
+    if not seconds:
+        yield
+        return
+    conn = await session.connection()
+    if conn.dialect.name == "sqlite":
+        raw = (await conn.get_raw_connection()).driver_connection
+        deadline = time.monotonic() + seconds
+        await raw.set_progress_handler(lambda: time.monotonic() > deadline, SQLITE_PROGRESS_STEPS)
+        try:
+            yield
+        except Exception as e:
+            if "interrupted" in str(e) and time.monotonic() > deadline:
+                raise timeout_error(e, seconds) from e
+            raise
+        finally:
+            await raw.set_progress_handler(None, 0)
+    else:
+        if conn.dialect.name == "postgresql":
+            await conn.execute(text(f"SET LOCAL statement_timeout = {int(seconds * 1000)}"))
+        yield
@@ -1,70 +1,138 @@
+import logging
+import time
 from langgraph.graph import StateGraph, END
 from agent.state import AgentState
-from agent.nodes import * 
-from langgraph.checkpoint.memory import MemorySaver
-
-# Set up memory
-memory = MemorySaver()
-
-workflow = StateGraph(AgentState)
-
-workflow.add_node("get_current_user", get_current_user)
-workflow.add_node("check_relevance", check_relevance)
-workflow.add_node("convert_to_sql", convert_nl_to_sql)
-workflow.add_node("execute_sql", execute_sql)
-workflow.add_node("generate_human_readable_answer", generate_human_readable_answer)
-workflow.add_node("regenerate_query", regenerate_query)
-workflow.add_node("generate_funny_response", generate_funny_response)
-workflow.add_node("end_max_iterations", end_max_iterations)
-workflow.add_node("confirm_order", confirm_order)
-workflow.add_node("cancel_order", cancel_order)
-
-workflow.add_edge("get_current_user", "check_relevance")
-
-workflow.add_conditional_edges(
-    "check_relevance",
-    relevance_router,
-    {
-        "convert_to_sql": "convert_to_sql",
-        "generate_funny_response": "generate_funny_response",
-    },
-)
-
-#workflow.add_edge("convert_to_sql", "execute_sql")
-workflow.add_conditional_edges(
-    "convert_to_sql",
-    confirm_router,
-    {
-        "confirm_order": "confirm_order",
-        "execute_sql": "execute_sql",
-    },
-)
-
-
-workflow.add_conditional_edges(
-    "execute_sql",
-    execute_sql_router,
-    {
-        "generate_human_readable_answer": "generate_human_readable_answer",
-        "regenerate_query": "regenerate_query",
-    },
-)
-
-workflow.add_conditional_edges(
-    "regenerate_query",
-    check_attempts_router,
-    {
-        "convert_to_sql": "convert_to_sql",
-        "max_iterations": "end_max_iterations",
-    },
-)
-
-workflow.add_edge("cancel_order", END)
-
-workflow.add_edge("generate_human_readable_answer", END)
-workflow.add_edge("generate_funny_response", END)
-workflow.add_edge("end_max_iterations", END)
-
-workflow.set_entry_point("get_current_user")
-
-app = workflow.compile(checkpointer=memory)
\ No newline at end of file
+from agent.nodes import *
+from agent.async_nodes import *
+from agent.checkpoint import PersistentSaver
+from agent.metrics import instrument
+from agent.llm import warm_models
+
+logger = logging.getLogger(__name__)
+
+# Set up memory (SQLite file shared by both graphs, see CHECKPOINT_DB)
+memory = PersistentSaver.from_path()
+
+sync_nodes = {
+    "get_current_user": get_current_user,
+    "check_relevance": check_relevance,
+    "convert_to_sql": convert_nl_to_sql,
+    "execute_sql": execute_sql,
+    "generate_human_readable_answer": generate_human_readable_answer,
+    "regenerate_query": regenerate_query,
+    "generate_funny_response": generate_funny_response,
+    "end_max_iterations": end_max_iterations,
+    "confirm_order": confirm_order,
+    "cancel_order": cancel_order,
+}
+
+async_nodes = {
+    **sync_nodes,
+    "get_current_user": aget_current_user,
+    "check_relevance": acheck_relevance,
+    "convert_to_sql": aconvert_nl_to_sql,
+    "execute_sql": aexecute_sql,
+    "generate_human_readable_answer": agenerate_human_readable_answer,
+    "regenerate_query": aregenerate_query,
+    "generate_funny_response": agenerate_funny_response,
+}
+
+
+def build_workflow(nodes):
+    workflow = StateGraph(AgentState)
+
+    for name, node in nodes.items():
+        workflow.add_node(name, instrument(name, node))
+
+    workflow.add_edge("get_current_user", "check_relevance")
+
+    workflow.add_conditional_edges(
+        "check_relevance",
+        relevance_router,
+        {
+            "convert_to_sql": "convert_to_sql",
+            "generate_funny_response": "generate_funny_response",
+        },
+    )
+
+    #workflow.add_edge("convert_to_sql", "execute_sql")
+    workflow.add_conditional_edges(
+        "convert_to_sql",
+        confirm_router,
+        {
+            "confirm_order": "confirm_order",
+            "execute_sql": "execute_sql",
+            "generate_human_readable_answer": "generate_human_readable_answer",
+        },
+    )
+
+
+    workflow.add_conditional_edges(
+        "execute_sql",
+        execute_sql_router,
+        {
+            "generate_human_readable_answer": "generate_human_readable_answer",
+            "regenerate_query": "regenerate_query",
+        },
+    )
+
+    workflow.add_conditional_edges(
+        "regenerate_query",
+        check_attempts_router,
+        {
+            "convert_to_sql": "convert_to_sql",
+            "confirm_order": "confirm_order",
+            "execute_sql": "execute_sql",
+            "end_max_iterations": "end_max_iterations",
+        },
+    )
+
+    workflow.add_edge("cancel_order", END)
+
+    workflow.add_edge("generate_human_readable_answer", END)
+    workflow.add_edge("generate_funny_response", END)
+    workflow.add_edge("end_max_iterations", END)
+
+    workflow.set_entry_point("get_current_user")
+    return workflow
+
+
+workflow = build_workflow(sync_nodes)
+
+app = workflow.compile(checkpointer=memory)
+# Same graph with awaitable nodes; drive it with ainvoke/astream.
+async_app = build_workflow(async_nodes).compile(checkpointer=memory)
+
+
+def warmup(model=True):
+    """Pay the one-time startup costs before the first customer turn.
+
+    Builds the graph drawables, configures the ORM mappers, opens the
+    checkpointer, loads the schema and menu snapshots and, with model=True,
+    has Ollama load the route models. Returns
+    seconds per step; a failing step is logged and skipped.
+    """
+    from sqlalchemy.orm import configure_mappers
+    from database import database
+
+    steps = {
+        "graph": lambda: (app.get_graph(), async_app.get_graph()),
+        "orm": configure_mappers,
+        "checkpointer": memory.setup,
+        "schema": lambda: get_schema_snapshot(database.engine).for_question("menu"),
+        "menu": menu_index.snapshot,
+    }
+    if database.read_engine is not database.engine:
+        steps["read_schema"] = lambda: get_schema_snapshot(database.read_engine)
+    if model:
+        steps["model"] = warm_models
+    timings = {}
+    for name, step in steps.items():
+        started = time.perf_counter()
+        try:
+            step()
+        except Exception as e:
+            logger.warning(f"Warmup step '{name}' failed: {str(e)}")
+        timings[name] = round(time.perf_counter() - started, 6)
+    logger.info(f"Warmup finished: {timings}")
+    return timings
@@ -1,5 +1,6 @@
 import streamlit as st
-from agent.workflow import app
+from agent.workflow import app, warmup
+from agent.streaming import stream_turn
 from langgraph.types import Command
 import uuid
 
@@ -40,6 +41,38 @@ st.set_page_config(page_title="🍽️ Restaurant Chatbot", page_icon="🍔", la
 st.title("🍽️ Welcome to ChatFood Restaurant!")
 st.caption("🛎️ Your personal assistant for ordering delicious food.")
 
+@st.cache_resource(show_spinner="🔥 Warming up the kitchen...")
+def warm_agent():
+    # Once per server process, so the first customer does not wait for the model to load.
+    return warmup()
+
+warm_agent()
+
+def stream_response(graph_input):
+    """Stream one graph run into the current chat message; returns the final state or None on interrupt."""
+    outcome = {}
+    progress = st.empty()
+
+    def tokens():
+        first = True
+        for kind, payload in stream_turn(app, graph_input, config):
+            if kind == "node":
+                progress.caption(f"⏳ {payload.replace('_', ' ')}...")
+            elif kind == "token":
+                if first:
+                    first = False
+                    yield "🍽️ "
+                yield payload
+            else:
+                outcome[kind] = payload
+
+    streamed = st.write_stream(tokens())
+    progress.empty()
+    final = outcome.get("final")
+    if final is not None and not streamed:
+        st.markdown("🍽️ " + final["query_result"])
+    return final
+
 # -------------------------
 # 3) Display Chat History
 # -------------------------
@@ -56,13 +89,12 @@ if prompt := st.chat_input("Type your order here... 🍽️"):
     with st.chat_message("user"):
         st.markdown(user_msg)
 
-    response = app.invoke({"question": f"user: {prompt}", "attempts": 0}, config=config)
+    with st.chat_message("assistant"):
+        response = stream_response({"question": f"user: {prompt}", "attempts": 0})
 
-    if isinstance(response, dict) and "query_result" in response:
+    if response is not None:
         assistant_msg = "🍽️ " + response["query_result"]
         st.session_state.messages.append({"role": "assistant", "content": assistant_msg})
-        with st.chat_message("assistant"):
-            st.markdown(assistant_msg)
         reset_confirmation_state()
     else:
         st.session_state.awaiting_confirmation = True
@@ -86,9 +118,8 @@ if st.session_state.awaiting_confirmation:
 # 6) Handle Confirmation
 # -------------------------
 if st.session_state.confirmation_response:
-    response = app.invoke(Command(resume=st.session_state.confirmation_response), config=config)
+    with st.chat_message("assistant"):
+        response = stream_response(Command(resume=st.session_state.confirmation_response))
     assistant_msg = "🍽️ " + response["query_result"]
     st.session_state.messages.append({"role": "assistant", "content": assistant_msg})
-    with st.chat_message("assistant"):
-        st.markdown(assistant_msg)
     reset_confirmation_state()
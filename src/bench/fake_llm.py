@@ -0,0 +1,164 @@
+import asyncio
+import re
+import threading
+import time
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.runnables import RunnableLambda
+
+MENU_SQL = "SELECT name AS food_name, price, description AS food_description FROM food"
+ORDERS_SQL = (
+    "SELECT food.name AS food_name, food.price AS price FROM orders "
+    "JOIN food ON food.id = orders.food_id JOIN users ON users.id = orders.user_id "
+    "WHERE users.name = '{user}'"
+)
+PLACE_ORDER_SQL = (
+    "INSERT INTO orders (food_id, user_id) SELECT food.id, users.id FROM food, users "
+    "WHERE food.name = '{dish}' AND users.name = '{user}'"
+)
+BROKEN_SQL = "SELECT name FROM no_such_table"
+
+
+class CallStats:
+    def __init__(self):
+        self.calls = 0
+        self.prompt_chars = 0
+        self._lock = threading.Lock()
+
+    def record(self, prompt):
+        with self._lock:
+            self.calls += 1
+            self.prompt_chars += len(prompt)
+
+
+stats = CallStats()
+
+
+def _messages_text(value):
+    messages = value.to_messages() if hasattr(value, "to_messages") else value
+    return [(m.type, m.content) for m in messages]
+
+
+def _question(messages):
+    human = [content for kind, content in messages if kind == "human"]
+    text = human[-1] if human else ""
+    match = re.search(r"(?:Original )?Question:\s*(.*?)(?:\n|$)", text)
+    return (match.group(1) if match else text).strip()
+
+
+def _current_user(messages):
+    for kind, content in messages:
+        match = re.search(r"current user is '([^']*)'", content)
+        if match:
+            return match.group(1)
+        match = re.search(r"starting with 'Hello ([^,']*),'", content)
+        if match:
+            return match.group(1)
+    return "guest"
+
+
+def scripted_output(schema_name, messages):
+    """Deterministic answer for a structured-output call, chosen from the prompt."""
+    question = _question(messages).lower()
+    if schema_name == "CheckRelevance":
+        if "menu" in question or "price" in question:
+            return {"relevance": "menu"}
+        if "order" in question or "want" in question:
+            return {"relevance": "order"}
+        return {"relevance": "not_relevant"}
+    if schema_name == "ConvertToSQL":
+        system = " ".join(content for kind, content in messages if kind == "system")
+        if any("Database error:" in content for kind, content in messages if kind == "human"):
+            return {"sql_query": MENU_SQL if "menu" in question else ORDERS_SQL.format(user=_current_user(messages))}
+        if "broken" in question:
+            return {"sql_query": BROKEN_SQL}
+        if "about the menu" in system:
+            return {"sql_query": MENU_SQL}
+        user = _current_user(messages)
+        match = re.search(r"want (?:an? |some )?(\w+)", question)
+        if match:
+            return {"sql_query": PLACE_ORDER_SQL.format(dish=match.group(1), user=user)}
+        return {"sql_query": ORDERS_SQL.format(user=user)}
+    if schema_name == "RewrittenQuestion":
+        return {"question": question.replace("broken", "").strip() + " (rewritten)"}
+    raise ValueError(f"No script for structured output {schema_name}")
+
+
+class ScriptedChatModel(BaseChatModel):
+    """Offline stand-in for ChatOllama with configurable latency.
+
+    latency is paid once per call (prompt processing), token_latency once per
+    streamed token.
+    """
+
+    latency: float = 0.0
+    token_latency: float = 0.0
+    reply_words: int = 24
+
+    @property
+    def _llm_type(self):
+        return "scripted"
+
+    def _reply(self, messages):
+        user = _current_user(_messages_text(messages))
+        words = [f"Hello {user},"] + ["here"] * max(self.reply_words - 1, 0)
+        return [word + " " for word in words]
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        stats.record(str(messages))
+        time.sleep(self.latency)
+        tokens = self._reply(messages)
+        time.sleep(self.token_latency * len(tokens))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content="".join(tokens)))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        stats.record(str(messages))
+        await asyncio.sleep(self.latency)
+        tokens = self._reply(messages)
+        await asyncio.sleep(self.token_latency * len(tokens))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content="".join(tokens)))])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        stats.record(str(messages))
+        time.sleep(self.latency)
+        for token in self._reply(messages):
+            time.sleep(self.token_latency)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager:
+                run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        stats.record(str(messages))
+        await asyncio.sleep(self.latency)
+        for token in self._reply(messages):
+            await asyncio.sleep(self.token_latency)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager:
+                await run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+
+    def with_structured_output(self, schema, **kwargs):
+        def run(value):
+            messages = _messages_text(value)
+            stats.record(str(messages))
+            time.sleep(self.latency)
+            return schema(**scripted_output(schema.__name__, messages))
+
+        async def arun(value):
+            messages = _messages_text(value)
+            stats.record(str(messages))
+            await asyncio.sleep(self.latency)
+            return schema(**scripted_output(schema.__name__, messages))
+
+        return RunnableLambda(run, afunc=arun, name=f"scripted_{schema.__name__}")
+
+
+def install(latency=0.0, token_latency=0.0):
+    """Route every agent LLM client to ScriptedChatModel; call before importing agent.workflow."""
+    from agent import llm
+
+    llm.use_chat_model(lambda **kwargs: ScriptedChatModel(
+        latency=latency, token_latency=token_latency, callbacks=kwargs.get("callbacks"),
+    ))
@@ -0,0 +1,289 @@
+"""Offline end-to-end benchmark for agent.workflow.app.
+
+Runs the compiled graph against bench.fake_llm.ScriptedChatModel on freshly
+seeded databases and reports per-node and per-turn latency percentiles,
+throughput under concurrent threads and memory growth:
+
+    cd src
+    python -m bench.run --sizes small,medium --concurrency 1,8 --turns 200 --latency 0.05
+    python -m bench.run --compare bench_results/previous.json
+
+Each database size runs in its own subprocess so engines, caches and the
+checkpointer start cold.
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+SIZES = {
+    "small": {"users": 10, "foods": 20, "orders": 1_000},
+    "medium": {"users": 1_000, "foods": 200, "orders": 100_000},
+    "large": {"users": 10_000, "foods": 1_000, "orders": 1_000_000},
+}
+
+SCENARIOS = {
+    "menu": ["show me the menu", "what is on the menu today?", "menu please"],
+    "order_confirm": ["I want spaghetti", "I want salad", "I want sandwich"],
+    "not_relevant": ["tell me a joke", "what is the weather like?", "who won the game yesterday?"],
+    "regenerate": ["show me the broken menu"],
+}
+
+
+def percentiles(samples):
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+
+    def rank(p):
+        return ordered[min(len(ordered) - 1, max(0, int(round(p / 100 * len(ordered))) - 1))]
+
+    return {
+        "count": len(ordered),
+        "mean_ms": round(sum(ordered) / len(ordered) * 1000, 3),
+        "p50_ms": round(rank(50) * 1000, 3),
+        "p95_ms": round(rank(95) * 1000, 3),
+        "p99_ms": round(rank(99) * 1000, 3),
+    }
+
+
+def rss_bytes():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def seed_database(url, users, foods, orders, seed=0):
+    from sqlalchemy import create_engine
+    from database.setup_db import generate_db
+
+    engine = create_engine(url)
+    generate_db(engine, users, foods, orders, seed=seed)
+    engine.dispose()
+
+
+class NodeTimer:
+    """Callback handler that times every graph node run."""
+
+    def __init__(self):
+        from langchain_core.callbacks import BaseCallbackHandler
+
+        timer = self
+
+        class Handler(BaseCallbackHandler):
+            def on_chain_start(self, serialized, inputs, *, run_id, metadata=None, **kwargs):
+                if metadata and kwargs.get("name") == metadata.get("langgraph_node"):
+                    timer.started[run_id] = (kwargs["name"], time.perf_counter())
+
+            def on_chain_end(self, outputs, *, run_id, **kwargs):
+                timer.finish(run_id)
+
+            def on_chain_error(self, error, *, run_id, **kwargs):
+                timer.finish(run_id)
+
+        self.handler = Handler()
+        self.started = {}
+        self.samples = {}
+        self._lock = threading.Lock()
+
+    def finish(self, run_id):
+        entry = self.started.pop(run_id, None)
+        if entry is None:
+            return
+        name, started = entry
+        with self._lock:
+            self.samples.setdefault(name, []).append(time.perf_counter() - started)
+
+    def reset(self):
+        with self._lock:
+            self.samples = {}
+
+
+def run_turn(app, scenario, question, user_id, timer):
+    from langgraph.types import Command
+
+    config = {
+        "configurable": {"thread_id": str(uuid.uuid4()), "current_user_id": str(user_id)},
+        "callbacks": [timer.handler],
+    }
+    started = time.perf_counter()
+    response = app.invoke({"question": f"user: {question}", "attempts": 0}, config=config)
+    if "__interrupt__" in response:
+        response = app.invoke(Command(resume="Yes"), config=config)
+    elapsed = time.perf_counter() - started
+    if not response.get("query_result"):
+        raise RuntimeError(f"{scenario} turn finished without a result")
+    return elapsed
+
+
+def run_child(args):
+    from bench import fake_llm
+
+    fake_llm.install(latency=args.latency, token_latency=args.token_latency)
+    from agent.workflow import app, memory
+
+    size = SIZES[args.size]
+    timer = NodeTimer()
+    plan = [(scenario, question) for scenario, questions in SCENARIOS.items() for question in questions]
+    run_turn(app, "warmup", "show me the menu", 1, timer)
+    numbers = itertools.count()
+    results = []
+    for concurrency in args.concurrency:
+        timer.reset()
+        turn_samples = {scenario: [] for scenario in SCENARIOS}
+        errors = 0
+        calls_before = fake_llm.stats.calls
+        rss_before = rss_bytes()
+        rng = random.Random(args.seed)
+        jobs = [plan[i % len(plan)] + (rng.randint(1, size["users"]), next(numbers)) for i in range(args.turns)]
+
+        def job(item):
+            scenario, question, user_id, number = item
+            if scenario == "regenerate":
+                # Unique across the whole run: otherwise the SQL cache serves the repaired query and the repair loop never runs again.
+                question = f"{question} {number}"
+            return scenario, run_turn(app, scenario, question, user_id, timer)
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            for future in [pool.submit(job, item) for item in jobs]:
+                try:
+                    scenario, elapsed = future.result()
+                    turn_samples[scenario].append(elapsed)
+                except Exception as e:
+                    errors += 1
+                    print(f"turn failed: {e}", file=sys.stderr)
+        wall = time.perf_counter() - started
+        all_turns = [sample for samples in turn_samples.values() for sample in samples]
+        results.append({
+            "size": args.size,
+            **size,
+            "concurrency": concurrency,
+            "turns": args.turns,
+            "errors": errors,
+            "wall_s": round(wall, 3),
+            "turns_per_s": round(len(all_turns) / wall, 3) if wall else 0.0,
+            "turn_latency": {"all": percentiles(all_turns), **{k: percentiles(v) for k, v in turn_samples.items()}},
+            "node_latency": {name: percentiles(samples) for name, samples in sorted(timer.samples.items())},
+            "llm_calls_per_turn": round((fake_llm.stats.calls - calls_before) / max(len(all_turns), 1), 3),
+            "rss_growth_bytes": rss_bytes() - rss_before,
+            "rss_bytes": rss_bytes(),
+            "checkpoint": memory.footprint(),
+        })
+    with open(args.child_output, "w") as f:
+        json.dump(results, f)
+
+
+def run_size(size, args, workdir):
+    database = os.path.join(workdir, f"{size}.db")
+    url = f"sqlite:///{database}"
+    started = time.perf_counter()
+    seed_database(url, seed=args.seed, **SIZES[size])
+    seed_s = time.perf_counter() - started
+    output = os.path.join(workdir, f"{size}.json")
+    env = dict(
+        os.environ,
+        DATABASE_URL=url,
+        CHECKPOINT_DB=os.path.join(workdir, f"{size}-checkpoints.db"),
+        SQL_CACHE_PATH="",
+        # Node progress is logged at INFO on every step.
+        AGENT_LOG_LEVEL="WARNING",
+    )
+    command = [
+        sys.executable, "-m", "bench.run", "--child", "--size", size,
+        "--child-output", output,
+        "--turns", str(args.turns),
+        "--concurrency", ",".join(str(c) for c in args.concurrency),
+        "--latency", str(args.latency),
+        "--token-latency", str(args.token_latency),
+        "--seed", str(args.seed),
+    ]
+    subprocess.run(command, env=env, check=True, cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    with open(output) as f:
+        results = json.load(f)
+    for result in results:
+        result["seed_s"] = round(seed_s, 3)
+    return results
+
+
+def compare(current, baseline):
+    index = {(r["size"], r["concurrency"]): r for r in baseline["results"]}
+    for result in current["results"]:
+        old = index.get((result["size"], result["concurrency"]))
+        if old is None:
+            continue
+        print(f"{result['size']} x{result['concurrency']}: "
+              f"turns/s {old['turns_per_s']} -> {result['turns_per_s']}")
+        for scenario, stats in result["turn_latency"].items():
+            before = old["turn_latency"].get(scenario, {})
+            if stats.get("count") and before.get("count"):
+                print(f"  {scenario:14} p50 {before['p50_ms']:>9} -> {stats['p50_ms']:>9} ms"
+                      f"   p95 {before['p95_ms']:>9} -> {stats['p95_ms']:>9} ms")
+
+
+def summarize(report):
+    for result in report["results"]:
+        overall = result["turn_latency"]["all"]
+        print(f"{result['size']:>6} x{result['concurrency']:<3} {result['turns_per_s']:>8} turns/s"
+              f"  p50 {overall.get('p50_ms')} ms  p95 {overall.get('p95_ms')} ms  p99 {overall.get('p99_ms')} ms"
+              f"  llm/turn {result['llm_calls_per_turn']}  errors {result['errors']}"
+              f"  rss +{result['rss_growth_bytes'] // 1024} KiB")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="small", help=f"comma-separated, from {', '.join(SIZES)}")
+    parser.add_argument("--concurrency", default="1,4", type=lambda v: [int(c) for c in v.split(",")])
+    parser.add_argument("--turns", type=int, default=100, help="turns per concurrency level")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds per fake LLM call")
+    parser.add_argument("--token-latency", type=float, default=0.0, help="seconds per streamed token")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="JSON results path")
+    parser.add_argument("--compare", default=None, help="previous JSON results to diff against")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--size", help=argparse.SUPPRESS)
+    parser.add_argument("--child-output", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        run_child(args)
+        return
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "args": {k: v for k, v in vars(args).items() if not k.startswith("child") and k != "size"},
+        },
+        "results": [],
+    }
+    with tempfile.TemporaryDirectory(prefix="agent-bench-") as workdir:
+        for size in args.sizes.split(","):
+            report["results"].extend(run_size(size, args, workdir))
+
+    output = args.output or os.path.join("bench_results", f"{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    summarize(report)
+    print(f"Results written to {output}")
+    if args.compare:
+        with open(args.compare) as f:
+            compare(report, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
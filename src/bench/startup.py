@@ -0,0 +1,151 @@
+"""Startup benchmark: import times, warmup steps and first-turn latency.
+
+Every measurement runs in a fresh interpreter so nothing is already imported
+or cached:
+
+    cd src
+    python -m bench.startup
+    python -m bench.startup --repeat 5 --output startup.json
+    python -m bench.startup --max-import-ms 2000 --max-first-turn-ms 500   # exit 1 when over budget
+    python -m bench.startup --ollama   # real model instead of bench.fake_llm
+
+The first turn is timed twice: in a process that called agent.workflow.warmup()
+and in one that did not, so the gap is what warmup saves the first customer.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+IMPORT_MODULES = ("agent", "database.database", "agent.llm", "agent.nodes", "agent.workflow", "server")
+TURNS = ("show me the menu", "I want salad")
+
+
+def child_import(module):
+    started = time.perf_counter()
+    __import__(module)
+    return {"seconds": time.perf_counter() - started}
+
+
+def child_turns(warm, ollama, latency):
+    if not ollama:
+        from bench import fake_llm
+
+        fake_llm.install(latency=latency)
+    started = time.perf_counter()
+    from agent.workflow import app, warmup
+
+    result = {"import_s": time.perf_counter() - started, "warmup": warmup(model=True) if warm else {}}
+    turns = []
+    for question in TURNS:
+        config = {"configurable": {"thread_id": str(uuid.uuid4()), "current_user_id": "1"}}
+        started = time.perf_counter()
+        app.invoke({"question": f"user: {question}", "attempts": 0}, config=config)
+        turns.append(time.perf_counter() - started)
+    result["first_turn_s"], result["second_turn_s"] = turns
+    return result
+
+
+def run_child(args, *child_args):
+    command = [sys.executable, "-m", "bench.startup", "--child", *child_args]
+    if args.ollama:
+        command.append("--ollama")
+    output = subprocess.run(
+        command, env=args.env, check=True, capture_output=True, text=True,
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def median_ms(samples):
+    return round(statistics.median(samples) * 1000, 3)
+
+
+def measure(args):
+    report = {"imports_ms": {}, "turns": {}}
+    for module in IMPORT_MODULES:
+        samples = [run_child(args, "import", module)["seconds"] for _ in range(args.repeat)]
+        report["imports_ms"][module] = median_ms(samples)
+    for label, warm in (("cold", False), ("warm", True)):
+        runs = [run_child(args, "turns", "1" if warm else "0", str(args.latency)) for _ in range(args.repeat)]
+        report["turns"][label] = {
+            "first_turn_ms": median_ms([run["first_turn_s"] for run in runs]),
+            "second_turn_ms": median_ms([run["second_turn_s"] for run in runs]),
+            "warmup_ms": {
+                step: median_ms([run["warmup"][step] for run in runs]) for step in runs[0]["warmup"]
+            },
+        }
+    return report
+
+
+def over_budget(report, max_import_ms, max_first_turn_ms):
+    problems = []
+    slowest = max(report["imports_ms"].values())
+    if max_import_ms and slowest > max_import_ms:
+        problems.append(f"slowest import {slowest} ms > {max_import_ms} ms")
+    first_turn = report["turns"]["warm"]["first_turn_ms"]
+    if max_first_turn_ms and first_turn > max_first_turn_ms:
+        problems.append(f"first turn after warmup {first_turn} ms > {max_first_turn_ms} ms")
+    return problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=3, help="fresh processes per measurement (median is reported)")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds per fake LLM call")
+    parser.add_argument("--ollama", action="store_true", help="use the configured Ollama model")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max-import-ms", type=float, default=0, help="fail when any import is slower")
+    parser.add_argument("--max-first-turn-ms", type=float, default=0, help="fail when the warmed first turn is slower")
+    parser.add_argument("--output", default=None, help="JSON results path")
+    parser.add_argument("--child", nargs="+", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        kind, *rest = args.child
+        if kind == "import":
+            result = child_import(rest[0])
+        else:
+            result = child_turns(rest[0] == "1", args.ollama, float(rest[1]))
+        print(json.dumps(result))
+        return
+
+    from bench.run import SIZES, seed_database
+
+    with tempfile.TemporaryDirectory(prefix="agent-startup-") as workdir:
+        url = f"sqlite:///{os.path.join(workdir, 'small.db')}"
+        seed_database(url, seed=args.seed, **SIZES["small"])
+        args.env = dict(
+            os.environ,
+            DATABASE_URL=url,
+            CHECKPOINT_DB=os.path.join(workdir, "checkpoints.db"),
+            SQL_CACHE_PATH="",
+            AGENT_LOG_LEVEL="WARNING",
+        )
+        report = measure(args)
+    report["meta"] = {"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": sys.version.split()[0],
+                      "repeat": args.repeat, "ollama": args.ollama}
+
+    for module, ms in report["imports_ms"].items():
+        print(f"import {module:<18} {ms:>9} ms")
+    for label, turns in report["turns"].items():
+        print(f"{label:>4}: first turn {turns['first_turn_ms']} ms, second turn {turns['second_turn_ms']} ms"
+              + (f", warmup {turns['warmup_ms']}" if turns["warmup_ms"] else ""))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.output}")
+    problems = over_budget(report, args.max_import_ms, args.max_first_turn_ms)
+    for problem in problems:
+        print(f"over budget: {problem}", file=sys.stderr)
+    if problems:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
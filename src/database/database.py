@@ -1,10 +1,123 @@
 import os
-from sqlalchemy import create_engine
+import threading
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker
 from dotenv import load_dotenv
 
 load_dotenv()
 
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///example.db")
-engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
\ No newline at end of file
+# Optional replica for read-only SELECTs; defaults to the primary.
+DATABASE_READ_URL = os.getenv("DATABASE_READ_URL", "")
+
+# Pool settings apply to PostgreSQL and file SQLite (both pooled with QueuePool); in-memory SQLite has no pool.
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "1") == "1"
+
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_CACHE_SIZE = int(os.getenv("SQLITE_CACHE_SIZE", "-16000"))  # negative = KiB
+SQLITE_BUSY_TIMEOUT = int(os.getenv("SQLITE_BUSY_TIMEOUT", "5000"))  # ms
+# Enforce foreign keys (off by default, as in SQLite); with it, inserting an order for a deleted dish fails.
+SQLITE_FOREIGN_KEYS = os.getenv("SQLITE_FOREIGN_KEYS", "0") == "1"
+
+
+def sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"PRAGMA journal_mode={SQLITE_JOURNAL_MODE}")
+    cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+    cursor.execute(f"PRAGMA cache_size={SQLITE_CACHE_SIZE}")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT}")
+    if SQLITE_FOREIGN_KEYS:
+        cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.close()
+
+
+def is_memory_sqlite(url):
+    return url.startswith("sqlite") and (":memory:" in url or url.split("://", 1)[-1] in ("", "/"))
+
+
+def pool_options(url):
+    if is_memory_sqlite(url):
+        return {"pool_pre_ping": DB_POOL_PRE_PING}
+    return {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+
+
+def make_engine(url, **kwargs):
+    """Create an engine with the pool and SQLite settings taken from the environment."""
+    engine = create_engine(url, **pool_options(url), **kwargs)
+    if url.startswith("sqlite") and not is_memory_sqlite(url):
+        event.listen(engine, "connect", sqlite_pragmas)
+    return engine
+
+
+_engines_lock = threading.Lock()
+
+
+def _build_engines():
+    engine = make_engine(DATABASE_URL)
+    read_engine = make_engine(DATABASE_READ_URL) if DATABASE_READ_URL else engine
+    return {
+        "engine": engine,
+        "SessionLocal": sessionmaker(autocommit=False, autoflush=False, bind=engine),
+        "read_engine": read_engine,
+        "ReadSessionLocal": sessionmaker(autocommit=False, autoflush=False, bind=read_engine),
+    }
+
+
+def __getattr__(name):
+    # engine, SessionLocal, read_engine and ReadSessionLocal are created on
+    # first access (PEP 562) rather than when the module is imported.
+    if name in ("engine", "SessionLocal", "read_engine", "ReadSessionLocal"):
+        with _engines_lock:
+            if name not in globals():
+                globals().update(_build_engines())
+        return globals()[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def to_async_url(url):
+    if url.startswith("sqlite:"):
+        return "sqlite+aiosqlite:" + url[len("sqlite:"):]
+    if url.startswith(("postgresql:", "postgres:")):
+        return "postgresql+asyncpg:" + url.split(":", 1)[1]
+    return url
+
+
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL", to_async_url(DATABASE_URL))
+ASYNC_DATABASE_READ_URL = os.getenv(
+    "ASYNC_DATABASE_READ_URL", to_async_url(DATABASE_READ_URL) if DATABASE_READ_URL else ""
+)
+_async_engines = {}
+_async_sessionmakers = {}
+
+
+def get_async_engine(read=False):
+    # Built on first use so the sync app does not need an async driver installed.
+    url = ASYNC_DATABASE_READ_URL if read and ASYNC_DATABASE_READ_URL else ASYNC_DATABASE_URL
+    engine = _async_engines.get(url)
+    if engine is None:
+        from sqlalchemy.ext.asyncio import create_async_engine
+        engine = create_async_engine(url, **pool_options(url))
+        if url.startswith("sqlite") and not is_memory_sqlite(url):
+            event.listen(engine.sync_engine, "connect", sqlite_pragmas)
+        _async_engines[url] = engine
+    return engine
+
+
+def AsyncSessionLocal(read=False):
+    engine = get_async_engine(read)
+    factory = _async_sessionmakers.get(id(engine))
+    if factory is None:
+        from sqlalchemy.ext.asyncio import async_sessionmaker
+        factory = _async_sessionmakers[id(engine)] = async_sessionmaker(engine, autoflush=False, expire_on_commit=False)
+    return factory()
@@ -37,3 +37,13 @@ class Order(Base):
 
     user = relationship("User", back_populates="orders")
     food = relationship("Food", back_populates="orders")
+
+
+class OrderKey(Base):
+    """Idempotency key of an order placed by agent.orders.OrderWriter, written with its order rows."""
+
+    __tablename__ = "order_keys"
+
+    key = Column(String, primary_key=True)
+    rows = Column(Integer)
+    created_at = Column(Float, index=True)
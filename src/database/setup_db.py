@@ -1,13 +1,53 @@
-import os
+import argparse
+import math
+import random
+import time
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy import create_engine
-from models import *
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.schema import CreateTable
+try:
+    from database.models import *
+except ImportError:  # run as a script from src/database
+    from models import *
 
 DATABASE_URL = "sqlite:///example.db"
 
 engine = create_engine(DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+SAMPLE_FOODS = [
+    ("spaghetti", 12.5, "Classic Italian pasta with rich tomato sauce."),
+    ("salad", 15.0, "Fresh garden vegetables with a light vinaigrette."),
+    ("sandwich", 14.0, "Grilled chicken sandwich with lettuce and mayo."),
+]
+
+FIRST_NAMES = [
+    "amir", "ali", "mohammad", "sara", "maryam", "reza", "zahra", "hossein", "fatemeh", "mehdi",
+    "alice", "bob", "charlie", "diana", "eve", "frank", "grace", "henry", "irene", "jack",
+]
+DISH_BASES = [
+    "pizza", "burger", "ramen", "curry", "kebab", "risotto", "taco", "burrito", "soup", "stew",
+    "lasagna", "noodles", "dumplings", "omelette", "pancakes", "steak", "falafel", "sushi", "paella", "wrap",
+]
+DISH_STYLES = [
+    "classic", "spicy", "vegan", "grilled", "smoked", "crispy", "creamy", "garlic", "lemon", "herb",
+    "truffle", "chili", "honey", "teriyaki", "pesto", "cajun", "tandoori", "bbq", "sesame", "mushroom",
+]
+DESCRIPTION_TEMPLATES = [
+    "House {style} {base}, made fresh to order.",
+    "Our {style} {base} served with a side salad.",
+    "A generous portion of {style} {base}.",
+    "Chef's {style} {base} with seasonal vegetables.",
+]
+
+# Orders are drawn with Zipf popularity over foods and lognormal activity over users.
+FOOD_ZIPF_EXPONENT = 1.1
+USER_ACTIVITY_SIGMA = 1.0
+PRICE_MEDIAN = 13.0
+PRICE_SIGMA = 0.45
+BATCH_SIZE = 50_000
+ROWS_PER_TRANSACTION = 1_000_000
+
 
 def init_db():
     Base.metadata.create_all(bind=engine)
@@ -22,11 +62,7 @@ def init_db():
     session.add_all(users)
     session.commit()
 
-    foods = [
-        Food(name="spaghetti", price=12.5, description="Classic Italian pasta with rich tomato sauce."),
-        Food(name="salad", price=15.0, description="Fresh garden vegetables with a light vinaigrette."),
-        Food(name="sandwich", price=14.0, description="Grilled chicken sandwich with lettuce and mayo."),
-    ]
+    foods = [Food(name=name, price=price, description=description) for name, price, description in SAMPLE_FOODS]
 
     session.add_all(foods)
     session.commit()
@@ -43,8 +79,133 @@ def init_db():
     print("The database was successfully expanded and populated with sample data.")
 
 
-if __name__ == "__main__":
-    if not os.path.exists("example.db"):
-        init_db()
+def generate_users(rng, count):
+    for i in range(count):
+        name = FIRST_NAMES[i] if i < len(FIRST_NAMES) else f"{rng.choice(FIRST_NAMES)}_{i}"
+        age = min(85, max(18, int(rng.gauss(36, 12))))
+        yield {"id": i + 1, "name": name, "age": age, "email": f"{name}.{i + 1}@example.com"}
+
+
+def generate_foods(rng, count):
+    combos = [(style, base) for style in DISH_STYLES for base in DISH_BASES]
+    rng.shuffle(combos)
+    for i in range(count):
+        if i < len(SAMPLE_FOODS):
+            name, price, description = SAMPLE_FOODS[i]
+        else:
+            style, base = combos[(i - len(SAMPLE_FOODS)) % len(combos)]
+            lap = (i - len(SAMPLE_FOODS)) // len(combos)
+            name = f"{style} {base}" if not lap else f"{style} {base} no.{lap + 1}"
+            price = round(min(80.0, max(3.0, rng.lognormvariate(math.log(PRICE_MEDIAN), PRICE_SIGMA))), 2)
+            description = rng.choice(DESCRIPTION_TEMPLATES).format(style=style, base=base)
+        yield {"id": i + 1, "name": name, "price": price, "description": description}
+
+
+def cumulative(weights):
+    total, out = 0.0, []
+    for weight in weights:
+        total += weight
+        out.append(total)
+    return out
+
+
+def generate_orders(rng, count, users, foods, batch_size):
+    """Yield order batches; food popularity follows Zipf, user activity is lognormal."""
+    food_ids = list(range(1, foods + 1))
+    rng.shuffle(food_ids)
+    food_weights = cumulative(1.0 / (rank + 1) ** FOOD_ZIPF_EXPONENT for rank in range(foods))
+    user_ids = list(range(1, users + 1))
+    user_weights = cumulative(rng.lognormvariate(0, USER_ACTIVITY_SIGMA) for _ in user_ids)
+    remaining = count
+    while remaining:
+        size = min(batch_size, remaining)
+        chosen_foods = rng.choices(food_ids, cum_weights=food_weights, k=size)
+        chosen_users = rng.choices(user_ids, cum_weights=user_weights, k=size)
+        yield [{"food_id": f, "user_id": u} for f, u in zip(chosen_foods, chosen_users)]
+        remaining -= size
+
+
+def create_tables(conn):
+    """Create bare tables; indexes are built by create_indexes once the data is in."""
+    for table in Base.metadata.sorted_tables:
+        conn.execute(CreateTable(table, if_not_exists=True))
+
+
+def create_indexes(conn):
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(conn, checkfirst=True)
+    if conn.dialect.name == "sqlite":
+        conn.execute(text("ANALYZE"))
+
+
+def generate_db(engine, users=1_000, foods=100, orders=100_000, seed=0, batch_size=BATCH_SIZE,
+                rows_per_transaction=ROWS_PER_TRANSACTION):
+    """Bulk-load a reproducible synthetic dataset into an empty database.
+
+    The first foods are the sample spaghetti/salad/sandwich so the demo questions
+    keep working; everything else is drawn from a random.Random(seed).
+    """
+    if users < 1 or foods < 1:
+        raise ValueError("generate_db needs at least one user and one food")
+    rng = random.Random(seed)
+    started = time.perf_counter()
+    with engine.begin() as conn:
+        if conn.dialect.name == "sqlite":
+            conn.exec_driver_sql("PRAGMA synchronous=OFF")
+        create_tables(conn)
+        conn.execute(User.__table__.insert(), list(generate_users(rng, users)))
+        conn.execute(Food.__table__.insert(), list(generate_foods(rng, foods)))
+
+    loaded = 0
+    batches = generate_orders(rng, orders, users, foods, batch_size)
+    while loaded < orders:
+        with engine.begin() as conn:
+            if conn.dialect.name == "sqlite":
+                conn.exec_driver_sql("PRAGMA synchronous=OFF")
+            in_transaction = 0
+            for batch in batches:
+                conn.execute(Order.__table__.insert(), batch)
+                in_transaction += len(batch)
+                if in_transaction >= rows_per_transaction:
+                    break
+        loaded += in_transaction
+        rate = loaded / max(time.perf_counter() - started, 1e-9)
+        print(f"Loaded {loaded:,}/{orders:,} orders ({rate:,.0f} rows/s).")
+
+    with engine.begin() as conn:
+        create_indexes(conn)
+    print(f"Generated {users:,} users, {foods:,} foods and {orders:,} orders "
+          f"in {time.perf_counter() - started:.1f}s (seed {seed}).")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Create and populate the restaurant database.")
+    parser.add_argument("--database-url", default=DATABASE_URL)
+    parser.add_argument("--generate", action="store_true", help="bulk-load synthetic data instead of the samples")
+    parser.add_argument("--users", type=int, default=1_000)
+    parser.add_argument("--foods", type=int, default=100)
+    parser.add_argument("--orders", type=int, default=100_000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--replace", action="store_true", help="drop existing tables first")
+    args = parser.parse_args(argv)
+
+    target = create_engine(args.database_url)
+    if args.replace:
+        Base.metadata.drop_all(bind=target)
+    elif inspect(target).has_table("users"):
+        print(f"The database '{target.url.database}' already exists.")
+        return
+
+    if args.generate:
+        generate_db(target, args.users, args.foods, args.orders, seed=args.seed, batch_size=args.batch_size)
     else:
-        print("The database 'example.db' already exists.")
+        global engine, SessionLocal
+        engine = target
+        SessionLocal.configure(bind=engine)
+        init_db()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,390 @@
+"""Headless HTTP/WebSocket service for the agent, an alternative to the Streamlit app.
+
+    cd src
+    uvicorn server:api --host 0.0.0.0 --port 8000 --workers 4
+    # or: python server.py --workers 4
+
+Endpoints:
+
+    POST /turns                       {"question", "user_id", "thread_id"?} -> result
+    POST /turns/stream                same body, Server-Sent Events
+    POST /threads/{thread_id}/resume  {"answer": "Yes" | "No", "user_id"} -> result
+    POST /threads/{thread_id}/resume/stream
+    GET  /threads/{thread_id}?user_id= whether the thread waits for confirmation
+    WS   /ws                          {"type": "question" | "resume", ...} messages, events back
+    GET  /healthz, GET /metrics
+
+A result is {"thread_id", "status": "done" | "interrupted", "answer",
+"interrupt", ...}; an interrupted turn is continued with /resume on the same
+thread_id. Stream events are the (kind, payload) pairs of
+agent.streaming.astream_turn: "node", "token", then "interrupt" or "final".
+
+Turns run on the async graph (agent.workflow.async_app: the same nodes and
+the same SQLite checkpointer as agent.workflow.app), so all workers see the
+same threads and a resume may land on any of them. A resume first claims the
+interrupted checkpoint in that file, so only one of two concurrent resumes
+runs. A thread is only visible to the user it was started for.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import uuid
+from contextlib import asynccontextmanager
+from typing import Optional
+from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from pydantic import BaseModel
+from langgraph.types import Command
+from agent.batch import RESULT_FIELDS
+from agent.metrics import registry, render_prometheus
+from agent.streaming import astream_turn
+from agent.workflow import async_app, memory, warmup
+
+logger = logging.getLogger(__name__)
+
+# Turns this worker runs at once; further requests wait for a slot.
+SERVER_MAX_TURNS = int(os.getenv("SERVER_MAX_TURNS", "32"))
+# Seconds a request waits for a slot before it is refused with 503.
+SERVER_QUEUE_TIMEOUT = float(os.getenv("SERVER_QUEUE_TIMEOUT", "10"))
+# Requests allowed to wait for a slot; beyond this they are refused at once.
+SERVER_MAX_WAITING = int(os.getenv("SERVER_MAX_WAITING", "128"))
+SERVER_DEFAULT_USER_ID = os.getenv("SERVER_DEFAULT_USER_ID")
+# Load snapshots and the model before accepting traffic (see agent.workflow.warmup).
+SERVER_WARMUP = os.getenv("SERVER_WARMUP", "1") == "1"
+CONFIRM_ANSWERS = ("Yes", "No")
+
+
+class Busy(Exception):
+    """No turn slot became free within SERVER_QUEUE_TIMEOUT."""
+
+
+class AlreadyResumed(Exception):
+    """Another request, possibly in another worker, claimed this confirmation first."""
+
+
+class TurnLimiter:
+    """Bounds the turns running in this worker and how many may queue for a slot."""
+
+    def __init__(self, max_turns=SERVER_MAX_TURNS, max_waiting=SERVER_MAX_WAITING, timeout=SERVER_QUEUE_TIMEOUT):
+        self.max_turns = max_turns
+        self.max_waiting = max_waiting
+        self.timeout = timeout
+        self.running = 0
+        self.waiting = 0
+        self.rejected = 0
+        self._semaphore = None
+        self._thread_locks = {}
+
+    @asynccontextmanager
+    async def slot(self, thread_id):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_turns)
+        if self.waiting >= self.max_waiting:
+            self.rejected += 1
+            raise Busy(f"{self.waiting} requests are already waiting")
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.timeout)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            raise Busy(f"no turn slot within {self.timeout:g}s")
+        finally:
+            self.waiting -= 1
+        # One turn per thread at a time, so a double-clicked resume cannot run twice here.
+        entry = self._thread_locks.setdefault(thread_id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        self.running += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            self.running -= 1
+            self._semaphore.release()
+            entry[1] -= 1
+            if not entry[1]:
+                self._thread_locks.pop(thread_id, None)
+
+    def stats(self):
+        return {
+            "max_turns": self.max_turns,
+            "running": self.running,
+            "waiting": self.waiting,
+            "rejected": self.rejected,
+        }
+
+
+limiter = TurnLimiter()
+registry.register_collector(
+    lambda: [(f"agent_server_turns_{key}", {}, value) for key, value in limiter.stats().items()]
+)
+
+
+@asynccontextmanager
+async def lifespan(api):
+    if SERVER_WARMUP:
+        await asyncio.to_thread(warmup)
+    yield
+
+
+api = FastAPI(title="ChatFood agent", lifespan=lifespan)
+
+
+class TurnRequest(BaseModel):
+    question: str
+    user_id: Optional[str] = None
+    thread_id: Optional[str] = None
+
+
+class ResumeRequest(BaseModel):
+    answer: str
+    user_id: Optional[str] = None
+
+
+def turn_config(thread_id, user_id):
+    return {"configurable": {"thread_id": thread_id, "current_user_id": user_id or SERVER_DEFAULT_USER_ID}}
+
+
+def thread_owner(config):
+    return str(config["configurable"]["current_user_id"] or "")
+
+
+def turn_input(question, config):
+    # The requesting user owns the thread from its first turn, whether or not their user lookup succeeds.
+    return {"question": f"user: {question}", "attempts": 0, "thread_owner": thread_owner(config)}
+
+
+def turn_result(thread_id, outcome):
+    """JSON body for a finished or interrupted turn."""
+    if "interrupt" in outcome:
+        return {"thread_id": thread_id, "status": "interrupted", "answer": None, "interrupt": outcome["interrupt"]}
+    values = outcome.get("final") or {}
+    result = {"thread_id": thread_id, "status": "done", "answer": values.get("query_result"), "interrupt": None}
+    result.update({field: values.get(field) for field in RESULT_FIELDS})
+    return result
+
+
+def owned_by(state, config):
+    """Whether the thread was started for the user in config; threads without a turn belong to nobody yet."""
+    if not state.values:
+        return True
+    owner = state.values.get("thread_owner")
+    return owner is not None and owner == thread_owner(config)
+
+
+async def pending_interrupt(config):
+    """(interrupt value or None, checkpoint id) of a thread the requesting user owns; None if not theirs."""
+    state = await async_app.aget_state(config)
+    if not owned_by(state, config):
+        return None
+    checkpoint_id = state.config["configurable"].get("checkpoint_id")
+    return (state.interrupts[0].value if state.interrupts else None), checkpoint_id
+
+
+async def claim_resume(thread_id, config):
+    """Claim the pending confirmation of a thread; returns its checkpoint id."""
+    pending = await pending_interrupt(config)
+    if pending is None:
+        raise LookupError(f"thread {thread_id} not found")
+    interrupt, checkpoint_id = pending
+    if interrupt is None:
+        raise AlreadyResumed(f"thread {thread_id} is not waiting for a confirmation")
+    if not await asyncio.to_thread(memory.claim_resume, thread_id, checkpoint_id):
+        raise AlreadyResumed(f"thread {thread_id} is already being resumed")
+    return checkpoint_id
+
+
+async def release_resume(thread_id, config, checkpoint_id):
+    """Give the claim back when the resume failed before the thread moved on, so it can be retried."""
+    state = await async_app.aget_state(config)
+    if state.config["configurable"].get("checkpoint_id") == checkpoint_id:
+        await asyncio.to_thread(memory.release_resume, thread_id, checkpoint_id)
+
+
+async def resume_command(thread_id, request: ResumeRequest):
+    if request.answer not in CONFIRM_ANSWERS:
+        raise HTTPException(422, f"answer must be one of {', '.join(CONFIRM_ANSWERS)}")
+    config = turn_config(thread_id, request.user_id)
+    try:
+        claim = await claim_resume(thread_id, config)
+    except LookupError as e:
+        raise HTTPException(404, str(e))
+    except AlreadyResumed as e:
+        raise HTTPException(409, str(e))
+    return Command(resume=request.answer), config, claim
+
+
+async def run_turn(thread_id, graph_input, config, claim=None):
+    outcome = {}
+    try:
+        async with limiter.slot(thread_id):
+            async for kind, payload in astream_turn(async_app, graph_input, config):
+                if kind in ("interrupt", "final"):
+                    outcome[kind] = payload
+    except BaseException as e:
+        if claim is not None:
+            await release_resume(thread_id, config, claim)
+        if isinstance(e, Busy):
+            raise HTTPException(503, f"server busy: {e}", headers={"Retry-After": "1"})
+        raise
+    return turn_result(thread_id, outcome)
+
+
+def sse(kind, payload):
+    return f"event: {kind}\ndata: {json.dumps(payload, default=str)}\n\n"
+
+
+async def stream_events(thread_id, graph_input, config, claim=None):
+    """Turn events as (kind, payload) pairs; "final" carries turn_result instead of the whole state."""
+    try:
+        async with limiter.slot(thread_id):
+            yield "thread", {"thread_id": thread_id}
+            async for kind, payload in astream_turn(async_app, graph_input, config):
+                if kind == "interrupt":
+                    payload = turn_result(thread_id, {"interrupt": payload})
+                elif kind == "final":
+                    payload = turn_result(thread_id, {"final": payload})
+                yield kind, payload
+    except BaseException:
+        if claim is not None:
+            await release_resume(thread_id, config, claim)
+        raise
+
+
+async def sse_response(thread_id, graph_input, config, claim=None):
+    events = stream_events(thread_id, graph_input, config, claim)
+    try:
+        # Take the slot before answering, so a busy server says 503 instead of an empty stream.
+        first = await events.__anext__()
+    except Busy as e:
+        raise HTTPException(503, f"server busy: {e}", headers={"Retry-After": "1"})
+
+    async def body():
+        try:
+            yield sse(*first)
+            async for kind, payload in events:
+                yield sse(kind, payload)
+        except Exception as e:
+            logger.warning(f"Turn on thread {thread_id} failed: {str(e)}")
+            yield sse("error", {"detail": str(e)})
+        finally:
+            await events.aclose()
+
+    return StreamingResponse(body(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
+async def turn_thread(request: TurnRequest):
+    """Thread id and config for a new turn; an existing thread must belong to the user."""
+    thread_id = request.thread_id or str(uuid.uuid4())
+    config = turn_config(thread_id, request.user_id)
+    if request.thread_id and await pending_interrupt(config) is None:
+        raise HTTPException(404, f"thread {thread_id} not found")
+    return thread_id, config
+
+
+@api.post("/turns")
+async def start_turn(request: TurnRequest):
+    thread_id, config = await turn_thread(request)
+    return await run_turn(thread_id, turn_input(request.question, config), config)
+
+
+@api.post("/turns/stream")
+async def stream_turn(request: TurnRequest):
+    thread_id, config = await turn_thread(request)
+    return await sse_response(thread_id, turn_input(request.question, config), config)
+
+
+@api.post("/threads/{thread_id}/resume")
+async def resume_turn(thread_id: str, request: ResumeRequest):
+    command, config, claim = await resume_command(thread_id, request)
+    return await run_turn(thread_id, command, config, claim)
+
+
+@api.post("/threads/{thread_id}/resume/stream")
+async def stream_resume(thread_id: str, request: ResumeRequest):
+    command, config, claim = await resume_command(thread_id, request)
+    return await sse_response(thread_id, command, config, claim)
+
+
+@api.get("/threads/{thread_id}")
+async def thread_status(thread_id: str, user_id: Optional[str] = None):
+    pending = await pending_interrupt(turn_config(thread_id, user_id))
+    if pending is None:
+        raise HTTPException(404, f"thread {thread_id} not found")
+    interrupt = pending[0]
+    return {"thread_id": thread_id, "status": "interrupted" if interrupt else "idle", "interrupt": interrupt}
+
+
+@api.websocket("/ws")
+async def chat_socket(websocket: WebSocket):
+    """One conversation per socket: send {"type": "question", "question", "user_id"} or
+    {"type": "resume", "answer"}; every event comes back as {"event", "data"}."""
+    await websocket.accept()
+    thread_id = websocket.query_params.get("thread_id") or str(uuid.uuid4())
+    user_id = websocket.query_params.get("user_id")
+    try:
+        while True:
+            message = await websocket.receive_json()
+            user_id = message.get("user_id", user_id)
+            config = turn_config(thread_id, user_id)
+            claim = None
+            if message.get("type") == "resume":
+                if message.get("answer") not in CONFIRM_ANSWERS:
+                    detail = f"answer must be one of {', '.join(CONFIRM_ANSWERS)}"
+                    await websocket.send_json({"event": "error", "data": {"detail": detail}})
+                    continue
+                try:
+                    claim = await claim_resume(thread_id, config)
+                except (LookupError, AlreadyResumed) as e:
+                    await websocket.send_json({"event": "error", "data": {"detail": str(e)}})
+                    continue
+                graph_input = Command(resume=message["answer"])
+            elif message.get("question"):
+                if await pending_interrupt(config) is None:
+                    await websocket.send_json({"event": "error", "data": {"detail": f"thread {thread_id} not found"}})
+                    continue
+                graph_input = turn_input(message["question"], config)
+            else:
+                await websocket.send_json({"event": "error", "data": {"detail": "expected a question"}})
+                continue
+            try:
+                async for kind, payload in stream_events(thread_id, graph_input, config, claim):
+                    await websocket.send_json({"event": kind, "data": json.loads(json.dumps(payload, default=str))})
+            except Busy as e:
+                await websocket.send_json({"event": "error", "data": {"detail": f"server busy: {e}", "retry": True}})
+            except WebSocketDisconnect:
+                raise
+            except Exception as e:
+                # As on the SSE path: report the failed turn and keep the socket for the next message.
+                logger.warning(f"Turn on thread {thread_id} failed: {str(e)}")
+                await websocket.send_json({"event": "error", "data": {"detail": str(e)}})
+    except WebSocketDisconnect:
+        logger.info(f"WebSocket for thread {thread_id} closed.")
+
+
+@api.get("/healthz")
+async def healthz():
+    return {"status": "ok", "turns": limiter.stats()}
+
+
+@api.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    return render_prometheus()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default=os.getenv("SERVER_HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("SERVER_PORT", "8000")))
+    parser.add_argument("--workers", type=int, default=int(os.getenv("SERVER_WORKERS", "1")))
+    args = parser.parse_args(argv)
+
+    import uvicorn
+
+    # Workers are separate processes; they share the database and CHECKPOINT_DB, not memory.
+    uvicorn.run("server:api", host=args.host, port=args.port, workers=args.workers)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+import json
+import threading
+import time
+import pytest
+from langgraph.types import Command
+from agent import batch
+from agent.batch import completed_ids, finish_interrupted, read_records, run_batch
+
+
+class FakeGraph:
+    """Stands in for the compiled graph: every question asks for confirmation when sql is a write."""
+
+    def __init__(self, sql="SELECT name FROM food", delay=0.0):
+        self.sql = sql
+        self.delay = delay
+        self.questions = []
+        self.resumes = []
+        self.checkpointer = self
+        self._lock = threading.Lock()
+
+    def delete_thread(self, thread_id):
+        pass
+
+    def invoke(self, payload, config):
+        time.sleep(self.delay)
+        with self._lock:
+            if isinstance(payload, Command):
+                self.resumes.append(payload.resume)
+                return {"query_result": "Order placed.", "sql_query": self.sql}
+            self.questions.append(payload["question"])
+        if self.sql.startswith("INSERT"):
+            return {"__interrupt__": ["confirm"], "query_result": "Confirm?", "sql_query": self.sql}
+        return {"query_result": "Salad", "sql_query": self.sql}
+
+
+def records(*questions, user_id=2):
+    return [{"id": str(i), "question": question, "user_id": user_id} for i, question in enumerate(questions)]
+
+
+def test_read_records():
+    lines = ['{"question": "menu?", "id": 7}', "", "plain question", "{not json"]
+    parsed = list(read_records(lines, default_user_id="3"))
+    assert [record["id"] for record in parsed] == ["7", "line-3", "line-4"]
+    assert parsed[1] == {"question": "plain question", "id": "line-3", "user_id": "3"}
+    assert parsed[2]["question"] is None and parsed[2]["error"].startswith("invalid JSON")
+
+
+def test_repeated_questions_are_answered_once():
+    graph = FakeGraph()
+    results = list(run_batch(records("Show me the menu", "show me the MENU!", "Salad price"), graph=graph))
+    assert len(graph.questions) == 2
+    duplicate = next(result for result in results if result.get("duplicate_of"))
+    assert duplicate["id"] == "1" and duplicate["duplicate_of"] == "0"
+
+
+def test_orders_are_left_unconfirmed_by_default():
+    assert batch.BATCH_CONFIRM == "skip"
+    graph = FakeGraph(sql="INSERT INTO orders (food_id, user_id) VALUES (1, 2)")
+    results = list(run_batch(records("I want a salad"), graph=graph))
+    assert graph.resumes == []
+    assert results[0]["interrupted"] is True
+
+
+def test_confirmed_orders_are_never_deduped():
+    graph = FakeGraph(sql="INSERT INTO orders (food_id, user_id) VALUES (1, 2)")
+    results = list(run_batch(records(*["I want a salad"] * 3), graph=graph, confirm="yes", concurrency=1))
+    assert graph.resumes == ["Yes"] * 3
+    assert not any(result.get("duplicate_of") for result in results)
+
+
+def test_done_ids_are_skipped(tmp_path):
+    output = tmp_path / "answers.jsonl"
+    output.write_text(json.dumps({"id": "0"}) + "\nnot json\n")
+    done = completed_ids(str(output))
+    assert done == {"0"}
+    graph = FakeGraph()
+    results = list(run_batch(records("Show me the menu", "Salad price"), graph=graph, done=done))
+    assert [result["id"] for result in results] == ["1"]
+
+
+def interrupted_after(items, count):
+    for i, item in enumerate(items):
+        if i == count:
+            raise KeyboardInterrupt
+        yield item
+
+
+def test_interrupt_reports_the_questions_already_running():
+    graph = FakeGraph(delay=0.05)
+    questions = records(*(f"question {i}" for i in range(10)))
+    seen = []
+    with pytest.raises(KeyboardInterrupt):
+        for result in run_batch(interrupted_after(questions, 3), graph=graph, concurrency=4):
+            seen.append(result["id"])
+    # Every question that ran is reported, so a rerun skips it.
+    assert sorted(seen) == ["0", "1", "2"]
+    assert len(graph.questions) == 3
+
+
+def test_interrupt_outside_the_runner():
+    graph = FakeGraph(delay=0.05)
+    results = run_batch(records(*(f"question {i}" for i in range(10))), graph=graph, concurrency=2)
+    reported = [next(results)["id"]]
+    reported += [result["id"] for result in finish_interrupted(results)]
+    # Questions not started yet are cancelled; every one that ran is reported once.
+    assert len(graph.questions) < 10
+    assert len(reported) == len(set(reported)) == len(graph.questions)
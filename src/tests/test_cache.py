@@ -0,0 +1,50 @@
+import pytest
+from sqlalchemy import create_engine, text
+from agent.cache import table_versions
+from agent.results import ResultCache
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'cache.db'}")
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE food (id INTEGER PRIMARY KEY, name TEXT)"))
+        conn.execute(text("CREATE TABLE orders (id INTEGER PRIMARY KEY, food_id INTEGER)"))
+        conn.execute(text("INSERT INTO food (name) VALUES ('Salad'), ('Ramen')"))
+        conn.execute(text("INSERT INTO orders (food_id) VALUES (1), (2)"))
+    yield engine
+    engine.dispose()
+
+
+@pytest.mark.parametrize("write, table", [
+    ("INSERT INTO orders (food_id) VALUES (1)", "orders"),
+    ("DELETE FROM main.orders WHERE id = 1", "orders"),
+    ("WITH old AS (SELECT id FROM orders WHERE id = 1) DELETE FROM orders WHERE id IN (SELECT id FROM old)", "orders"),
+    ("WITH cheap AS (SELECT id FROM food) UPDATE main.food SET name = 'x' WHERE id IN (SELECT id FROM cheap)", "food"),
+])
+def test_writes_bump_the_table_version(engine, write, table):
+    before = table_versions.get(table)
+    with engine.begin() as conn:
+        conn.execute(text(write))
+    # Once when the statement runs and once when its transaction commits.
+    assert table_versions.get(table) == before + 2
+
+
+def test_reads_do_not_bump_versions(engine):
+    before = table_versions.snapshot(("food", "orders"))
+    with engine.connect() as conn:
+        conn.execute(text("SELECT * FROM orders JOIN food ON food.id = orders.food_id WHERE name <> 'update'")).all()
+    assert table_versions.snapshot(("food", "orders")) == before
+
+
+def test_cte_write_makes_cached_results_stale(engine):
+    cache = ResultCache(max_bytes=1 << 20, ttl=0)
+    sql = "SELECT food_id FROM orders"
+    versions = cache.versions(sql)
+    with engine.connect() as conn:
+        rows = [row[0] for row in conn.execute(text(sql))]
+    cache.set(sql, ({"columns": ["food_id"], "values": [rows]}, False, None), versions)
+    assert cache.get(sql) is not None
+    with engine.begin() as conn:
+        conn.execute(text("WITH old AS (SELECT id FROM orders) DELETE FROM main.orders WHERE id IN (SELECT id FROM old)"))
+    assert cache.get(sql) is None
@@ -0,0 +1,127 @@
+import time
+from typing import TypedDict
+import pytest
+from langgraph.graph import END, START, StateGraph
+from langgraph.types import Command, interrupt
+from agent.checkpoint import PersistentSaver
+
+
+class CountState(TypedDict):
+    count: int
+    answer: str
+
+
+def step(state):
+    return {"count": state["count"] + 1}
+
+
+def ask(state):
+    return {"answer": interrupt("Confirm?")}
+
+
+def build(saver, confirm=False):
+    workflow = StateGraph(CountState)
+    workflow.add_node("step", step)
+    workflow.add_edge(START, "step")
+    if confirm:
+        workflow.add_node("ask", ask)
+        workflow.add_edge("step", "ask")
+        workflow.add_edge("ask", END)
+    else:
+        workflow.add_edge("step", END)
+    return workflow.compile(checkpointer=saver)
+
+
+def config(thread_id):
+    return {"configurable": {"thread_id": thread_id}}
+
+
+def checkpoints(saver, thread_id):
+    return len(list(saver.list(config(thread_id))))
+
+
+@pytest.fixture
+def saver(tmp_path):
+    saver = PersistentSaver.from_path(str(tmp_path / "checkpoints.db"))
+    saver.setup()
+    # Maintenance only when the tests call it.
+    saver.maintenance_interval = float("inf")
+    yield saver
+    saver.conn.close()
+
+
+def test_compact_keeps_only_the_latest_checkpoint(saver):
+    graph = build(saver)
+    graph.invoke({"count": 0, "answer": ""}, config("a"))
+    graph.invoke({"count": 5, "answer": ""}, config("a"))
+    before = checkpoints(saver, "a")
+    assert before > 1
+    saver.compact_after = 0
+    assert saver.compact(now=time.time() + 1) == before - 1
+    assert checkpoints(saver, "a") == 1
+    assert graph.get_state(config("a")).values["count"] == 6
+
+
+def test_compact_leaves_recent_threads_alone(saver):
+    graph = build(saver)
+    graph.invoke({"count": 0, "answer": ""}, config("a"))
+    before = checkpoints(saver, "a")
+    saver.compact_after = 60
+    assert saver.compact() == 0
+    assert checkpoints(saver, "a") == before
+
+
+def test_evict_drops_expired_threads_but_keeps_interrupted_ones_longer(saver):
+    build(saver).invoke({"count": 0, "answer": ""}, config("done"))
+    build(saver, confirm=True).invoke({"count": 0, "answer": ""}, config("waiting"))
+    saver.ttl = 10
+    saver.interrupted_ttl = 100
+    assert saver.evict(now=time.time() + 50) == 1
+    assert checkpoints(saver, "done") == 0
+    assert checkpoints(saver, "waiting") > 0
+    assert saver.evict(now=time.time() + 500) == 1
+    assert checkpoints(saver, "waiting") == 0
+    assert saver.footprint()["threads"] == 0
+
+
+def test_evict_enforces_max_threads_oldest_first(saver):
+    graph = build(saver)
+    for thread_id in ("first", "second", "third"):
+        graph.invoke({"count": 0, "answer": ""}, config(thread_id))
+        time.sleep(0.01)
+    saver.max_threads = 2
+    assert saver.evict() == 1
+    assert checkpoints(saver, "first") == 0
+    assert checkpoints(saver, "second") > 0
+    assert checkpoints(saver, "third") > 0
+
+
+def test_compacted_interrupt_still_resumes(saver):
+    graph = build(saver, confirm=True)
+    graph.invoke({"count": 0, "answer": ""}, config("a"))
+    saver.compact_after = 0
+    saver.compact(now=time.time() + 1)
+    assert graph.get_state(config("a")).interrupts
+    result = graph.invoke(Command(resume="Yes"), config("a"))
+    assert result == {"count": 1, "answer": "Yes"}
+
+
+def test_resume_is_claimed_once_across_savers(saver, tmp_path):
+    other = PersistentSaver.from_path(str(tmp_path / "checkpoints.db"))
+    other.setup()
+    try:
+        assert saver.claim_resume("a", "checkpoint-1")
+        assert not other.claim_resume("a", "checkpoint-1")
+        assert other.claim_resume("a", "checkpoint-2")
+        saver.release_resume("a", "checkpoint-1")
+        assert other.claim_resume("a", "checkpoint-1")
+    finally:
+        other.conn.close()
+
+
+def test_deleting_a_thread_drops_its_claims(saver):
+    build(saver).invoke({"count": 0, "answer": ""}, config("a"))
+    assert saver.claim_resume("a", "checkpoint-1")
+    saver.delete_thread("a")
+    assert checkpoints(saver, "a") == 0
+    assert saver.claim_resume("a", "checkpoint-1")
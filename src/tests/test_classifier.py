@@ -0,0 +1,79 @@
+import threading
+import pytest
+from sqlalchemy import create_engine, text
+from agent.classifier import KeywordClassifier, PreClassifier
+
+
+@pytest.fixture(scope="module")
+def classifier(tmp_path_factory):
+    engine = create_engine(f"sqlite:///{tmp_path_factory.mktemp('menu') / 'menu.db'}")
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE food (id INTEGER PRIMARY KEY, name TEXT)"))
+        conn.execute(text("INSERT INTO food (name) VALUES ('Salad'), ('Spaghetti Carbonara'), ('Ramen')"))
+    yield KeywordClassifier(engine=engine)
+    engine.dispose()
+
+
+@pytest.mark.parametrize("question, label", [
+    ("I want two salads", "order"),
+    ("I'd like the spaghetti carbonara", "order"),
+    ("Cancel my order please", "order"),
+    ("What is my order history?", "order"),
+    ("Show me the menu", "menu"),
+    ("How much is the ramen?", "menu"),
+    ("What is the price of the salad?", "menu"),
+])
+def test_labels_restaurant_questions(classifier, question, label):
+    verdict = classifier.classify(f"user: {question}")
+    assert verdict is not None and verdict[0] == label
+    assert verdict[1] >= 0.8
+
+
+@pytest.mark.parametrize("question", [
+    "I'd like to buy a car",
+    "I want to cancel my gym membership",
+    "place my bet on red",
+    "I want it",
+    "what's the weather like?",
+])
+def test_leaves_off_topic_questions_to_the_llm(classifier, question):
+    assert classifier.classify(question) is None
+
+
+@pytest.mark.parametrize("question", [
+    "which dishes did people order most?",
+    "how many orders were placed for ramen?",
+])
+def test_never_labels_questions_about_other_peoples_orders_as_order(classifier, question):
+    verdict = classifier.classify(question)
+    assert verdict is None or verdict[0] != "order"
+
+
+def test_pre_classifier_counts_decisions():
+    class Fixed:
+        name = "fixed"
+
+        def __init__(self, verdict):
+            self.verdict = verdict
+
+        def classify(self, question):
+            return self.verdict
+
+    pre = PreClassifier([Fixed(("menu", 0.5)), Fixed(("order", 0.9))], min_confidence=0.8)
+    threads = [threading.Thread(target=lambda: [pre.classify("q") for _ in range(500)]) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert pre.classify("q") == ("order", 0.9)
+    assert pre.stats() == {"turns": 2001, "resolved": 2001, "resolved_share": 1.0, "by_classifier": {"fixed": 2001}}
+
+
+def test_pre_classifier_skips_failing_classifiers():
+    class Broken:
+        name = "broken"
+
+        def classify(self, question):
+            raise RuntimeError("no database")
+
+    assert PreClassifier([Broken()]).classify("q") is None
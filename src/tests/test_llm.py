@@ -0,0 +1,137 @@
+import asyncio
+import pytest
+from agent import llm
+from agent.llm import RouteStats, RoutedClient
+
+ENDPOINTS = ["http://a:11434/", "http://b:11434/"]
+
+
+class FakeClient:
+    def __init__(self, calls, model, url, fail=None, chunks=("Hel", "lo"), fail_after=None):
+        self.calls = calls
+        self.name = (model, url)
+        self.fail = fail
+        self.chunks = chunks
+        self.fail_after = fail_after
+
+    def invoke(self, input, config=None, **kwargs):
+        self.calls.append(self.name)
+        if self.fail:
+            raise self.fail
+        return f"{self.name[0]}@{self.name[1]}"
+
+    async def ainvoke(self, input, config=None, **kwargs):
+        return self.invoke(input, config, **kwargs)
+
+    def stream(self, input, config=None, **kwargs):
+        self.calls.append(self.name)
+        if self.fail and self.fail_after is None:
+            raise self.fail
+        for i, chunk in enumerate(self.chunks):
+            if self.fail_after == i:
+                raise self.fail
+            yield chunk
+
+
+@pytest.fixture
+def routes(monkeypatch):
+    """Scripts the clients of a "test" route: failures[(model, url)] is raised by that client."""
+    calls = []
+    failures = {}
+
+    def build_client(temperature, schema, model, url, timeout):
+        fail, fail_after = failures.get((model, url), (None, None))
+        return FakeClient(calls, model, url, fail=fail, fail_after=fail_after)
+
+    monkeypatch.setattr(llm, "endpoints", ENDPOINTS)
+    monkeypatch.setattr(llm, "route_stats", RouteStats())
+    monkeypatch.setattr(llm, "build_client", build_client)
+    monkeypatch.setitem(llm.ROUTES, "test", {"model": "small", "fallback": "large", "timeout": 5})
+    monkeypatch.setitem(llm.ROUTES, "single", {"model": "large", "fallback": None, "timeout": 5})
+    return calls, failures
+
+
+def test_candidates_try_every_endpoint_then_the_fallback_model(routes):
+    attempts = RoutedClient("test").candidates()
+    assert [model for model, _ in attempts] == ["small", "small", "large", "large"]
+    assert sorted(url for _, url in attempts[:2]) == ENDPOINTS
+    assert [model for model, _ in RoutedClient("single").candidates()] == ["large", "large"]
+
+
+def test_unknown_route_uses_default():
+    assert RoutedClient("no-such-route").route == "default"
+
+
+def test_error_moves_to_the_next_endpoint(routes):
+    calls, failures = routes
+    client = RoutedClient("test")
+    first, second = client.candidates()[:2]
+    failures[first] = (ConnectionError("refused"), None)
+    assert client.invoke("hi") == f"small@{second[1]}"
+    assert calls == [first, second]
+    stats = llm.route_stats.stats()
+    assert stats[("test", *first)]["errors"] == 1
+    assert stats[("test", *first)]["fallbacks"] == 1
+    assert stats[("test", *second)]["calls"] == 1
+
+
+def test_timeouts_on_every_endpoint_fall_back_to_the_other_model(routes):
+    calls, failures = routes
+    for url in ENDPOINTS:
+        failures[("small", url)] = (TimeoutError("slow"), None)
+    assert RoutedClient("test").invoke("hi").startswith("large@")
+    assert [model for model, _ in calls] == ["small", "small", "large"]
+    stats = llm.route_stats.stats()
+    assert sum(stats[("test", "small", url)]["timeouts"] for url in ENDPOINTS) == 2
+    assert all(count == 0 for count in llm.route_stats.in_flight.values())
+
+
+def test_last_candidate_error_is_raised(routes):
+    calls, failures = routes
+    for url in ENDPOINTS:
+        failures[("large", url)] = (ConnectionError(url), None)
+    client = RoutedClient("single")
+    with pytest.raises(ConnectionError) as raised:
+        client.invoke("hi")
+    assert str(raised.value) == calls[-1][1]
+    assert len(calls) == 2
+
+
+def test_cancellation_is_not_retried(routes):
+    calls, failures = routes
+    client = RoutedClient("test")
+    first = client.candidates()[0]
+    failures[first] = (KeyboardInterrupt(), None)
+    with pytest.raises(KeyboardInterrupt):
+        client.invoke("hi")
+    assert calls == [first]
+
+
+def test_async_invoke_falls_back(routes):
+    calls, failures = routes
+    client = RoutedClient("test")
+    first, second = client.candidates()[:2]
+    failures[first] = (ConnectionError("refused"), None)
+    assert asyncio.run(client.ainvoke("hi")) == f"small@{second[1]}"
+
+
+def test_stream_falls_back_before_the_first_chunk(routes):
+    calls, failures = routes
+    client = RoutedClient("test")
+    first = client.candidates()[0]
+    failures[first] = (ConnectionError("refused"), None)
+    assert "".join(client.stream("hi")) == "Hello"
+    assert len(calls) == 2
+
+
+def test_stream_error_after_output_is_raised(routes):
+    calls, failures = routes
+    client = RoutedClient("test")
+    first = client.candidates()[0]
+    failures[first] = (ConnectionError("reset"), 1)
+    chunks = []
+    with pytest.raises(ConnectionError):
+        for chunk in client.stream("hi"):
+            chunks.append(chunk)
+    assert chunks == ["Hel"]
+    assert calls == [first]
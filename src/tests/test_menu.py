@@ -0,0 +1,79 @@
+import pytest
+from agent.menu import MenuItem, MenuSnapshot, parse_menu_question
+
+MENU = MenuSnapshot([
+    MenuItem(1, "Garlic Noodles", 9.0, "Wok-fried noodles"),
+    MenuItem(2, "Salad", 7.5, "Greens"),
+    MenuItem(3, "Spicy Ramen", 12.0, "Hot noodle soup"),
+    MenuItem(4, "Veggie Burger", 11.0, "Bean patty"),
+    MenuItem(5, "Nori Rolls", 6.0, "Seaweed rolls"),
+], version=0)
+
+
+def names(question):
+    query = parse_menu_question(question, MENU)
+    assert query is not None, question
+    return [item.name for item in query.apply(MENU)]
+
+
+def test_whole_menu():
+    assert len(names("Show me the menu")) == 5
+
+
+def test_price_bounds_and_picks():
+    assert names("What dishes are under 10 dollars?") == ["Nori Rolls", "Salad", "Garlic Noodles"]
+    assert names("menu items over 11") == ["Spicy Ramen"]
+    assert names("What is the cheapest dish?") == ["Nori Rolls"]
+    assert names("most expensive item") == ["Spicy Ramen"]
+
+
+def test_dish_names_and_words():
+    assert names("How much is the salad?") == ["Salad"]
+    assert names("anything with garlic?") == ["Garlic Noodles"]
+    assert names("do you have noodle dishes") == ["Garlic Noodles"]
+    assert names("which burgers do you serve") == ["Veggie Burger"]
+
+
+@pytest.mark.parametrize("question", [
+    "anything with no garlic?",
+    "dishes without garlic",
+    "everything except ramen",
+    "gluten free dishes",
+    "I don't want spicy food",
+    "what is not spicy?",
+])
+def test_negated_questions_fall_through(question):
+    assert parse_menu_question(question, MENU) is None
+
+
+@pytest.mark.parametrize("question", [
+    "dishes with ram",
+    "anything with no",
+    "do you have pizza",
+])
+def test_partial_and_unknown_words_fall_through(question):
+    assert parse_menu_question(question, MENU) is None
+
+
+def test_short_words_do_not_match_inside_names():
+    # "no" used to match "noodles" and "nori" as a substring.
+    assert names("is there some garlic dish") == ["Garlic Noodles"]
+
+
+def test_sql_matches_whole_words():
+    query = parse_menu_question("anything with garlic under 10", MENU)
+    assert query.sql() == (
+        "SELECT name AS food_name, price, description AS food_description FROM food "
+        "WHERE ' ' || lower(name) || ' ' LIKE '% garlic %' AND price < 10.0 ORDER BY price"
+    )
+
+
+def test_sql_runs(tmp_path):
+    import sqlite3
+
+    conn = sqlite3.connect(tmp_path / "menu.db")
+    conn.execute("CREATE TABLE food (id INTEGER PRIMARY KEY, name TEXT, price REAL, description TEXT)")
+    conn.executemany("INSERT INTO food VALUES (?, ?, ?, ?)",
+                     [(item.id, item.name, item.price, item.description) for item in MENU.items])
+    sql = parse_menu_question("dishes with noodles", MENU).sql()
+    assert [row[0] for row in conn.execute(sql)] == ["Garlic Noodles"]
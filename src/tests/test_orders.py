@@ -0,0 +1,154 @@
+import asyncio
+import uuid
+import pytest
+from sqlalchemy import create_engine, text
+from agent.menu import MenuItem, MenuSnapshot
+from agent.orders import ORDER_MAX_QUANTITY, OrderPending, OrderTooLarge, OrderWriter, order_rows, parse_order_action
+
+MENU = MenuSnapshot([
+    MenuItem(1, "Salad", 7.5, "Greens"),
+    MenuItem(2, "Ramen", 11.0, "Noodle soup"),
+    MenuItem(3, "Spicy Ramen", 12.0, "Hot noodle soup"),
+    MenuItem(4, "Spaghetti", 14.0, "Pasta"),
+], version=0)
+
+
+def test_parse_order_action_quantities():
+    action = parse_order_action("user: I want two salads and a ramen", 4, MENU)
+    assert action["user_id"] == 4
+    assert {item["food_name"]: item["quantity"] for item in action["items"]} == {"Salad": 2, "Ramen": 1}
+    assert len(order_rows(action)) == 3
+
+
+def test_parse_order_action_prefers_longest_name():
+    action = parse_order_action("I'd like 3 spicy ramen", 4, MENU)
+    assert [(item["food_id"], item["quantity"]) for item in action["items"]] == [(3, 3)]
+
+
+@pytest.mark.parametrize("question, expected", [
+    ("I want 2 spaghetti and salad", {"Spaghetti": 2, "Salad": 1}),
+    ("I want 2 spaghetti, salad", {"Spaghetti": 2, "Salad": 1}),
+    ("I want salad and 3 ramen", {"Salad": 1, "Ramen": 3}),
+    ("I want 2 ramen 3 salads", {"Ramen": 2, "Salad": 3}),
+    ("Can I get a couple of salads", {"Salad": 2}),
+])
+def test_parse_order_action_quantity_belongs_to_its_dish(question, expected):
+    action = parse_order_action(question, 4, MENU)
+    assert {item["food_name"]: item["quantity"] for item in action["items"]} == expected
+
+
+def test_parse_order_action_rejects_too_large_quantities():
+    with pytest.raises(OrderTooLarge, match=f"at most {ORDER_MAX_QUANTITY} x Salad"):
+        parse_order_action(f"I want {ORDER_MAX_QUANTITY + 1} salads", 4, MENU)
+    action = parse_order_action(f"I want {ORDER_MAX_QUANTITY} salads", 4, MENU)
+    assert action["items"][0]["quantity"] == ORDER_MAX_QUANTITY
+
+
+def test_parse_order_action_gives_fresh_keys():
+    assert parse_order_action("I want a salad", 4, MENU)["key"] != parse_order_action("I want a salad", 4, MENU)["key"]
+
+
+@pytest.mark.parametrize("question, user_id", [
+    ("I want a salad", None),
+    ("What did I order last time?", 4),
+    ("I want a pizza", 4),
+    ("Is the salad vegan?", 4),
+])
+def test_parse_order_action_leaves_other_questions_alone(question, user_id):
+    assert parse_order_action(question, user_id, MENU) is None
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'orders.db'}")
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE orders (id INTEGER PRIMARY KEY, food_id INTEGER NOT NULL, user_id INTEGER)"))
+    yield engine
+    engine.dispose()
+
+
+def order_count(engine):
+    with engine.connect() as conn:
+        return conn.execute(text("SELECT COUNT(*) FROM orders")).scalar()
+
+
+def action(food_id=1, quantity=1):
+    item = {"food_id": food_id, "food_name": "Salad", "price": 7.5, "quantity": quantity}
+    return {"user_id": 4, "items": [item], "key": uuid.uuid4().hex}
+
+
+def test_group_commit(engine):
+    writer = OrderWriter(engine=engine, window=0.2)
+    futures = [writer.submit(action(quantity=2)) for _ in range(5)]
+    assert [future.result(5) for future in futures] == [2] * 5
+    assert writer.stats()["batches"] == 1
+    assert writer.stats()["orders"] == 5
+    assert order_count(engine) == 10
+
+
+def test_same_key_is_inserted_once(engine):
+    writer = OrderWriter(engine=engine, window=0.01)
+    first = action()
+    assert writer.place(first) == 1
+    assert writer.place(dict(first)) == 1
+    assert writer.stats()["duplicates"] == 1
+    assert order_count(engine) == 1
+
+
+def test_keys_survive_a_restart(engine):
+    placed = action(quantity=2)
+    assert OrderWriter(engine=engine, window=0.01).place(placed) == 2
+    restarted = OrderWriter(engine=engine, window=0.01)
+    assert restarted.place(dict(placed)) == 2
+    assert restarted.stats()["duplicates"] == 1
+    assert order_count(engine) == 2
+
+
+def test_keys_are_shared_between_writers(engine):
+    # Two writers stand in for two server worker processes resuming the same turn.
+    shared = action()
+    first, second = OrderWriter(engine=engine, window=0.05), OrderWriter(engine=engine, window=0.05)
+    futures = [first.submit(shared), second.submit(dict(shared))]
+    assert [future.result(5) for future in futures] == [1, 1]
+    assert order_count(engine) == 1
+
+
+def test_failed_order_does_not_sink_the_batch(engine):
+    writer = OrderWriter(engine=engine, window=0.2)
+    failing = action(food_id=None)
+    good, bad = writer.submit(action()), writer.submit(failing)
+    assert good.result(5) == 1
+    with pytest.raises(Exception):
+        bad.result(5)
+    assert order_count(engine) == 1
+    # A failed key may be submitted again.
+    assert writer.submitted.get(failing["key"]) is None
+
+
+def test_timeout_raises_pending_and_commits_once(engine):
+    writer = OrderWriter(engine=engine, window=0.3)
+    pending = action()
+    with pytest.raises(OrderPending):
+        writer.place(pending, timeout=0.05)
+    assert writer.place(pending) == 1
+    assert order_count(engine) == 1
+
+
+def test_async_timeout_and_cancellation(engine):
+    writer = OrderWriter(engine=engine, window=0.2)
+    cancelled, other, slow = action(), action(), action()
+
+    async def run():
+        first = asyncio.create_task(writer.aplace(cancelled))
+        second = asyncio.create_task(writer.aplace(other))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        assert await second == 1
+        with pytest.raises(OrderPending):
+            await writer.aplace(slow, timeout=0.01)
+        return await writer.aplace(cancelled), await writer.aplace(slow)
+
+    assert asyncio.run(run()) == (1, 1)
+    assert writer._thread.is_alive()
+    # The cancelled turn's order and the timed-out one still commit, once each.
+    assert order_count(engine) == 3
@@ -0,0 +1,51 @@
+from agent.render import render_answer
+
+
+def state(sql_query, columns, *rows, relevance="order", **extra):
+    values = [list(column) for column in zip(*rows)] if rows else [[] for _ in columns]
+    return {"current_user": "amir", "relevance": relevance, "sql_query": sql_query,
+            "query_rows": {"columns": list(columns), "values": values}, **extra}
+
+
+def test_orders_with_food_name_column():
+    answer = render_answer("orders", state(
+        "SELECT f.name AS food_name, f.price FROM orders o JOIN food f ON f.id = o.food_id WHERE o.user_id = 1",
+        ("food_name", "price"), ("Salad", 7.5), ("Ramen", 11.0),
+    ))
+    assert answer == "Hello amir, you have ordered Salad for $7.5 and Ramen for $11.0."
+
+
+def test_bare_name_from_users_is_not_a_dish():
+    assert render_answer("orders", state("SELECT name FROM users WHERE id = 1", ("name",), ("amir",))) is None
+    assert render_answer("menu", state("SELECT name FROM users", ("name",), ("amir",), relevance="menu")) is None
+
+
+def test_bare_name_is_only_a_dish_when_reading_food_alone():
+    joined = "SELECT name, price FROM food JOIN orders ON orders.food_id = food.id WHERE user_id = 1"
+    assert render_answer("orders", state(joined, ("name", "price"), ("Salad", 7.5))) is None
+    menu = render_answer("menu", state("SELECT name, price FROM food", ("name", "price"), ("Salad", 7.5),
+                                       relevance="menu"))
+    assert menu.splitlines()[-1] == "| Salad | $7.5 |"
+
+
+def test_rejected_and_write_answers():
+    rejected = state("", (), order_rejected="I can take at most 20 x Salad in one order.")
+    assert render_answer("rejected", rejected) == "Hello amir, I can take at most 20 x Salad in one order."
+    action = {"user_id": 1, "key": "k", "items": [{"food_id": 1, "food_name": "Salad", "price": 7.5, "quantity": 2}]}
+    placed = state("INSERT INTO orders (food_id, user_id) VALUES (1, 1), (1, 1)", (), order_action=action)
+    assert render_answer("write", placed) == "Hello amir, your order has been placed: 2 x Salad ($7.5); total $15.0."
+
+
+def test_truncated_menu_mentions_the_total():
+    answer = render_answer("menu", state("SELECT name AS food_name FROM food", ("food_name",), ("Salad",),
+                                         relevance="menu", rows_truncated=True, total_rows_estimate=300))
+    assert answer.endswith("_Showing the first 1 of about 300 results._")
+
+
+def test_capped_total_is_shown_as_a_lower_bound():
+    from agent.sql_utils import COUNT_ESTIMATE_CAP
+
+    answer = render_answer("menu", state("SELECT name AS food_name FROM food", ("food_name",), ("Salad",),
+                                         relevance="menu", rows_truncated=True,
+                                         total_rows_estimate=COUNT_ESTIMATE_CAP + 1))
+    assert answer.endswith(f"_Showing the first 1 of more than {COUNT_ESTIMATE_CAP} results._")
@@ -0,0 +1,81 @@
+import time
+from agent.results import ResultCache, result_size
+
+
+def rows(*names):
+    return {"columns": ["name"], "values": [list(names)]}
+
+
+def store(cache, sql, data):
+    cache.set(sql, (data, False, None), cache.versions(sql))
+
+
+def test_hit_returns_a_copy():
+    cache = ResultCache(max_bytes=1 << 20, ttl=0)
+    store(cache, "SELECT name FROM food", rows("Salad"))
+    data, truncated, total = cache.get("select  name from FOOD;")
+    assert data == rows("Salad") and truncated is False and total is None
+    data["values"][0].append("Ramen")
+    assert cache.get("SELECT name FROM food")[0] == rows("Salad")
+    assert cache.stats()["hits"] == 2
+
+
+def test_write_invalidates_tables_it_names():
+    cache = ResultCache(max_bytes=1 << 20, ttl=0)
+    store(cache, "SELECT name FROM food", rows("Salad"))
+    store(cache, "SELECT id FROM users", rows("1"))
+    cache.invalidate("UPDATE food SET price = 3 WHERE id = 1")
+    assert cache.get("SELECT name FROM food") is None
+    assert cache.get("SELECT id FROM users") is not None
+    assert cache.stats()["stale"] == 1
+
+
+def test_write_during_query_makes_result_stale():
+    cache = ResultCache(max_bytes=1 << 20, ttl=0)
+    sql = "SELECT f.name FROM food f JOIN orders o ON o.food_id = f.id"
+    versions = cache.versions(sql)
+    cache.invalidate("INSERT INTO orders (food_id, user_id) VALUES (1, 2)")
+    cache.set(sql, (rows("Salad"), False, None), versions)
+    assert cache.get(sql) is None
+
+
+def test_ttl_expires_entries():
+    cache = ResultCache(max_bytes=1 << 20, ttl=0.01)
+    store(cache, "SELECT name FROM food", rows("Salad"))
+    time.sleep(0.02)
+    assert cache.get("SELECT name FROM food") is None
+
+
+def test_uncacheable_statements():
+    cache = ResultCache(max_bytes=1 << 20, ttl=0)
+    for sql in ("SELECT name FROM food ORDER BY random()", "SELECT 1",
+                "DELETE FROM orders", "SELECT date('now') FROM food"):
+        store(cache, sql, rows("x"))
+        assert cache.get(sql) is None
+    assert cache.stats()["size"] == 0
+
+
+def test_evicts_least_recently_used():
+    size = result_size("select name from t0", rows("Salad"))
+    cache = ResultCache(max_bytes=size * 4 + 1, ttl=0)
+    for i in range(4):
+        store(cache, f"SELECT name FROM t{i}", rows("Salad"))
+    cache.get("SELECT name FROM t0")
+    store(cache, "SELECT name FROM t4", rows("Salad"))
+    assert cache.get("SELECT name FROM t1") is None
+    assert cache.get("SELECT name FROM t0") is not None
+    assert cache.stats()["evictions"] == 1
+    assert cache.bytes <= cache.max_bytes
+
+
+def test_skips_results_too_large_for_the_cache():
+    cache = ResultCache(max_bytes=1024, ttl=0)
+    store(cache, "SELECT name FROM food", rows(*(f"dish {i}" for i in range(100))))
+    assert cache.get("SELECT name FROM food") is None
+    assert cache.stats()["skipped"] == 1
+
+
+def test_disabled_cache():
+    cache = ResultCache(max_bytes=0)
+    store(cache, "SELECT name FROM food", rows("Salad"))
+    assert cache.get("SELECT name FROM food") is None
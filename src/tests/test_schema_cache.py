@@ -0,0 +1,31 @@
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import create_engine, text
+from agent.utils import SchemaCache
+
+
+def test_counters_add_up_under_concurrent_lookups(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'schema.db'}")
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE food (id INTEGER PRIMARY KEY, name TEXT)"))
+    cache = SchemaCache(ttl=0)
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        snapshots = list(pool.map(lambda _: cache.get(engine), range(400)))
+    assert len({id(snapshot) for snapshot in snapshots}) == 1
+    assert cache.stats()["misses"] == 1
+    assert cache.stats()["hits"] == 399
+    engine.dispose()
+
+
+def test_ddl_invalidates_the_snapshot(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'schema.db'}")
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE food (id INTEGER PRIMARY KEY, name TEXT)"))
+    cache = SchemaCache(ttl=0)
+    before = cache.get(engine)
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE orders (id INTEGER PRIMARY KEY, food_id INTEGER)"))
+    after = cache.get(engine)
+    assert after is not before
+    assert "orders" in after.tables
+    assert cache.stats()["invalidations"] == 1
+    engine.dispose()
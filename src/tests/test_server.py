@@ -0,0 +1,138 @@
+import asyncio
+from types import SimpleNamespace
+import pytest
+from fastapi.testclient import TestClient
+import server
+from server import Busy, TurnLimiter, owned_by, turn_config, turn_input
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+async def until(condition):
+    while not condition():
+        await asyncio.sleep(0.001)
+
+
+def test_runs_at_most_max_turns():
+    limiter = TurnLimiter(max_turns=2, max_waiting=10, timeout=5)
+    peak = 0
+
+    async def turn(i):
+        nonlocal peak
+        async with limiter.slot(f"thread-{i}"):
+            peak = max(peak, limiter.running)
+            await asyncio.sleep(0.01)
+
+    async def main():
+        await asyncio.gather(*(turn(i) for i in range(6)))
+
+    run(main())
+    assert peak == 2
+    assert limiter.stats() == {"max_turns": 2, "running": 0, "waiting": 0, "rejected": 0}
+    assert not limiter._thread_locks
+
+
+def test_refuses_when_too_many_are_waiting():
+    limiter = TurnLimiter(max_turns=1, max_waiting=1, timeout=5)
+
+    async def main():
+        release = asyncio.Event()
+
+        async def hold():
+            async with limiter.slot("a"):
+                await release.wait()
+
+        holder = asyncio.create_task(hold())
+        await until(lambda: limiter.running == 1)
+        queued = asyncio.create_task(hold())
+        await until(lambda: limiter.waiting == 1)
+        with pytest.raises(Busy):
+            async with limiter.slot("b"):
+                pass
+        release.set()
+        await asyncio.gather(holder, queued)
+
+    run(main())
+    assert limiter.rejected == 1
+    assert limiter.running == limiter.waiting == 0
+
+
+def test_refuses_after_queue_timeout():
+    limiter = TurnLimiter(max_turns=1, max_waiting=10, timeout=0.05)
+
+    async def main():
+        async with limiter.slot("a"):
+            with pytest.raises(Busy):
+                async with limiter.slot("b"):
+                    pass
+        # The slot is free again once the holder leaves.
+        async with limiter.slot("b"):
+            assert limiter.running == 1
+
+    run(main())
+    assert limiter.rejected == 1
+
+
+def test_one_turn_per_thread():
+    limiter = TurnLimiter(max_turns=4, max_waiting=10, timeout=5)
+    inside = []
+
+    async def turn():
+        async with limiter.slot("same-thread"):
+            inside.append(1)
+            assert len(inside) == 1
+            await asyncio.sleep(0.01)
+            inside.pop()
+
+    async def main():
+        await asyncio.gather(turn(), turn(), turn())
+
+    run(main())
+    assert not limiter._thread_locks
+
+
+def test_first_turn_records_its_owner():
+    assert turn_input("hi", turn_config("t", "2"))["thread_owner"] == "2"
+
+
+@pytest.mark.parametrize("values, user_id, owned", [
+    ({}, "3", True),
+    ({"thread_owner": "2", "current_user_id": 2}, "2", True),
+    ({"thread_owner": "2", "current_user_id": 2}, "3", False),
+    # The user lookup failed, so current_user_id was never set; the thread still belongs to user 2.
+    ({"thread_owner": "2", "current_user": "Error retrieving user"}, "3", False),
+    ({"thread_owner": "2", "current_user": "Error retrieving user"}, "2", True),
+    ({"question": "user: hi"}, "3", False),
+])
+def test_owned_by(values, user_id, owned):
+    assert owned_by(SimpleNamespace(values=values), turn_config("t", user_id)) is owned
+
+
+@pytest.fixture
+def socket(monkeypatch):
+    async def pending_interrupt(config):
+        return None, "checkpoint-1"
+
+    async def stream_events(thread_id, graph_input, config, claim=None):
+        if "fail" in graph_input["question"]:
+            raise RuntimeError("LLM request timed out")
+        yield "final", {"thread_id": thread_id, "status": "done", "answer": "Hello"}
+
+    monkeypatch.setattr(server, "pending_interrupt", pending_interrupt)
+    monkeypatch.setattr(server, "stream_events", stream_events)
+    with TestClient(server.api).websocket_connect("/ws?user_id=2") as ws:
+        yield ws
+
+
+def test_socket_reports_failed_turns_and_stays_open(socket):
+    socket.send_json({"type": "question", "question": "please fail"})
+    assert socket.receive_json() == {"event": "error", "data": {"detail": "LLM request timed out"}}
+    socket.send_json({"type": "question", "question": "show me the menu"})
+    assert socket.receive_json()["event"] == "final"
+
+
+def test_socket_rejects_invalid_answers(socket):
+    socket.send_json({"type": "resume", "answer": "Maybe"})
+    assert socket.receive_json() == {"event": "error", "data": {"detail": "answer must be one of Yes, No"}}
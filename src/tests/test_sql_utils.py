@@ -0,0 +1,77 @@
+import pytest
+from agent.sql_utils import accepts_limit, apply_row_limit, count_query, describe_total, strip_statement, write_targets
+
+
+def test_apply_row_limit_appends_limit():
+    assert apply_row_limit("SELECT * FROM food;", 200) == "SELECT * FROM food LIMIT 200"
+
+
+def test_apply_row_limit_tightens_existing_limit():
+    assert apply_row_limit("SELECT * FROM food LIMIT 500", 200) == "SELECT * FROM food LIMIT 200"
+    assert apply_row_limit("SELECT * FROM food LIMIT 5", 200) == "SELECT * FROM food LIMIT 5"
+    assert apply_row_limit("SELECT * FROM food LIMIT 900 OFFSET 5", 200) == "SELECT * FROM food LIMIT 200 OFFSET 5"
+    assert apply_row_limit("SELECT * FROM food LIMIT 10, 900", 200) == "SELECT * FROM food LIMIT 10, 200"
+
+
+def test_apply_row_limit_ignores_trailing_comment():
+    assert apply_row_limit("SELECT * FROM food -- cheap ones\n", 200) == "SELECT * FROM food LIMIT 200"
+    assert apply_row_limit("SELECT * FROM food /* all */", 200) == "SELECT * FROM food LIMIT 200"
+
+
+def test_apply_row_limit_keeps_comment_markers_inside_strings():
+    sql = "SELECT * FROM food WHERE name = 'a -- b'"
+    assert apply_row_limit(sql, 200) == f"{sql} LIMIT 200"
+
+
+def test_apply_row_limit_only_for_select_and_values():
+    assert apply_row_limit("VALUES (1)", 200) == "VALUES (1) LIMIT 200"
+    assert apply_row_limit("EXPLAIN SELECT * FROM food", 200) == "EXPLAIN SELECT * FROM food"
+    assert not accepts_limit("EXPLAIN QUERY PLAN SELECT 1")
+    assert accepts_limit("WITH cheap AS (SELECT 1) SELECT * FROM cheap")
+
+
+def test_count_query_survives_trailing_comment():
+    sql = count_query("SELECT * FROM food -- cheap ones", cap=10)
+    assert "--" not in sql
+    assert sql == "SELECT COUNT(*) FROM (SELECT 1 FROM (SELECT * FROM food\n) AS bounded LIMIT 11) AS counted"
+
+
+def test_count_query_runs(tmp_path):
+    import sqlite3
+
+    conn = sqlite3.connect(tmp_path / "t.db")
+    conn.execute("CREATE TABLE food (id INTEGER PRIMARY KEY)")
+    conn.executemany("INSERT INTO food (id) VALUES (?)", [(i,) for i in range(30)])
+    assert conn.execute(count_query("SELECT * FROM food -- all of it", cap=10)).fetchone() == (11,)
+    assert conn.execute(count_query("SELECT * FROM food", cap=30)).fetchone() == (30,)
+    assert conn.execute(count_query("SELECT * FROM food;", cap=100)).fetchone() == (30,)
+
+
+def test_describe_total():
+    assert describe_total(30, cap=100) == "about 30"
+    assert describe_total(100, cap=100) == "about 100"
+    assert describe_total(101, cap=100) == "more than 100"
+
+
+def test_strip_statement():
+    assert strip_statement("  SELECT 1 ; -- done") == "SELECT 1"
+
+
+@pytest.mark.parametrize("sql, tables", [
+    ("INSERT INTO orders (food_id, user_id) VALUES (1, 2)", {"orders"}),
+    ("insert or replace into \"Orders\" values (1)", {"orders"}),
+    ("REPLACE INTO food VALUES (1, 'x', 1.0, '')", {"food"}),
+    ("UPDATE OR IGNORE food SET price = 1", {"food"}),
+    ("DELETE FROM main.orders WHERE id = 1", {"orders"}),
+    ("UPDATE main.food SET price = 2", {"food"}),
+    ("WITH old AS (SELECT id FROM orders WHERE id < 5) DELETE FROM orders WHERE id IN (SELECT id FROM old)", {"orders"}),
+    ("WITH cheap AS (SELECT id FROM food) INSERT INTO main.orders (food_id) SELECT id FROM cheap", {"orders"}),
+    ("DROP TABLE IF EXISTS food", {"food"}),
+    ("ALTER TABLE users ADD COLUMN phone TEXT", {"users"}),
+    ("DROP INDEX ix_food_name", set()),
+    ("SELECT * FROM orders WHERE note = 'update food'", set()),
+    ("WITH x AS (SELECT 1) SELECT * FROM x", set()),
+    ("DELETE FROM orders; UPDATE food SET price = 1", {"orders", "food"}),
+])
+def test_write_targets(sql, tables):
+    assert write_targets(sql) == tables
@@ -0,0 +1,78 @@
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+from agent import nodes
+from agent.cache import MISSING, CachedUser, UserCache, user_cache
+from database import database
+from database.models import Base
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'users.db'}")
+    Base.metadata.create_all(engine, tables=[Base.metadata.tables["users"]])
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO users (id, name, age, email) VALUES (1, 'Ada', 36, 'ada@example.com')"))
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def session_local(engine, monkeypatch):
+    monkeypatch.setattr(database, "SessionLocal", sessionmaker(bind=engine), raising=False)
+    user_cache.invalidate()
+    yield
+    user_cache.invalidate()
+
+
+def current_user(user_id):
+    return nodes.get_current_user({}, {"configurable": {"current_user_id": user_id}})
+
+
+def rename(engine, name):
+    with engine.begin() as conn:
+        conn.execute(text("UPDATE users SET name = :name WHERE id = 1"), {"name": name})
+
+
+def test_entry_is_served_until_users_is_written(engine):
+    cache = UserCache()
+    cache.set(1, CachedUser(1, "Ada", "ada@example.com"), cache.version())
+    assert cache.get(1).name == "Ada"
+    rename(engine, "Grace")
+    assert cache.get(1) is MISSING
+    assert cache.stats()["stale"] == 1
+
+
+def test_entry_read_before_a_concurrent_write_is_never_served(engine):
+    cache = UserCache()
+    version = cache.version()
+    # The write lands between reading the version and storing the row.
+    rename(engine, "Grace")
+    cache.set(1, CachedUser(1, "Ada", "ada@example.com"), version)
+    assert cache.get(1) is MISSING
+
+
+def test_writes_to_other_tables_keep_entries(engine):
+    cache = UserCache()
+    cache.set(1, CachedUser(1, "Ada", "ada@example.com"), cache.version())
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE notes (id INTEGER PRIMARY KEY)"))
+        conn.execute(text("INSERT INTO notes (id) VALUES (1)"))
+    assert cache.get(1).name == "Ada"
+
+
+def test_current_user_is_reloaded_after_a_users_write(engine, session_local):
+    assert current_user(1)["current_user"] == "Ada"
+    assert current_user(1)["current_user"] == "Ada"
+    rename(engine, "Grace")
+    state = current_user(1)
+    assert state["current_user"] == "Grace"
+    assert state["current_user_id"] == 1
+
+
+def test_unknown_user_is_cached_until_users_is_written(engine, session_local):
+    assert current_user(2)["current_user"] == "User not found"
+    assert user_cache.get(2) is None
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO users (id, name, age, email) VALUES (2, 'Grace', 45, 'grace@example.com')"))
+    assert current_user(2)["current_user"] == "Grace"
@@ -0,0 +1,50 @@
+import pytest
+from agent.validation import validate_sql
+
+
+def columns(*names):
+    return [{"name": name} for name in names]
+
+
+SCHEMA = {
+    "food": columns("id", "name", "price", "description"),
+    "orders": columns("id", "food_id", "user_id"),
+    "users": columns("id", "name", "email"),
+}
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT name, price FROM food WHERE price < 10 ORDER BY price",
+    "SELECT f.name FROM food f JOIN orders o ON o.food_id = f.id WHERE o.user_id = 2",
+    "SELECT name AS dish, COUNT(*) n FROM food GROUP BY dish ORDER BY n",
+    "WITH cheap AS (SELECT * FROM food WHERE price < 5) SELECT name FROM cheap",
+    "SELECT name FROM food WHERE name = 'salad' COLLATE NOCASE",
+    "SELECT name FROM food ORDER BY name COLLATE nocase DESC",
+    "SELECT * FROM food; -- trailing comment",
+])
+def test_accepts_valid_queries(sql):
+    assert validate_sql(sql, SCHEMA, "menu") is None
+
+
+def test_rejects_unknown_table():
+    assert validate_sql("SELECT * FROM dishes", SCHEMA) == "no such table: dishes"
+
+
+def test_rejects_unknown_column():
+    assert validate_sql("SELECT nme FROM food", SCHEMA) == "no such column: nme"
+    assert validate_sql("SELECT f.nme FROM food f", SCHEMA) == "no such column: f.nme"
+
+
+def test_rejects_empty_and_multiple_statements():
+    assert validate_sql("  ", SCHEMA) == "the SQL query is empty"
+    assert validate_sql("SELECT 1; SELECT 2", SCHEMA) == "only a single SQL statement is allowed"
+
+
+def test_rejects_ddl():
+    assert validate_sql("DROP TABLE food", SCHEMA) == "DROP statements are not allowed"
+
+
+def test_writes_only_for_orders():
+    sql = "INSERT INTO orders (food_id, user_id) VALUES (1, 2)"
+    assert validate_sql(sql, SCHEMA, "order") is None
+    assert validate_sql(sql, SCHEMA, "menu") == "menu questions may only read from the database"